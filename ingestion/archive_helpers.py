@@ -0,0 +1,176 @@
+import io
+import logging
+import mmap
+import shutil
+import struct
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Offset of the file name / extra field lengths in a zip local file header.
+_LOCAL_HEADER_LENGTHS_OFFSET = 26
+
+
+class MappedSlice(io.RawIOBase):
+    """Read-only, seekable file object over a slice of a buffer (e.g. an mmap)."""
+
+    def __init__(self, buffer, offset=0, length=None):
+        view = memoryview(buffer)
+        end = len(view) if length is None else offset + length
+        self._view = view[offset:end]
+        view.release()
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            # Views must be released before the underlying mmap can close.
+            self._view.release()
+        super().close()
+
+
+def list_nested_zips(outer_zip):
+    """List zip members of an archive, skipping __MACOSX and hidden files."""
+    # Filter out __MACOSX and other system files
+    return [
+        name
+        for name in outer_zip.namelist()
+        if name.endswith(".zip")
+        and not name.startswith("__MACOSX")
+        and not "__MACOSX" in name
+        and not name.startswith(".")
+    ]
+
+
+def stored_member_offset(mm, info: zipfile.ZipInfo) -> int:
+    """Byte offset of a member's data, read from its local file header."""
+    name_length, extra_length = struct.unpack_from(
+        "<HH", mm, info.header_offset + _LOCAL_HEADER_LENGTHS_OFFSET
+    )
+    return info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+
+def release_pages(mm, offset, length):
+    """
+    Drop the mapped pages of a finished member from our resident set, so RSS
+    tracks the member being read rather than everything read so far. The data
+    stays in the page cache and faults back in if it is read again.
+    """
+    if not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    start = offset - offset % mmap.PAGESIZE
+    mm.madvise(mmap.MADV_DONTNEED, start, offset + length - start)
+
+
+@contextmanager
+def _nested_source(mm, outer_zip, info, spool_dir=None):
+    """
+    A nested zip of the archive mapped at mm, as a seekable source: a slice of
+    the map if it is stored uncompressed, else spooled to a mapped temp file.
+    """
+    if info.compress_type == zipfile.ZIP_STORED:
+        offset = stored_member_offset(mm, info)
+        source = MappedSlice(mm, offset, info.file_size)
+        try:
+            yield source
+        finally:
+            source.close()
+            release_pages(mm, offset, info.file_size)
+        return
+    with tempfile.TemporaryFile(dir=spool_dir) as spool:
+        with outer_zip.open(info) as member:
+            shutil.copyfileobj(member, spool, 1 << 20)
+        spool.flush()
+        with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as spool_mm:
+            source = MappedSlice(spool_mm)
+            try:
+                yield source
+            finally:
+                source.close()
+
+
+def iter_archives(path, spool_dir=None, skip=None):
+    """
+    Yield (key prefix, zip source) for each archive holding CSVs: the file
+    itself, or each zip nested inside it. Nested zips whose key prefix
+    skip(prefix) is true are passed over without being read.
+
+    The outer archive is memory-mapped. Nested zips that are stored
+    uncompressed are opened in place as a slice of the map, with no copy;
+    compressed ones are streamed to a temporary file and mapped from there.
+    Either way the nested archive bytes are never held in memory.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        outer_source = MappedSlice(mm)
+        try:
+            with zipfile.ZipFile(outer_source) as outer_zip:
+                zip_files = list_nested_zips(outer_zip)
+                if not zip_files:
+                    yield "", path
+                    return
+
+                logger.info(f"Found {len(zip_files)} nested zip files")
+                for nested_zip_name in zip_files:
+                    if skip is not None and skip(f"{nested_zip_name}/"):
+                        logger.info(f"Skipping committed nested zip: {nested_zip_name}")
+                        continue
+                    logger.info(f"Processing nested zip: {nested_zip_name}")
+                    info = outer_zip.getinfo(nested_zip_name)
+                    with _nested_source(mm, outer_zip, info, spool_dir) as source:
+                        yield f"{nested_zip_name}/", source
+        finally:
+            outer_source.close()
+
+
+def list_archives(path) -> list[str]:
+    """Names of the zips nested in the archive at path; empty if it holds CSVs."""
+    with zipfile.ZipFile(path) as outer_zip:
+        return list_nested_zips(outer_zip)
+
+
+@contextmanager
+def open_archive(path, nested_zip_name=None, spool_dir=None):
+    """
+    A zip source for the archive at path, or for one zip nested in it, opened
+    the way iter_archives does. Lets a worker process open its own handle on
+    one nested zip of an archive on disk.
+    """
+    if nested_zip_name is None:
+        yield path
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        outer_source = MappedSlice(mm)
+        try:
+            with zipfile.ZipFile(outer_source) as outer_zip:
+                info = outer_zip.getinfo(nested_zip_name)
+                with _nested_source(mm, outer_zip, info, spool_dir) as source:
+                    yield source
+        finally:
+            outer_source.close()
@@ -0,0 +1,1437 @@
+"""
+Benchmarks for the ingestion pipeline, run against synthetic data.
+
+Usage: python benchmark.py <benchmark> [--rows N]
+"""
+
+import argparse
+import functools
+import http.server
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import h3
+import numpy as np
+import pandas as pd
+
+from archive_helpers import iter_archives, list_nested_zips
+from bs4 import BeautifulSoup
+from bucket_listing import BucketLister, listing_frame, parse_listing_page
+from copy_helpers import COPY_FORMATS, copy_columns, copy_source, copy_sql
+from date_parsing import detect_date_format, parse_dates
+from file_diff import FileSnapshots
+from file_helpers import (
+    compact_frame,
+    create_ride_id_hash,
+    create_ride_id_hashes,
+    expand_frame,
+    list_csv_members,
+    process_all_csvs_from_zip_data,
+    process_archive_file,
+    process_dataframe,
+    stream_csvs_from_zip_data,
+)
+from geo_helpers import (
+    H3CellCache,
+    apply_h3_latlng_to_cell,
+    cells_to_str,
+    latlng_to_cells,
+)
+from instrumentation import RunReport, peak_rss_mb, reset_peak_rss, stage
+from od_aggregates import MONTHLY_TABLE, count_od_pairs
+from od_matrix import ODMatrixIndex
+from ride_dedupe import RideFilter, row_fingerprints
+from ride_keys import RIDE_ID_LOWER, ride_id_labels
+from synthetic_archives import write_archive
+
+logger = logging.getLogger(__name__)
+
+# Rough bounding box of the NYC / Jersey City service area.
+LAT_RANGE = (40.63, 40.88)
+LNG_RANGE = (-74.08, -73.86)
+
+
+def synthetic_trips(n_rows, n_stations=2_000, null_rate=0.001, seed=0):
+    """
+    Build a processed-format trip frame (the output of process_dataframe).
+
+    Trips start and end at a fixed pool of stations like the real data, with a
+    small share of missing end coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    station_lat = rng.uniform(*LAT_RANGE, n_stations).round(6)
+    station_lng = rng.uniform(*LNG_RANGE, n_stations).round(6)
+    start = rng.integers(0, n_stations, n_rows)
+    end = rng.integers(0, n_stations, n_rows)
+
+    end_lat = station_lat[end]
+    end_lng = station_lng[end]
+    missing = rng.random(n_rows) < null_rate
+    end_lat[missing] = np.nan
+    end_lng[missing] = np.nan
+
+    return pd.DataFrame(
+        {
+            "ride_id": [f"{x:016x}" for x in rng.integers(0, 2**63, n_rows).tolist()],
+            "start_date": pd.Timestamp("2024-05-01").date(),
+            "locale": "NYC",
+            "start_lat": station_lat[start],
+            "start_lng": station_lng[start],
+            "end_lat": end_lat,
+            "end_lng": end_lng,
+        }
+    )
+
+
+def apply_h3_latlng_to_cell_rowwise(df_by_file, resolution=9):
+    """The original DataFrame.apply(axis=1) implementation, kept as a reference."""
+    output_obj = {}
+    for key in df_by_file.keys():
+        df_in_loop = df_by_file[key].copy()
+        df_in_loop["h3_cell_start"] = df_in_loop.apply(
+            lambda row: (
+                h3.latlng_to_cell(row["start_lat"], row["start_lng"], resolution)
+                if pd.notnull(row["start_lat"]) and pd.notnull(row["start_lng"])
+                else None
+            ),
+            axis=1,
+        )
+        df_in_loop["h3_cell_end"] = df_in_loop.apply(
+            lambda row: (
+                h3.latlng_to_cell(row["end_lat"], row["end_lng"], resolution)
+                if pd.notnull(row["end_lat"]) and pd.notnull(row["end_lng"])
+                else None
+            ),
+            axis=1,
+        )
+        df_in_loop.drop(
+            columns=["start_lat", "start_lng", "end_lat", "end_lng"], inplace=True
+        )
+        df_in_loop = df_in_loop[~df_in_loop.duplicated(subset=["ride_id"])]
+        output_obj[key] = df_in_loop
+    return output_obj
+
+
+def timed(label, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    logger.info(f"{label:<40} {elapsed:8.2f}s")
+    return result, elapsed
+
+
+def bench_h3(n_rows):
+    df_by_file = {"synthetic.csv": synthetic_trips(n_rows)}
+    batched, batched_s = timed("h3 batched", apply_h3_latlng_to_cell, df_by_file)
+    rowwise, rowwise_s = timed(
+        "h3 row-wise apply", apply_h3_latlng_to_cell_rowwise, df_by_file
+    )
+    pd.testing.assert_frame_equal(
+        batched["synthetic.csv"].reset_index(drop=True),
+        rowwise["synthetic.csv"].reset_index(drop=True),
+    )
+    logger.info(f"h3 speedup: {rowwise_s / batched_s:.1f}x (outputs identical)")
+
+
+def bench_h3_cache(n_rows):
+    df_by_file = {"synthetic.csv": synthetic_trips(n_rows)}
+    cache = H3CellCache()
+    uncached, uncached_s = timed("h3 batched", apply_h3_latlng_to_cell, df_by_file)
+    cold, cold_s = timed(
+        "h3 cached (cold)", apply_h3_latlng_to_cell, df_by_file, cell_cache=cache
+    )
+    warm, warm_s = timed(
+        "h3 cached (warm)", apply_h3_latlng_to_cell, df_by_file, cell_cache=cache
+    )
+    pd.testing.assert_frame_equal(uncached["synthetic.csv"], warm["synthetic.csv"])
+    cache.log_stats()
+    logger.info(
+        f"h3 cache speedup: {uncached_s / cold_s:.1f}x cold, {uncached_s / warm_s:.1f}x warm"
+    )
+
+
+def synthetic_legacy_keys(n_rows, seed=0):
+    """start_time / bike_id columns as they come out of a 2013-2020 CSV."""
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(0, 365 * 24 * 3600, n_rows)
+    start_time = (
+        pd.Timestamp("2016-01-01") + pd.to_timedelta(seconds, unit="s")
+    ).strftime("%Y-%m-%d %H:%M:%S")
+    return pd.DataFrame(
+        {"start_time": start_time, "bike_id": rng.integers(14_000, 40_000, n_rows)}
+    )
+
+
+def bench_ride_id_hash(n_rows, workers=4):
+    keys = synthetic_legacy_keys(n_rows)
+    rowwise, rowwise_s = timed(
+        "ride_id row-wise apply", keys.apply, create_ride_id_hash, axis=1
+    )
+    batched, batched_s = timed(
+        "ride_id batched",
+        create_ride_id_hashes,
+        keys["start_time"],
+        keys["bike_id"],
+    )
+    parallel, parallel_s = timed(
+        f"ride_id batched ({workers} workers)",
+        create_ride_id_hashes,
+        keys["start_time"],
+        keys["bike_id"],
+        workers=workers,
+    )
+    # Hashes must match create_ride_id_hash exactly or upserts stop matching.
+    pd.testing.assert_series_equal(batched, rowwise, check_dtype=False)
+    pd.testing.assert_series_equal(parallel, rowwise, check_dtype=False)
+    logger.info(
+        f"ride_id speedup: {rowwise_s / batched_s:.1f}x, {rowwise_s / parallel_s:.1f}x with {workers} workers (outputs identical)"
+    )
+
+
+def write_nested_archive(path, n_rows, n_members=3, compression=zipfile.ZIP_STORED):
+    """Write a yearly-style archive: an outer zip of monthly zips with one CSV each."""
+    rows_per_member = n_rows // n_members
+    with zipfile.ZipFile(path, "w", compression=compression) as outer:
+        for month in range(1, n_members + 1):
+            trips = synthetic_trips(rows_per_member, seed=month)
+            trips = trips.drop(columns=["start_date", "locale"]).assign(
+                started_at=f"2024-{month:02d}-01 08:00:00"
+            )
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as inner_zip:
+                inner_zip.writestr(
+                    f"2024{month:02d}-citibike-tripdata.csv", trips.to_csv(index=False)
+                )
+            outer.writestr(f"2024{month:02d}-citibike-tripdata.zip", inner.getvalue())
+
+
+def _iter_archives_in_memory(path):
+    """The previous approach: whole outer archive and each nested zip in BytesIO."""
+    with open(path, "rb") as f:
+        content = f.read()
+    outer_zip = zipfile.ZipFile(io.BytesIO(content))
+    for nested_zip_name in list_nested_zips(outer_zip):
+        yield f"{nested_zip_name}/", io.BytesIO(outer_zip.read(nested_zip_name))
+    outer_zip.close()
+
+
+def _nested_zip_peak_rss_mb(mode, path):
+    if mode != "baseline":
+        archives = (
+            _iter_archives_in_memory(path) if mode == "bytesio" else iter_archives(path)
+        )
+        for _, zip_data in archives:
+            for _ in stream_csvs_from_zip_data(zip_data, "NYC", chunksize=100_000):
+                pass
+    return peak_rss_mb()
+
+
+def bench_nested_zip_memory(n_rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "2024-citibike-tripdata.zip")
+        write_nested_archive(path, n_rows)
+        logger.info(f"archive size: {os.path.getsize(path) / 2**20:.0f} MB")
+        # Each mode runs in a fresh process so peak RSS is measured in isolation.
+        ctx = multiprocessing.get_context("spawn")
+        for mode in ["baseline", "bytesio", "mmap"]:
+            with ctx.Pool(1) as pool:
+                start = time.perf_counter()
+                peak = pool.apply(_nested_zip_peak_rss_mb, (mode, path))
+                elapsed = time.perf_counter() - start
+            logger.info(
+                f"nested zip {mode:<10} peak RSS {peak:8.0f} MB {elapsed:8.2f}s"
+            )
+
+
+def _consume_copy_source(df, copy_format, size=8192):
+    """Encode df and read it the way cursor.copy_expert does, in size-byte reads."""
+    source = copy_source(df, copy_format)
+    n_bytes = 0
+    while data := source.read(size):
+        n_bytes += len(data)
+    return n_bytes
+
+
+def _copy_to_postgres(dsn, df, copy_format):
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE bench_ride_data (
+                ride_id varchar, start_date date, locale varchar,
+                h3_cell_start varchar, h3_cell_end varchar
+            ) ON COMMIT DROP
+            """
+        )
+        cur.copy_expert(
+            copy_sql("bench_ride_data", df.columns, copy_format),
+            copy_source(df, copy_format),
+        )
+        conn.rollback()
+
+
+def bench_copy_formats(n_rows):
+    """
+    Rows/sec and peak Python memory of each COPY payload format.
+
+    Without a database the payload is drained by a reader that pulls it in
+    8 KB blocks, like copy_expert writing to the socket. Set BENCH_PG_DSN to
+    also COPY into a temporary table on a real (e.g. local) Postgres.
+    """
+    df = apply_h3_latlng_to_cell({"synthetic.csv": synthetic_trips(n_rows)})[
+        "synthetic.csv"
+    ]
+    dsn = os.environ.get("BENCH_PG_DSN")
+    for copy_format in COPY_FORMATS:
+        n_bytes, elapsed = timed(
+            f"copy {copy_format} encode",
+            _consume_copy_source,
+            df,
+            copy_format,
+        )
+        # tracemalloc slows allocation down a lot, so memory gets its own pass.
+        tracemalloc.start()
+        _consume_copy_source(df, copy_format)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(
+            f"copy {copy_format:<12} {len(df) / elapsed:12,.0f} rows/s "
+            f"{n_bytes / 2**20:8.0f} MB payload {peak / 2**20:8.0f} MB peak"
+        )
+        if dsn:
+            _, elapsed = timed(
+                f"copy {copy_format} to postgres",
+                _copy_to_postgres,
+                dsn,
+                df,
+                copy_format,
+            )
+            logger.info(
+                f"copy {copy_format:<12} {len(df) / elapsed:12,.0f} rows/s (postgres)"
+            )
+
+
+def synthetic_monthly_counts(n_pairs, n_months=12, n_cells=1_500, seed=0):
+    """
+    citi-bike-monthly rows for 2024: n_pairs (cell, cell) counts per month,
+    skewed towards a few busy cells like the real data.
+    """
+    rng = np.random.default_rng(seed)
+    cells, valid = latlng_to_cells(
+        rng.uniform(*LAT_RANGE, n_cells), rng.uniform(*LNG_RANGE, n_cells)
+    )
+    labels = pd.unique(cells_to_str(cells, valid))
+    weights = rng.pareto(1.5, len(labels)) + 1
+    weights /= weights.sum()
+
+    months = []
+    for month in range(1, n_months + 1):
+        start = rng.choice(len(labels), n_pairs, p=weights)
+        end = rng.choice(len(labels), n_pairs, p=weights)
+        pairs = pd.DataFrame({"start": start, "end": end}).drop_duplicates()
+        months.append(
+            pd.DataFrame(
+                {
+                    "h3_cell_start": labels[pairs["start"]],
+                    "h3_cell_end": labels[pairs["end"]],
+                    "date_month": pd.Timestamp(f"2024-{month:02d}-01").date(),
+                    "count": rng.integers(1, 200, len(pairs)),
+                }
+            )
+        )
+    return pd.concat(months, ignore_index=True), labels
+
+
+def _sql_flows(counts, month, cells, group_by, filter_by):
+    """Row-by-row filter of analyze_trip_flows_v3, run by pandas."""
+    rows = counts[
+        (counts["date_month"] == month)
+        & counts[filter_by].isin(cells)
+        & ~(counts["h3_cell_start"].isin(cells) & counts["h3_cell_end"].isin(cells))
+    ]
+    return rows.groupby(group_by)["count"].sum()
+
+
+def _sql_cell_totals(counts, cells, start_month, end_month):
+    """Row-by-row filter of get_h3_cell_monthly_counts ('both'), run by pandas."""
+    rows = counts[
+        (counts["date_month"] >= start_month)
+        & (counts["date_month"] <= end_month)
+        & (counts["h3_cell_start"].isin(cells) | counts["h3_cell_end"].isin(cells))
+    ]
+    return rows.groupby("date_month")["count"].sum()
+
+
+def _pg_query_latency(dsn, counts, queries, repeat=5):
+    """Median latency of each SQL query against the counts loaded into Postgres."""
+    import psycopg2
+
+    latencies = {}
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE bench_monthly (LIKE public.{MONTHLY_TABLE} INCLUDING ALL)
+            """
+        )
+        cur.copy_expert(
+            copy_sql("bench_monthly", counts.columns, "csv"),
+            copy_source(counts, "csv"),
+        )
+        cur.execute("ANALYZE bench_monthly")
+        for label, (sql, params) in queries.items():
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cur.execute(sql, params)
+                cur.fetchall()
+                times.append(time.perf_counter() - start)
+            latencies[label] = float(np.median(times))
+        conn.rollback()
+    return latencies
+
+
+def _median_latency(fn, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def bench_od_matrix(n_rows, n_query_cells=25):
+    """
+    Flow query latency of ODMatrixIndex against the row-by-row filters of the
+    SQL functions, evaluated by pandas on the same rows. Set BENCH_PG_DSN to
+    also time the SQL itself on a local Postgres.
+    """
+    counts, labels = synthetic_monthly_counts(max(n_rows // 12, 1))
+    logger.info(f"{len(counts):,} citi-bike-monthly rows, {len(labels):,} cells")
+    by_month = {month: df for month, df in counts.groupby("date_month")}
+    index = ODMatrixIndex(lambda month: by_month[month], max_months=12)
+
+    rng = np.random.default_rng(1)
+    cells = list(rng.choice(labels, n_query_cells, replace=False))
+    month = pd.Timestamp("2024-06-01").date()
+    first, last = pd.Timestamp("2024-01-01").date(), pd.Timestamp("2024-12-01").date()
+
+    _, build_s = timed(
+        "od matrix build (12 months)", index.monthly_totals, cells, first, last
+    )
+    logger.info(f"od matrix build per month {build_s / 12 * 1000:8.1f} ms")
+
+    # Answers must match the SQL semantics exactly.
+    expected = _sql_flows(counts, month, cells, "h3_cell_end", "h3_cell_start")
+    actual = index.destinations_from(month, cells)
+    pd.testing.assert_series_equal(
+        actual.sort_index(), expected.sort_index(), check_names=False, check_dtype=False
+    )
+    expected = _sql_flows(counts, month, cells, "h3_cell_start", "h3_cell_end")
+    actual = index.origins_to(month, cells)
+    pd.testing.assert_series_equal(
+        actual.sort_index(), expected.sort_index(), check_names=False, check_dtype=False
+    )
+    expected = _sql_cell_totals(counts, cells, first, last)
+    actual = index.monthly_totals(cells, first, last)
+    pd.testing.assert_series_equal(
+        actual, expected, check_names=False, check_dtype=False
+    )
+
+    queries = {
+        "destinations from cells": (
+            lambda: index.destinations_from(month, cells),
+            lambda: _sql_flows(counts, month, cells, "h3_cell_end", "h3_cell_start"),
+        ),
+        "origins to cells": (
+            lambda: index.origins_to(month, cells),
+            lambda: _sql_flows(counts, month, cells, "h3_cell_start", "h3_cell_end"),
+        ),
+        "monthly totals (12 months)": (
+            lambda: index.monthly_totals(cells, first, last),
+            lambda: _sql_cell_totals(counts, cells, first, last),
+        ),
+    }
+    for label, (matrix_query, filter_query) in queries.items():
+        matrix_s = _median_latency(matrix_query)
+        filter_s = _median_latency(filter_query, repeat=5)
+        logger.info(
+            f"{label:<28} matrix {matrix_s * 1000:8.2f} ms  row filter {filter_s * 1000:8.2f} ms  ({filter_s / matrix_s:.0f}x)"
+        )
+
+    dsn = os.environ.get("BENCH_PG_DSN")
+    if dsn:
+        pg = _pg_query_latency(
+            dsn,
+            counts,
+            {
+                "destinations from cells": (
+                    """
+                    SELECT h3_cell_end, SUM(count) FROM bench_monthly
+                    WHERE date_month = %(month)s AND h3_cell_start = ANY(%(cells)s)
+                      AND NOT (h3_cell_start = ANY(%(cells)s) AND h3_cell_end = ANY(%(cells)s))
+                    GROUP BY h3_cell_end
+                    """,
+                    {"month": month, "cells": cells},
+                ),
+                "monthly totals (12 months)": (
+                    """
+                    SELECT date_month, SUM(count) FROM bench_monthly
+                    WHERE date_month >= %(first)s AND date_month <= %(last)s
+                      AND (h3_cell_start = ANY(%(cells)s) OR h3_cell_end = ANY(%(cells)s))
+                    GROUP BY date_month
+                    """,
+                    {"first": first, "last": last, "cells": cells},
+                ),
+            },
+        )
+        for label, seconds in pg.items():
+            logger.info(f"{label:<28} postgres {seconds * 1000:8.2f} ms")
+    logger.info(f"od matrix cache: {index.hits} hits, {index.misses} misses")
+
+
+S3_XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def synthetic_listing(n_keys, page_size=1_000, seed=0):
+    """
+    ListObjectsV2 response pages for a bucket of n_keys trip archives.
+
+    Returns:
+    tuple: (list of XML pages, each page's continuation token)
+    """
+    rng = np.random.default_rng(seed)
+    modified = pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(
+        rng.integers(0, 5 * 365 * 86400, n_keys), unit="s"
+    )
+    sizes = rng.integers(1_000_000, 500_000_000, n_keys)
+    etags = [f"{x:032x}" for x in rng.integers(0, 2**63, n_keys).tolist()]
+
+    pages, tokens = [], []
+    for page_start in range(0, n_keys, page_size):
+        page_end = min(page_start + page_size, n_keys)
+        truncated = page_end < n_keys
+        entries = "".join(
+            f"<Contents><Key>{i:06d}-citibike-tripdata.zip</Key>"
+            f"<LastModified>{modified[i].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<ETag>&quot;{etags[i]}&quot;</ETag><Size>{sizes[i]}</Size>"
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for i in range(page_start, page_end)
+        )
+        next_token = f"token-{page_end}"
+        pages.append(
+            f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="{S3_XMLNS}">'
+            f"<Name>tripdata</Name><KeyCount>{page_end - page_start}</KeyCount>"
+            f"<MaxKeys>{page_size}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>"
+            + (f"<NextContinuationToken>{next_token}</NextContinuationToken>" if truncated else "")
+            + entries
+            + "</ListBucketResult>"
+        )
+        tokens.append(next_token)
+    return pages, tokens
+
+
+def parse_listing_bs4(xml_content):
+    """The previous BeautifulSoup parser of FileDownloader, kept as a reference."""
+    soup = BeautifulSoup(xml_content, "xml")
+    file_data = []
+    for content in soup.find_all("Contents"):
+        key = content.find("Key")
+        last_modified = content.find("LastModified")
+        size = content.find("Size")
+        etag = content.find("ETag")
+        if key:
+            file_data.append(
+                {
+                    "file_name": key.text,
+                    "last_modified": last_modified.text if last_modified else None,
+                    "etag": etag.text.strip('"') if etag else None,
+                    "size_bytes": int(size.text) if size else None,
+                }
+            )
+    df = pd.DataFrame(file_data)
+    df["last_modified"] = pd.to_datetime(df["last_modified"])
+    return df
+
+
+def _serve_listing(pages, tokens):
+    """Serve listing pages over local HTTP, following continuation-token."""
+    page_for_token = {token: i + 1 for i, token in enumerate(tokens)}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            token = query.get("continuation-token", [None])[0]
+            body = pages[page_for_token[token] if token else 0].encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_bucket_listing(n_rows, n_keys=50_000):
+    """
+    Listing parse time for a bucket of n_keys (--rows is ignored): the old
+    BeautifulSoup parser on a single document against iterparse, then the
+    paginated client against a local server.
+    """
+    pages, tokens = synthetic_listing(n_keys)
+    # What the old code saw if the listing came back in one response.
+    single_page = pages[0].split("<Contents>", 1)[0].replace(
+        "<IsTruncated>true</IsTruncated>", "<IsTruncated>false</IsTruncated>"
+    ) + "".join(
+        "<Contents>" + page.split("<Contents>", 1)[1].removesuffix("</ListBucketResult>")
+        for page in pages
+    ) + "</ListBucketResult>"
+
+    old, old_s = timed("listing BeautifulSoup", parse_listing_bs4, single_page)
+    new, new_s = timed(
+        "listing iterparse",
+        lambda: listing_frame(parse_listing_page(single_page)[0]),
+    )
+    pd.testing.assert_frame_equal(new, old, check_dtype=False)
+    logger.info(f"listing parse speedup: {old_s / new_s:.1f}x (outputs identical)")
+
+    server = _serve_listing(pages, tokens)
+    try:
+        lister = BucketLister(f"http://127.0.0.1:{server.server_port}/tripdata/")
+        listed, _ = timed(f"listing paginated ({len(pages)} pages)", lister.list_files)
+    finally:
+        server.shutdown()
+    pd.testing.assert_frame_equal(listed, new)
+    logger.info(f"paginated listing returned all {len(listed):,} keys")
+
+
+def bench_ride_filter(n_rows, changed_share=0.001):
+    """
+    Rows a RideFilter lets through to COPY when a month is loaded, reloaded
+    unchanged, and reloaded with a few rows changed and a few added.
+    """
+    trips = apply_h3_latlng_to_cell({"synthetic.csv": synthetic_trips(n_rows)})
+    df = trips["synthetic.csv"]
+    with tempfile.TemporaryDirectory() as path:
+        ride_filter = RideFilter(path, capacity=max(n_rows * 2, 1_000_000))
+        batch = ride_filter.batch()
+        first, first_s = timed("filter first load", batch.filter, df)
+        _, commit_s = timed("filter commit", batch.commit)
+        _, save_s = timed("filter save", ride_filter.save)
+        assert len(first) == len(df)
+
+        # A fresh instance, as in the next run.
+        ride_filter = RideFilter(path)
+        rerun, rerun_s = timed("filter unchanged reload", ride_filter.batch().filter, df)
+        assert len(rerun) == 0
+
+        rng = np.random.default_rng(1)
+        changed = df.copy()
+        rows = rng.choice(len(df), max(1, int(len(df) * changed_share)), replace=False)
+        changed.iloc[rows, changed.columns.get_loc("h3_cell_end")] = "8f2a100d2c3ffff"
+        added = synthetic_trips(len(rows), seed=2)
+        added = apply_h3_latlng_to_cell({"added.csv": added})["added.csv"]
+        changed = pd.concat([changed, added], ignore_index=True)
+        kept, _ = timed("filter reload with changes", ride_filter.batch().filter, changed)
+        # The exact fallback means nothing new or changed is ever dropped.
+        assert len(kept) == 2 * len(rows), (len(kept), 2 * len(rows))
+
+    logger.info(
+        f"ride filter: {len(df) / first_s:,.0f} rows/s on first load, "
+        f"{len(df) / rerun_s:,.0f} rows/s on reload; "
+        f"{len(kept):,} of {len(changed):,} rows reach COPY after {len(rows):,} "
+        f"changes and {len(rows):,} additions"
+    )
+
+
+def bench_file_diff(n_rows, n_changes=100):
+    """
+    Rows a re-published file sends to the database in diff mode when
+    n_changes rows were edited, n_changes added and n_changes dropped.
+    """
+    df = apply_h3_latlng_to_cell({"synthetic.csv": synthetic_trips(n_rows)})[
+        "synthetic.csv"
+    ]
+    rng = np.random.default_rng(1)
+    edited, dropped = np.split(rng.choice(len(df), 2 * n_changes, replace=False), 2)
+    republished = df.copy()
+    republished.iloc[edited, republished.columns.get_loc("h3_cell_end")] = (
+        "8f2a100d2c3ffff"
+    )
+    added = apply_h3_latlng_to_cell(
+        {"added.csv": synthetic_trips(n_changes, seed=2)}
+    )["added.csv"]
+    republished = pd.concat(
+        [republished.drop(republished.index[dropped]), added], ignore_index=True
+    )
+
+    with tempfile.TemporaryDirectory() as path:
+        snapshots = FileSnapshots(path)
+        first = snapshots.diff("synthetic.zip")
+        _, first_s = timed("diff first load", first.filter, df)
+        _, save_s = timed("diff snapshot save", first.save)
+        size_mb = os.path.getsize(os.path.join(path, "synthetic.zip.npz")) / 1e6
+
+        diff, load_s = timed("diff snapshot load", snapshots.diff, "synthetic.zip")
+        upload, diff_s = timed("diff republished file", diff.filter, republished)
+        removed = diff.removed()
+    assert (diff.inserted, diff.changed, len(removed)) == (n_changes,) * 3
+    assert set(removed["ride_id"]) == set(df["ride_id"].iloc[dropped])
+
+    logger.info(
+        f"file diff: {len(upload):,} of {len(republished):,} rows uploaded and "
+        f"{len(removed):,} deleted instead of a full upsert; snapshot {size_mb:.1f} MB, "
+        f"diff {load_s + diff_s:.2f}s"
+    )
+
+
+def synthetic_start_times(n_rows, seed=0):
+    """Start time columns in each format the archives have used."""
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(0, 365 * 24 * 3600, n_rows)
+    start = pd.Timestamp("2016-01-01") + pd.to_timedelta(seconds, unit="s")
+    millis = pd.Series(rng.integers(0, 1000, n_rows)).map("{:03d}".format)
+    return {
+        "iso": pd.Series(start.strftime("%Y-%m-%d %H:%M:%S")),
+        "iso_fractional": start.strftime("%Y-%m-%d %H:%M:%S.") + millis.to_numpy(),
+        "us_seconds": pd.Series(start.strftime("%-m/%-d/%Y %-H:%M:%S")),
+        "us_minutes": pd.Series(start.strftime("%-m/%-d/%Y %-H:%M")),
+    }
+
+
+def bench_date_parsing(n_rows):
+    """
+    start_date parsing: pandas' inferred to_datetime(...).dt.date against
+    parse_dates with the format detected once per file.
+    """
+    for name, values in synthetic_start_times(n_rows).items():
+        values = pd.Series(values, dtype=object)
+        old, old_s = timed(
+            f"{name} to_datetime .dt.date", lambda v: pd.to_datetime(v).dt.date, values
+        )
+        date_format = detect_date_format(values)
+        new, new_s = timed(f"{name} parse_dates", parse_dates, values, date_format)
+        assert (pd.to_datetime(old).to_numpy() == new).all(), name
+        logger.info(
+            f"{name}: {n_rows / new_s:,.0f} rows/s as {date_format}, "
+            f"{old_s / new_s:.1f}x faster (dates identical)"
+        )
+
+    # A file whose format changes part-way still parses every row.
+    values = synthetic_start_times(n_rows)
+    mixed = pd.concat([values["iso"], values["us_minutes"].iloc[:1000]])
+    parsed = parse_dates(mixed, "iso")
+    assert not np.isnat(parsed).any()
+
+
+def write_published_archive(n_rows):
+    """
+    A monthly archive as published: every column of the current format, and
+    a station list CSV alongside the trips.
+    """
+    trips = synthetic_trips(n_rows)
+    rng = np.random.default_rng(3)
+    published = pd.DataFrame(
+        {
+            "ride_id": trips["ride_id"],
+            "rideable_type": rng.choice(["classic_bike", "electric_bike"], n_rows),
+            "started_at": "2024-05-01 08:00:00.000",
+            "ended_at": "2024-05-01 08:21:13.000",
+            "start_station_name": "W 21 St & 6 Ave",
+            "start_station_id": "6140.05",
+            "end_station_name": "Broadway & E 14 St",
+            "end_station_id": "5905.14",
+            "start_lat": trips["start_lat"],
+            "start_lng": trips["start_lng"],
+            "end_lat": trips["end_lat"],
+            "end_lng": trips["end_lng"],
+            "member_casual": rng.choice(["member", "casual"], n_rows),
+        }
+    )
+    stations = pd.DataFrame(
+        {"station_id": np.arange(n_rows // 10), "name": "W 21 St & 6 Ave"}
+    )
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr("202405-citibike-tripdata.csv", published.to_csv(index=False))
+        zip_ref.writestr("stations.csv", stations.to_csv(index=False))
+    return zip_data.getvalue()
+
+
+def _process_archive_full_read(zip_bytes, locale):
+    """The previous approach: read every CSV in full, then check its columns."""
+    results = {}
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_ref:
+        for member in list_csv_members(zip_ref):
+            with zip_ref.open(member) as csv_file:
+                df = pd.read_csv(csv_file)
+            if "ride_id" in df.columns:
+                results[member] = process_dataframe(df, locale)
+    return results
+
+
+def bench_source_formats(n_rows):
+    """
+    Reading an archive with header sniffing and per-format usecols/dtypes
+    against reading every CSV in full.
+    """
+    zip_bytes = write_published_archive(n_rows)
+    full, full_s = timed(
+        "read every column", _process_archive_full_read, zip_bytes, "NYC"
+    )
+    sniffed, sniffed_s = timed(
+        "read sniffed columns",
+        process_all_csvs_from_zip_data,
+        io.BytesIO(zip_bytes),
+        "NYC",
+    )
+    assert list(full) == list(sniffed)
+    for key in full:
+        pd.testing.assert_frame_equal(full[key], sniffed[key])
+    logger.info(
+        f"source formats speedup: {full_s / sniffed_s:.1f}x (outputs identical, "
+        f"station list skipped from its header)"
+    )
+
+
+def _traced_mb(fn, *args, **kwargs):
+    """Result of fn and the MB it allocated that are still alive afterwards."""
+    tracemalloc.start()
+    result = fn(*args, **kwargs)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 2**20
+
+
+def bench_integer_cells(n_rows):
+    """
+    The pipeline stages after H3 assignment with cells as hex strings and as
+    int64 (H3_INTEGER_CELLS=1): frame memory, pickling (as between parse
+    workers and uploaders), OD counts, fingerprints and COPY encoding, whose
+    payloads must match.
+    """
+    trips = {"synthetic.csv": synthetic_trips(n_rows)}
+    frames = {}
+    for mode, integer_cells in (("str", False), ("int", True)):
+        output, _ = timed(
+            f"h3 assign ({mode})",
+            apply_h3_latlng_to_cell,
+            trips,
+            integer_cells=integer_cells,
+        )
+        df = output["synthetic.csv"]
+        _, frame_mb = _traced_mb(
+            apply_h3_latlng_to_cell, trips, integer_cells=integer_cells
+        )
+        payload, pickle_s = timed(f"pickle ({mode})", pickle.dumps, df)
+        timed(f"count_od_pairs ({mode})", count_od_pairs, df)
+        timed(f"row_fingerprints ({mode})", row_fingerprints, df)
+        logger.info(
+            f"cells {mode}: {frame_mb / n_rows * 1e6:6.0f} MB per 1M rows, "
+            f"pickled {len(payload) / 2**20:.0f} MB in {pickle_s:.2f}s"
+        )
+        frames[mode] = df
+
+    pd.testing.assert_series_equal(
+        count_od_pairs(frames["str"]), count_od_pairs(frames["int"])
+    )
+    assert (row_fingerprints(frames["str"]) == row_fingerprints(frames["int"])).all()
+    for copy_format in COPY_FORMATS:
+        for mode, df in frames.items():
+            timed(
+                f"copy {copy_format} encode ({mode})",
+                _consume_copy_source,
+                df,
+                copy_format,
+            )
+        encoded = [copy_source(df, copy_format).read() for df in frames.values()]
+        assert encoded[0] == encoded[1], copy_format
+    logger.info("integer cells: OD counts, fingerprints and COPY payloads identical")
+
+
+def _upsert_to_postgres(dsn, df, copy_format):
+    """COPY df to a staging table and upsert it into ride_data twice, as new
+    rows and then as conflicting ones, in a transaction that is rolled back."""
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE bench_ride_data (
+                ride_id varchar NOT NULL, start_date date NOT NULL, locale varchar,
+                h3_cell_start varchar, h3_cell_end varchar,
+                UNIQUE (ride_id, start_date, locale)
+            ) ON COMMIT DROP
+            """
+        )
+        columns = ", ".join(copy_columns(df))
+        for _ in range(2):
+            cur.execute(
+                "CREATE TEMP TABLE bench_staging (LIKE bench_ride_data) ON COMMIT DROP"
+            )
+            cur.copy_expert(
+                copy_sql("bench_staging", copy_columns(df), copy_format),
+                copy_source(df, copy_format),
+            )
+            cur.execute(
+                f"""
+                INSERT INTO bench_ride_data ({columns})
+                SELECT {columns} FROM bench_staging
+                ON CONFLICT (ride_id, start_date, locale)
+                DO UPDATE SET h3_cell_start = EXCLUDED.h3_cell_start,
+                    h3_cell_end = EXCLUDED.h3_cell_end
+                """
+            )
+            cur.execute("DROP TABLE bench_staging")
+        conn.rollback()
+
+
+def bench_compact_ride_ids(n_rows):
+    """
+    ride_ids as strings and as 64-bit keys (COMPACT_RIDE_IDS=1): memory per
+    1M rows, dedupe, fingerprints and COPY encoding, whose payloads must
+    match, and with BENCH_PG_DSN the upsert of each COPY format.
+    """
+    trips = synthetic_trips(n_rows)
+    # Published ride_ids are uppercase, legacy hashes lowercase.
+    trips_upper = trips.assign(ride_id=trips["ride_id"].str.upper())
+    dsn = os.environ.get("BENCH_PG_DSN")
+    for case, df_in in (("lower", trips), ("upper", trips_upper)):
+        frames = {}
+        for mode, compact in (("str", False), ("key", True)):
+            output, _ = timed(
+                f"h3 assign + dedupe ({case}, {mode})",
+                apply_h3_latlng_to_cell,
+                {"synthetic.csv": df_in},
+                compact_ride_ids=compact,
+            )
+            df = output["synthetic.csv"]
+            ride_id_mb = (
+                df[["ride_id", *([RIDE_ID_LOWER] if compact else [])]]
+                .memory_usage(deep=True, index=False)
+                .sum()
+                / 2**20
+            )
+            frame_mb = df.memory_usage(deep=True, index=False).sum() / 2**20
+            logger.info(
+                f"ride_id {case} {mode}: {ride_id_mb / len(df) * 1e6:5.0f} MB per 1M "
+                f"rows ({frame_mb / len(df) * 1e6:.0f} MB for the whole frame)"
+            )
+            timed(
+                f"duplicated ({case}, {mode})",
+                df.duplicated,
+                subset=["ride_id", *([RIDE_ID_LOWER] if compact else [])],
+            )
+            timed(f"row_fingerprints ({case}, {mode})", row_fingerprints, df)
+            payload, _ = timed(f"pickle ({case}, {mode})", pickle.dumps, df)
+            logger.info(f"pickled {len(payload) / len(df) * 1e6 / 2**20:.0f} MB per 1M rows")
+            frames[mode] = df
+
+        assert frames["key"]["ride_id"].dtype != object
+        assert (ride_id_labels(frames["key"]) == frames["str"]["ride_id"]).all()
+        assert (row_fingerprints(frames["str"]) == row_fingerprints(frames["key"])).all()
+        for copy_format in COPY_FORMATS:
+            for mode, df in frames.items():
+                timed(
+                    f"copy {copy_format} encode ({case}, {mode})",
+                    _consume_copy_source,
+                    df,
+                    copy_format,
+                )
+            encoded = [copy_source(df, copy_format).read() for df in frames.values()]
+            assert encoded[0] == encoded[1], copy_format
+            if dsn:
+                for mode, df in frames.items():
+                    _, elapsed = timed(
+                        f"upsert {copy_format} ({case}, {mode})",
+                        _upsert_to_postgres,
+                        dsn,
+                        df,
+                        copy_format,
+                    )
+                    logger.info(
+                        f"upsert {copy_format:<12} {mode} "
+                        f"{2 * len(df) / elapsed:12,.0f} rows/s (postgres)"
+                    )
+    logger.info("compact ride_ids: strings, fingerprints and COPY payloads identical")
+
+
+# Processes for the parallel run of bench_archive_members.
+MEMBER_WORKERS = 4
+
+
+def bench_archive_members(n_rows):
+    """
+    A yearly archive of monthly nested zips parsed one member after another
+    and on a process pool (ARCHIVE_MEMBER_WORKERS), whose outputs must
+    match, plus what a frame costs to send back from a worker pickled whole
+    and as compact arrays.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path, _ = write_archive(
+            tmp, n_rows=n_rows, month=1, nested=True, n_months=12
+        )
+        serial, serial_s = timed(
+            "members serial", process_archive_file, str(path), path.name, "NYC"
+        )
+        parallel, parallel_s = timed(
+            f"members on {MEMBER_WORKERS} processes",
+            process_archive_file,
+            str(path),
+            path.name,
+            "NYC",
+            member_workers=MEMBER_WORKERS,
+        )
+    assert list(serial) == list(parallel)
+    for key in serial:
+        pd.testing.assert_frame_equal(serial[key], parallel[key])
+    logger.info(
+        f"archive members speedup: {serial_s / parallel_s:.1f}x on "
+        f"{os.cpu_count()} CPUs (outputs identical)"
+    )
+
+    # Workers pickle their frames and the main process unpickles them.
+    df = pd.concat(serial.values(), ignore_index=True)
+    for name, obj, load in (
+        ("frame", df, pickle.loads),
+        ("compact", compact_frame(df), lambda data: expand_frame(pickle.loads(data))),
+    ):
+        payload, dump_s = timed(f"worker pickle ({name})", pickle.dumps, obj)
+        _, load_s = timed(f"main unpickle ({name})", load, payload)
+        logger.info(
+            f"{name}: {len(payload) / len(df) * 1e6 / 2**20:.0f} MB, "
+            f"{dump_s / len(df) * 1e6:.2f}s in the worker and "
+            f"{load_s / len(df) * 1e6:.2f}s in the main process per 1M rows"
+        )
+
+
+# Archives of the end-to-end suite, one per layout and packaging the
+# pipeline has to handle. Each gets --rows rows.
+E2E_SCENARIOS = {
+    "current_nyc": {"layout": "current", "locale": "NYC"},
+    "current_jc": {"layout": "current", "locale": "JC"},
+    "legacy_lower_nested": {
+        "layout": "legacy_lower",
+        "year": 2015,
+        "nested": True,
+        "time_format": "us_seconds",
+    },
+    "legacy_lower_jc": {
+        "layout": "legacy_lower",
+        "locale": "JC",
+        "year": 2015,
+        "time_format": "us_minutes",
+    },
+    "legacy_title_nyc": {"layout": "legacy_title", "year": 2018},
+}
+E2E_DUPLICATE_RATE = 0.001
+
+# BikeShareProcessor configurations run against BENCH_PG_DSN.
+E2E_PROCESSOR_MODES = {
+    "chunk": {},
+    "file": {"upload_mode": "file"},
+    "file_stream": {"upload_mode": "file", "stream_chunk_size": 100_000},
+    "file_od": {"upload_mode": "file", "aggregate_od": True},
+}
+
+BASELINE_PATH = Path(__file__).with_name("benchmark_baseline.json")
+# Rates may drop, and peak RSS grow, by this share before counting as a regression.
+BASELINE_TOLERANCE = 0.2
+# Peak RSS changes smaller than this are noise, as are the rates of
+# stages that took less than this many seconds in the baseline.
+BASELINE_MIN_RSS_MB = 50
+BASELINE_MIN_SECONDS = 0.5
+
+E2E_SCHEMA = "bench_e2e"
+
+
+def _run_e2e_stages(path, locale, n_rides):
+    """Every stage up to COPY on one archive; run in a fresh process per archive."""
+    report = RunReport()
+    file_name = Path(path).name
+    with report.file(file_name) as stats:
+        df_by_file = process_archive_file(path, file_name, locale)
+        output = apply_h3_latlng_to_cell(df_by_file)
+        for df in output.values():
+            with stage("copy_encode", rows=len(df)) as encode:
+                encode.bytes = _consume_copy_source(df, "csv")
+        stats.rows = sum(len(df) for df in output.values())
+    assert stats.rows == n_rides, f"{file_name}: {stats.rows} rows, {n_rides} rides"
+    return report.as_dict()["files"][0]
+
+
+def _create_e2e_schema(dsn, months):
+    """A ride_data partitioned like the production one, in its own schema."""
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {E2E_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {E2E_SCHEMA}")
+        # As in the schema migration: only the parent generates ids, and the
+        # partitions are created on their own with a plain id, then attached.
+        cur.execute(
+            f"""
+            CREATE TABLE {E2E_SCHEMA}.ride_data (
+                id bigint NOT NULL,
+                created_at timestamp with time zone DEFAULT now() NOT NULL,
+                ride_id varchar NOT NULL,
+                start_date date NOT NULL,
+                locale varchar,
+                h3_cell_start varchar,
+                h3_cell_end varchar,
+                PRIMARY KEY (id, start_date),
+                UNIQUE (ride_id, locale, start_date)
+            ) PARTITION BY RANGE (start_date)
+            """
+        )
+        cur.execute(
+            f"""
+            ALTER TABLE {E2E_SCHEMA}.ride_data
+            ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY
+            """
+        )
+        for month in months:
+            partition = f"{E2E_SCHEMA}.ride_data_{month:%Y_%m}"
+            cur.execute(
+                f"""
+                CREATE TABLE {partition} (
+                    id bigint NOT NULL,
+                    created_at timestamp with time zone DEFAULT now() NOT NULL,
+                    ride_id varchar NOT NULL,
+                    start_date date NOT NULL,
+                    locale varchar,
+                    h3_cell_start varchar,
+                    h3_cell_end varchar,
+                    PRIMARY KEY (id, start_date),
+                    UNIQUE (ride_id, locale, start_date)
+                )
+                """
+            )
+            cur.execute(
+                f"""
+                ALTER TABLE {E2E_SCHEMA}.ride_data ATTACH PARTITION {partition}
+                FOR VALUES FROM (%s) TO (%s)
+                """,
+                (month.date(), (month + pd.DateOffset(months=1)).date()),
+            )
+        # What AGGREGATE_OD keeps up to date, also as in the migration.
+        cur.execute(
+            f"""
+            CREATE TABLE {E2E_SCHEMA}."citi-bike-monthly" (
+                id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                created_at timestamp with time zone DEFAULT now() NOT NULL,
+                h3_cell_start varchar,
+                h3_cell_end varchar,
+                date_month date,
+                count integer DEFAULT 0,
+                CONSTRAINT unique_by_month UNIQUE (h3_cell_start, h3_cell_end, date_month)
+            )
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE MATERIALIZED VIEW {E2E_SCHEMA}.monthly_totals AS
+            SELECT date_month, sum(count) AS total_count
+            FROM {E2E_SCHEMA}."citi-bike-monthly"
+            WHERE date_month IS NOT NULL
+            GROUP BY date_month
+            WITH NO DATA
+            """
+        )
+        # For CHECKPOINTS=1, as in the ingest_checkpoints migration.
+        cur.execute(
+            f"""
+            CREATE TABLE {E2E_SCHEMA}.ingest_checkpoints (
+                file_name text NOT NULL,
+                locale text NOT NULL,
+                member text NOT NULL,
+                version text NOT NULL,
+                chunks integer DEFAULT 0 NOT NULL,
+                rows bigint DEFAULT 0 NOT NULL,
+                complete boolean DEFAULT false NOT NULL,
+                updated_at timestamp with time zone DEFAULT now() NOT NULL,
+                PRIMARY KEY (file_name, locale, member)
+            )
+            """
+        )
+    conn.close()
+
+
+def _drop_e2e_schema(dsn):
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {E2E_SCHEMA} CASCADE")
+    conn.close()
+
+
+def _count_e2e_rows(dsn):
+    """
+    Rows in the bench ride_data, and how many (cell pair, month) counts of
+    citi-bike-monthly differ from a full recount of it. Both are emptied.
+    """
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {E2E_SCHEMA}.ride_data")
+        n_rows = cur.fetchone()[0]
+        cur.execute(
+            f"""
+            SELECT count(*)
+            FROM (
+                SELECT h3_cell_start, h3_cell_end,
+                       date_trunc('month', start_date)::date AS date_month,
+                       count(*)::integer AS count
+                FROM {E2E_SCHEMA}.ride_data
+                WHERE h3_cell_start IS NOT NULL AND h3_cell_end IS NOT NULL
+                GROUP BY 1, 2, 3
+            ) recount
+            FULL JOIN {E2E_SCHEMA}."citi-bike-monthly" m
+                USING (h3_cell_start, h3_cell_end, date_month)
+            WHERE recount.count IS DISTINCT FROM m.count
+            """
+        )
+        od_mismatches = cur.fetchone()[0]
+        cur.execute(f'TRUNCATE {E2E_SCHEMA}.ride_data, {E2E_SCHEMA}."citi-bike-monthly"')
+    conn.close()
+    return n_rows, od_mismatches
+
+
+class _ManifestSink:
+    """Stands in for ManifestWriter, whose upserts go to the Supabase REST API."""
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, file, row_count=None):
+        self.records.append((file["file_name"], row_count))
+
+    def flush(self):
+        pass
+
+
+class _QuietFileHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _run_e2e_processor(dsn, archive_dir, files, n_rides, options):
+    """
+    The full BikeShareProcessor flow over every archive: download from a
+    local HTTP server, parse, H3, COPY and upsert into the bench schema.
+    """
+    from processor import BikeShareProcessor
+
+    handler = functools.partial(_QuietFileHandler, directory=archive_dir)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        processor = BikeShareProcessor(
+            conn_details={"dsn": dsn, "options": f"-c search_path={E2E_SCHEMA}"},
+            supabase_client=None,
+            **options,
+        )
+        processor.download_cache.base_url = f"http://127.0.0.1:{server.server_port}/"
+        processor.manifest_writer = _ManifestSink()
+        reset_peak_rss()
+        start = time.perf_counter()
+        processor.process_files_df(files)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    report = processor.run_report.as_dict()
+    failed = [file["file_name"] for file in report["files"] if file["status"] != "ok"]
+    assert not failed, f"files failed: {failed}"
+    n_rows, od_mismatches = _count_e2e_rows(dsn)
+    assert n_rows == n_rides, f"{n_rows} rows in ride_data, {n_rides} rides"
+    if options.get("aggregate_od"):
+        assert not od_mismatches, f"{od_mismatches} wrong citi-bike-monthly counts"
+    return {
+        "wall_seconds": round(elapsed, 3),
+        "rows": n_rows,
+        "rows_per_second": round(n_rows / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": report["stages"],
+    }
+
+
+def _e2e_metrics(name, result) -> dict:
+    """Flatten a run into the "<name>/<stage>" rates and peak RSS kept in baselines."""
+    metrics = {
+        f"{name}/total": {
+            "seconds": result["wall_seconds"],
+            "rows_per_second": result["rows_per_second"],
+            "peak_rss_mb": result["peak_rss_mb"],
+        }
+    }
+    for stage_name, totals in result["stages"].items():
+        if totals["rows_per_second"]:
+            metrics[f"{name}/{stage_name}"] = {
+                "seconds": totals["seconds"],
+                "rows_per_second": totals["rows_per_second"],
+            }
+    return metrics
+
+
+def compare_with_baseline(metrics, baseline) -> list[str]:
+    """Log each metric against the baseline and return the regressions."""
+    regressions = []
+    for key, values in metrics.items():
+        if key not in baseline:
+            logger.info(f"{key:<40} (not in baseline)")
+            continue
+        old_rate = baseline[key]["rows_per_second"]
+        rate = values["rows_per_second"]
+        line = f"{key:<40} {rate:12,.0f} rows/s ({rate / old_rate - 1:+6.0%})"
+        if (
+            rate < old_rate * (1 - BASELINE_TOLERANCE)
+            and baseline[key]["seconds"] >= BASELINE_MIN_SECONDS
+        ):
+            regressions.append(f"{key} rows/s {old_rate:,.0f} -> {rate:,.0f}")
+        if "peak_rss_mb" in values and "peak_rss_mb" in baseline[key]:
+            old_rss, rss = baseline[key]["peak_rss_mb"], values["peak_rss_mb"]
+            line += f" {rss:8.0f} MB ({rss - old_rss:+.0f})"
+            if (
+                rss > old_rss * (1 + BASELINE_TOLERANCE)
+                and rss - old_rss > BASELINE_MIN_RSS_MB
+            ):
+                regressions.append(f"{key} peak RSS {old_rss:.0f} -> {rss:.0f} MB")
+        logger.info(line)
+    return regressions
+
+
+def bench_end_to_end(n_rows):
+    """
+    Every pipeline stage on generated archives of each layout, and with
+    BENCH_PG_DSN set, the full BikeShareProcessor flow into a local
+    Postgres in each upload mode.
+
+    Rows/s per stage and peak RSS are compared with the baseline at
+    BENCH_BASELINE (benchmark_baseline.json by default), and the run fails
+    if any got worse by more than BASELINE_TOLERANCE (stages shorter than
+    BASELINE_MIN_SECONDS are only logged). Set
+    BENCH_SAVE_BASELINE=1 to store this run as the new baseline instead.
+    Baselines are only comparable on the same machine and --rows.
+    """
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        n_rides = 0
+        months = set()
+        for seed, (name, options) in enumerate(E2E_SCENARIOS.items()):
+            path, rides = write_archive(
+                tmp,
+                n_rows=n_rows,
+                duplicate_rate=E2E_DUPLICATE_RATE,
+                seed=seed,
+                **options,
+            )
+            locale = options.get("locale", "NYC")
+            files.append(
+                {"file_name": path.name, "locale": locale, "last_modified": seed}
+            )
+            n_rides += rides
+            first_month = options.get("month", 5)
+            n_months = options.get("n_months", 3) if options.get("nested") else 1
+            for month in range(first_month, first_month + n_months):
+                months.add(pd.Timestamp(options.get("year", 2024), month, 1))
+
+            # Each archive runs in a fresh process so peak RSS is its own.
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(1) as pool:
+                result = pool.apply(_run_e2e_stages, (str(path), locale, rides))
+            logger.info(
+                f"{name:<20} {result['rows_per_second']:12,.0f} rows/s "
+                f"{result['peak_rss_mb']:8.0f} MB peak RSS"
+            )
+            metrics.update(_e2e_metrics(name, result))
+
+        dsn = os.environ.get("BENCH_PG_DSN")
+        if dsn:
+            _create_e2e_schema(dsn, sorted(months))
+            try:
+                for mode, options in E2E_PROCESSOR_MODES.items():
+                    result = _run_e2e_processor(
+                        dsn, tmp, pd.DataFrame(files), n_rides, options
+                    )
+                    logger.info(
+                        f"processor {mode:<10} {result['rows_per_second']:12,.0f} rows/s "
+                        f"{result['peak_rss_mb']:8.0f} MB peak RSS"
+                    )
+                    metrics.update(_e2e_metrics(f"processor_{mode}", result))
+            finally:
+                _drop_e2e_schema(dsn)
+        else:
+            logger.info("Set BENCH_PG_DSN to also run BikeShareProcessor end to end")
+
+    baseline_path = Path(os.environ.get("BENCH_BASELINE", BASELINE_PATH))
+    if os.environ.get("BENCH_SAVE_BASELINE") == "1":
+        with open(baseline_path, "w") as f:
+            json.dump({"rows": n_rows, "metrics": metrics}, f, indent=2)
+        logger.info(f"Saved baseline to {baseline_path}")
+        return
+    if not baseline_path.exists():
+        logger.info(f"No baseline at {baseline_path}; BENCH_SAVE_BASELINE=1 stores one")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["rows"] != n_rows:
+        logger.warning(
+            f"Baseline was run with --rows {baseline['rows']}, not {n_rows}: skipping comparison"
+        )
+        return
+    regressions = compare_with_baseline(metrics, baseline["metrics"])
+    if regressions:
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        raise SystemExit(f"{len(regressions)} regressions against {baseline_path}")
+    logger.info(f"No regressions against {baseline_path}")
+
+
+BENCHMARKS = {
+    "h3": bench_h3,
+    "h3_cache": bench_h3_cache,
+    "ride_id_hash": bench_ride_id_hash,
+    "nested_zip_memory": bench_nested_zip_memory,
+    "copy_formats": bench_copy_formats,
+    "od_matrix": bench_od_matrix,
+    "bucket_listing": bench_bucket_listing,
+    "ride_filter": bench_ride_filter,
+    "file_diff": bench_file_diff,
+    "date_parsing": bench_date_parsing,
+    "source_formats": bench_source_formats,
+    "integer_cells": bench_integer_cells,
+    "archive_members": bench_archive_members,
+    "compact_ride_ids": bench_compact_ride_ids,
+    "end_to_end": bench_end_to_end,
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=[*BENCHMARKS, "all"])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    for name in names:
+        logger.info(f"--- {name} ({args.rows:,} rows) ---")
+        BENCHMARKS[name](args.rows)
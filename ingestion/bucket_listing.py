@@ -0,0 +1,138 @@
+import io
+import logging
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Fields of each <Contents> entry we keep, and the column they become.
+LISTING_FIELDS = {
+    "Key": "file_name",
+    "LastModified": "last_modified",
+    "ETag": "etag",
+    "Size": "size_bytes",
+}
+
+# Page-level fields used to follow the listing.
+PAGE_FIELDS = {"IsTruncated", "NextContinuationToken", "KeyCount"}
+
+
+def _local_name(tag: str) -> str:
+    # S3 responses are namespaced: "{http://s3.amazonaws.com/doc/2006-03-01/}Key"
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_listing_page(source) -> tuple[dict[str, list], dict[str, str]]:
+    """
+    Parse one bucket listing page with a streaming iterparse.
+
+    Each <Contents> element is read and then cleared, so memory does not grow
+    with the tree, and no DOM is ever built.
+
+    Parameters:
+    source: bytes, str, or a binary file-like object (e.g. a response stream)
+
+    Returns:
+    tuple: (column lists keyed by LISTING_FIELDS values, PAGE_FIELDS values)
+    """
+    if isinstance(source, str):
+        source = source.encode()
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    columns = {column: [] for column in LISTING_FIELDS.values()}
+    page = {}
+    for _, elem in ET.iterparse(source, events=("end",)):
+        name = _local_name(elem.tag)
+        if name == "Contents":
+            # Its children are complete once the element ends.
+            entry = {_local_name(child.tag): child.text for child in elem}
+            if entry.get("Key"):
+                for field, column in LISTING_FIELDS.items():
+                    columns[column].append(entry.get(field))
+            elem.clear()
+        elif name in PAGE_FIELDS:
+            page[name] = elem.text
+    return columns, page
+
+
+def listing_frame(columns: dict[str, list]) -> pd.DataFrame:
+    """Typed frame of listing entries: file_name, last_modified (UTC), etag, size_bytes."""
+    return pd.DataFrame(
+        {
+            "file_name": pd.Series(columns["file_name"], dtype=object),
+            "last_modified": pd.to_datetime(
+                pd.Series(columns["last_modified"], dtype=object),
+                utc=True,
+                format="ISO8601",
+            ),
+            "etag": pd.Series(
+                [etag.strip('"') if etag else None for etag in columns["etag"]],
+                dtype=object,
+            ),
+            "size_bytes": pd.to_numeric(
+                pd.Series(columns["size_bytes"], dtype=object)
+            ).astype("Int64"),
+        }
+    )
+
+
+class BucketLister:
+    """
+    Lists every key of a public S3 bucket.
+
+    S3 returns at most 1000 keys per response, so pages are followed with
+    ListObjectsV2 continuation tokens (or start-after the last key when the
+    server does not send one) until the listing is no longer truncated. Each
+    response is parsed straight from the network stream.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "https://s3.amazonaws.com/tripdata/",
+        max_keys: int = 1000,
+        timeout: int = 30,
+        session: requests.Session | None = None,
+    ):
+        self.base_url = base_url
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def iter_pages(self):
+        """Yield the column lists of each listing page."""
+        params = {"list-type": "2", "max-keys": str(self.max_keys)}
+        n_pages = 0
+        while True:
+            with self.session.get(
+                self.base_url, params=params, stream=True, timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                columns, page = parse_listing_page(response.raw)
+            n_pages += 1
+            yield columns
+
+            if page.get("IsTruncated", "false").lower() != "true":
+                break
+            params.pop("continuation-token", None)
+            params.pop("start-after", None)
+            if page.get("NextContinuationToken"):
+                params["continuation-token"] = page["NextContinuationToken"]
+            elif columns["file_name"]:
+                params["start-after"] = columns["file_name"][-1]
+            else:
+                raise ValueError(
+                    f"Truncated listing page {n_pages} from {self.base_url} has no continuation token"
+                )
+        logger.info(f"Listed {self.base_url} in {n_pages} pages")
+
+    def list_files(self) -> pd.DataFrame:
+        """All keys in the bucket as a listing_frame."""
+        columns = {column: [] for column in LISTING_FIELDS.values()}
+        for page_columns in self.iter_pages():
+            for column, values in page_columns.items():
+                columns[column].extend(values)
+        return listing_frame(columns)
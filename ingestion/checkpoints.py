@@ -0,0 +1,183 @@
+import logging
+
+import pandas as pd
+
+from download_cache import file_version
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_TABLE = "ingest_checkpoints"
+# member of the row marking the whole file as done.
+FILE_MEMBER = ""
+
+
+class CheckpointStore:
+    """
+    Committed progress through files that are streamed in chunks, kept in
+    the ingest_checkpoints table next to ride_data.
+
+    Each CSV member of a file has a row counting the chunks and rows of it
+    that have been uploaded; nested zips, and the file itself, get a row once
+    every member in them is done. Rows are tied to the file version (ETag or
+    last_modified), so a re-published file starts over.
+    """
+
+    def __init__(self, table=CHECKPOINTS_TABLE):
+        self.table = table
+
+    def load(self, conn, file: pd.Series) -> "FileCheckpoint":
+        """The file's checkpoint, discarding progress on an older version of it."""
+        version = file_version(file.get("etag"), file.get("last_modified"))
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                DELETE FROM {self.table}
+                WHERE file_name = %s AND locale = %s AND version <> %s
+                """,
+                (file["file_name"], file["locale"], version),
+            )
+            if cur.rowcount:
+                logger.info(
+                    f"Discarded checkpoints of an older version of {file['file_name']}"
+                )
+            cur.execute(
+                f"""
+                SELECT member, chunks, rows, complete FROM {self.table}
+                WHERE file_name = %s AND locale = %s
+                """,
+                (file["file_name"], file["locale"]),
+            )
+            members = {
+                member: {"chunks": chunks, "rows": rows, "complete": complete}
+                for member, chunks, rows, complete in cur.fetchall()
+            }
+        conn.commit()
+        return FileCheckpoint(
+            conn, self.table, file["file_name"], file["locale"], version, members
+        )
+
+
+class FileCheckpoint:
+    """
+    Progress through one file version. Members are keyed like the output of
+    process_archive_file: "<nested zip>/<csv key>", or the CSV key alone for
+    a flat archive; a nested zip itself is "<nested zip>/".
+
+    record_chunk() runs in the transaction that upserts a chunk's rows, so
+    the rows a checkpoint counts are exactly those ride_data holds.
+    """
+
+    def __init__(self, conn, table, file_name, locale, version, members):
+        self.conn = conn
+        self.table = table
+        self.file_name = file_name
+        self.locale = locale
+        self.version = version
+        self.members = members
+        # Members that failed in this run; the file is not complete until
+        # a later run gets through them.
+        self.failed = []
+
+    @property
+    def complete(self) -> bool:
+        return self.members.get(FILE_MEMBER, {}).get("complete", False)
+
+    @property
+    def rows(self) -> int:
+        """Rows committed so far, across every CSV member."""
+        return sum(
+            progress["rows"]
+            for member, progress in self.members.items()
+            if member != FILE_MEMBER and not member.endswith("/")
+        )
+
+    def archive_done(self, prefix) -> bool:
+        """Whether every member of a nested zip ("<name>/") has been committed."""
+        return self.members.get(prefix, {}).get("complete", False)
+
+    def resume_points(self, prefix="") -> dict[str, int | None]:
+        """
+        CSV key within the archive at prefix -> rows of it already committed,
+        or None for members that are done, for stream_csvs_from_zip_data.
+        """
+        points = {}
+        for member, progress in self.members.items():
+            if not member.startswith(prefix) or member.endswith("/"):
+                continue
+            key = member[len(prefix) :]
+            if not key or "/" in key:
+                continue
+            points[key] = None if progress["complete"] else progress["rows"]
+        return points
+
+    def member_callback(self, prefix=""):
+        """on_member_done for stream_csvs_from_zip_data on the archive at prefix."""
+
+        def on_member_done(key, error):
+            if error is None:
+                self.complete_member(f"{prefix}{key}")
+            else:
+                self.failed.append(f"{prefix}{key or ''}")
+
+        return on_member_done
+
+    def finish_archive(self, prefix):
+        """Mark a nested zip as done, unless one of its members failed."""
+        if prefix and not any(member.startswith(prefix) for member in self.failed):
+            self.complete_member(prefix)
+
+    def finish(self) -> bool:
+        """Mark the file as done if no member failed. Returns whether it is."""
+        if self.failed:
+            logger.info(
+                f"{self.file_name}: {len(self.failed)} members failed, "
+                "resuming them next run"
+            )
+            return False
+        self.complete_file()
+        return True
+
+    def record_chunk(self, cur, member, rows):
+        """Count a chunk of member on cur, committed by the caller with its rows."""
+        self._upsert(member, chunks=1, rows=rows, cur=cur)
+
+    def complete_member(self, member):
+        """Mark a CSV member or nested zip as done."""
+        self._upsert(member, complete=True)
+
+    def complete_file(self):
+        self._upsert(FILE_MEMBER, complete=True)
+
+    def _upsert(self, member, chunks=0, rows=0, complete=False, cur=None):
+        if cur is None:
+            with self.conn.cursor() as cur:
+                self._upsert(member, chunks, rows, complete, cur)
+            self.conn.commit()
+            return
+        cur.execute(
+            f"""
+            INSERT INTO {self.table}
+                (file_name, locale, member, version, chunks, rows, complete)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (file_name, locale, member) DO UPDATE SET
+                chunks = {self.table}.chunks + EXCLUDED.chunks,
+                rows = {self.table}.rows + EXCLUDED.rows,
+                complete = {self.table}.complete OR EXCLUDED.complete,
+                updated_at = now()
+            """,
+            (
+                self.file_name,
+                self.locale,
+                member,
+                self.version,
+                chunks,
+                rows,
+                complete,
+            ),
+        )
+        progress = self.members.setdefault(
+            member, {"chunks": 0, "rows": 0, "complete": False}
+        )
+        progress["chunks"] += chunks
+        progress["rows"] += rows
+        progress["complete"] |= complete
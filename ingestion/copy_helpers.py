@@ -0,0 +1,197 @@
+import io
+import struct
+
+import numpy as np
+import pandas as pd
+
+from geo_helpers import H3_NULL, cell_labels, is_integer_cells
+from ride_keys import (
+    RIDE_ID_LENGTH,
+    RIDE_ID_LOWER,
+    has_compact_ride_ids,
+    ride_id_digits,
+    with_ride_id_labels,
+)
+
+# Rows encoded per batch. Only one batch of encoded bytes is alive at a time.
+COPY_BATCH_ROWS = 10_000
+
+# Postgres types of the ride_data columns we load; anything else is sent as text.
+# "h3" columns are text in the database but may hold int64 cells in memory,
+# and "ride_id" compact keys (ride_keys.py), whose case column is not sent.
+RIDE_DATA_COPY_TYPES = {
+    "ride_id": "ride_id",
+    "start_date": "date",
+    "h3_cell_start": "h3",
+    "h3_cell_end": "h3",
+}
+
+COPY_FORMATS = ("csv", "text_stream", "binary")
+
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack("!h", -1)
+_NULL_FIELD = struct.pack("!i", -1)
+_PG_EPOCH = np.datetime64("2000-01-01", "D")
+
+
+class CopyStream(io.RawIOBase):
+    """
+    File-like adapter over an iterator of byte blocks, for cursor.copy_expert.
+
+    COPY pulls data with read(size), so blocks are produced on demand and the
+    full payload never exists in memory at once.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = memoryview(b"")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._block):
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._block = memoryview(block)
+            self._pos = 0
+        n = min(len(b), len(self._block) - self._pos)
+        b[:n] = self._block[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+
+def copy_columns(df: pd.DataFrame) -> list[str]:
+    """The columns of df that copy_source sends."""
+    return [col for col in df.columns if col != RIDE_ID_LOWER]
+
+
+def copy_sql(table_name, columns, copy_format):
+    """COPY ... FROM STDIN statement matching the payload of copy_format."""
+    column_list = ", ".join(columns)
+    if copy_format == "binary":
+        return f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT binary)"
+    return f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')"
+
+
+def copy_source(df: pd.DataFrame, copy_format, column_types=RIDE_DATA_COPY_TYPES):
+    """File-like object holding df in the given COPY format."""
+    if copy_format in ("csv", "text_stream"):
+        df = _with_labels(df, column_types)
+    if copy_format == "csv":
+        # The original path: the whole chunk as one in-memory string.
+        output = io.StringIO()
+        df.to_csv(output, sep="\t", header=False, index=False, na_rep="\\N")
+        output.seek(0)
+        return output
+    if copy_format == "text_stream":
+        return CopyStream(iter_text_copy(df))
+    if copy_format == "binary":
+        return CopyStream(iter_binary_copy(df, column_types))
+    raise ValueError(
+        f"Unknown COPY format {copy_format}, expected one of {COPY_FORMATS}"
+    )
+
+
+def _with_labels(df: pd.DataFrame, column_types) -> pd.DataFrame:
+    """df with any integer "h3" / "ride_id" columns formatted as the strings to store."""
+    if column_types.get("ride_id") == "ride_id":
+        df = with_ride_id_labels(df)
+    labels = {
+        col: cell_labels(df[col])
+        for col in df.columns
+        if column_types.get(col) == "h3" and is_integer_cells(df[col])
+    }
+    return df.assign(**labels) if labels else df
+
+
+def iter_text_copy(df: pd.DataFrame, batch_rows=COPY_BATCH_ROWS):
+    """Yield df as tab-separated COPY text, one encoded batch of rows at a time."""
+    for i in range(0, len(df), batch_rows):
+        yield df.iloc[i : i + batch_rows].to_csv(
+            sep="\t", header=False, index=False, na_rep="\\N"
+        ).encode()
+
+
+def iter_binary_copy(
+    df: pd.DataFrame, column_types=RIDE_DATA_COPY_TYPES, batch_rows=COPY_BATCH_ROWS
+):
+    """
+    Yield df in PostgreSQL binary COPY format.
+
+    Every row is a 16-bit field count followed by (32-bit length, bytes) per
+    field, so Postgres skips text parsing entirely on the server.
+    """
+    yield _PGCOPY_HEADER
+    columns = copy_columns(df)
+    field_count = struct.pack("!h", len(columns))
+    compact_ride_ids = has_compact_ride_ids(df)
+    for i in range(0, len(df), batch_rows):
+        batch = df.iloc[i : i + batch_rows]
+        fields = [
+            (
+                _encode_ride_ids(batch)
+                if compact_ride_ids and column_types.get(col) == "ride_id"
+                else _encode_column(batch[col], column_types.get(col, "text"))
+            )
+            for col in columns
+        ]
+        yield b"".join(
+            [field_count + b"".join(row_fields) for row_fields in zip(*fields)]
+        )
+    yield _PGCOPY_TRAILER
+
+
+def _encode_column(series: pd.Series, pg_type) -> list[bytes]:
+    """Length-prefixed binary fields for one column."""
+    if pg_type == "date":
+        dates = pd.to_datetime(series).to_numpy().astype("datetime64[D]")
+        isnull = np.isnat(dates)
+        # Each field is an int32 length of 4 followed by days since 2000-01-01.
+        packed = np.empty(len(dates), dtype=[("length", ">i4"), ("days", ">i4")])
+        packed["length"] = 4
+        packed["days"] = (dates - _PG_EPOCH).astype(np.int64)
+        raw = packed.tobytes()
+        return [
+            _NULL_FIELD if null else raw[8 * j : 8 * j + 8]
+            for j, null in enumerate(isnull.tolist())
+        ]
+    if pg_type == "h3" and is_integer_cells(series):
+        # Encode each distinct cell once; a chunk holds a few thousand.
+        codes, cells = pd.factorize(series.to_numpy(np.int64))
+        pack_length = struct.Struct("!i").pack
+        fields = []
+        for cell in cells.tolist():
+            if cell == H3_NULL:
+                fields.append(_NULL_FIELD)
+            else:
+                label = format(cell, "x").encode()
+                fields.append(pack_length(len(label)) + label)
+        return [fields[code] for code in codes.tolist()]
+    if pg_type in ("text", "h3", "ride_id"):
+        pack_length = struct.Struct("!i").pack
+        values = series.astype(object).where(series.notna(), None).tolist()
+        encoded = []
+        for value in values:
+            if value is None:
+                encoded.append(_NULL_FIELD)
+            else:
+                data = str(value).encode()
+                encoded.append(pack_length(len(data)) + data)
+        return encoded
+    raise ValueError(f"No binary COPY encoder for type {pg_type}")
+
+
+def _encode_ride_ids(df: pd.DataFrame) -> list[bytes]:
+    """Length-prefixed binary fields for the compact ride_ids of df."""
+    # Every field is the same length, so they are built as one array.
+    width = 4 + RIDE_ID_LENGTH
+    packed = np.empty((len(df), width), dtype=np.uint8)
+    packed[:, :4] = np.frombuffer(struct.pack("!i", RIDE_ID_LENGTH), np.uint8)
+    packed[:, 4:] = ride_id_digits(
+        df["ride_id"].to_numpy(), df[RIDE_ID_LOWER].to_numpy()
+    )
+    raw = packed.tobytes()
+    return [raw[width * j : width * j + width] for j in range(len(df))]
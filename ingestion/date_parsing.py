@@ -0,0 +1,172 @@
+import logging
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import record
+
+logger = logging.getLogger(__name__)
+
+# Start time formats seen across the Citi Bike archives, tried in order.
+# Each maps to the regex every value of that format fully matches, and the
+# format of its date part (None: ISO, which numpy parses directly).
+DATE_FORMATS = {
+    # 2014-01-01 00:00:06, 2016-01-01 00:00:41.0000, 2021-02-01 00:00:00.123
+    "iso": (
+        re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"),
+        None,
+    ),
+    # 1/1/2015 0:01:26
+    "us_seconds": (
+        re.compile(r"\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}:\d{2}"),
+        "%m/%d/%Y",
+    ),
+    # 1/1/2015 0:01
+    "us_minutes": (
+        re.compile(r"\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}"),
+        "%m/%d/%Y",
+    ),
+}
+
+DETECT_SAMPLE_SIZE = 1_000
+# Every supported format has its date within the first 10 characters.
+PREFIX_LENGTH = 10
+
+
+def detect_date_format(values, sample_size=DETECT_SAMPLE_SIZE) -> str | None:
+    """
+    Name of the DATE_FORMATS entry matching the most of a sample of values,
+    or None if none matches any of them.
+    """
+    sample = pd.Series(values).dropna()
+    sample = sample.iloc[:sample_size].astype(str).str.strip().tolist()
+    best, best_matches = None, 0
+    for name, (pattern, _) in DATE_FORMATS.items():
+        matches = sum(1 for value in sample if pattern.fullmatch(value))
+        if matches > best_matches:
+            best, best_matches = name, matches
+    if best is not None and best_matches < len(sample):
+        logger.info(
+            f"Date format {best} matches {best_matches} of {len(sample)} sampled values"
+        )
+    return best
+
+
+def _factorize_prefixes(prefixes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """pd.factorize of an S10 array, done on two uint64 words per value."""
+    padded = np.zeros((len(prefixes), 16), dtype=np.uint8)
+    padded[:, :PREFIX_LENGTH] = prefixes.view(np.uint8).reshape(-1, PREFIX_LENGTH)
+    words = padded.view(np.uint64)
+    high, high_uniques = pd.factorize(words[:, 0])
+    low, low_uniques = pd.factorize(words[:, 1])
+    codes, pairs = pd.factorize(high.astype(np.int64) * len(low_uniques) + low)
+    # Any row of each code will do as its representative.
+    rows = np.zeros(len(pairs), dtype=np.int64)
+    rows[codes] = np.arange(len(codes))
+    return codes, prefixes[rows]
+
+
+# Offsets of the digits in a "YYYY-MM-DD" prefix.
+_ISO_DIGIT_OFFSETS = [0, 1, 2, 3, 5, 6, 8, 9]
+
+
+def _parse_iso_days(prefixes: np.ndarray) -> np.ndarray:
+    """
+    datetime64[D] of "YYYY-MM-DD" S10 prefixes, NaT where one is not a valid
+    date. Worked out from the bytes rather than with astype("datetime64[D]"),
+    which with numpy 2.3 can crash the process on a bad value instead of
+    raising.
+    """
+    chars = prefixes.view(np.uint8).reshape(-1, PREFIX_LENGTH)
+    digits = chars[:, _ISO_DIGIT_OFFSETS].astype(np.int64) - ord("0")
+    valid = (
+        ((digits >= 0) & (digits <= 9)).all(axis=1)
+        & (chars[:, 4] == ord("-"))
+        & (chars[:, 7] == ord("-"))
+    )
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + np.where(valid, day - 1, 0)
+    # Days past the end of their month (2021-02-30) roll into the next one.
+    valid &= days.astype("datetime64[M]") == months
+    days[~valid] = np.datetime64("NaT")
+    return days
+
+
+def _parse_prefix_days(prefixes: np.ndarray, day_format) -> np.ndarray:
+    # A file spans a few hundred days, so each distinct prefix is parsed once.
+    codes, uniques = _factorize_prefixes(prefixes)
+    day_strings = pd.Series(uniques.astype(str)).str.split(" ", n=1).str[0]
+    days = (
+        pd.to_datetime(day_strings, format=day_format, errors="coerce")
+        .to_numpy()
+        .astype("datetime64[D]")
+    )
+    return days[codes]
+
+
+def parse_dates(values, date_format=None) -> np.ndarray:
+    """
+    Parse start times to datetime64[D] days.
+
+    Only the first 10 characters of each value are read: ISO dates are
+    decoded from their bytes in bulk, other formats are parsed once per
+    distinct date. Values the format does not parse are retried with pandas'
+    per-element "mixed" parser, and remain NaT only if that fails as well.
+
+    Parameters:
+    values (array-like): Timestamps as strings
+    date_format (str): DATE_FORMATS name, usually from detect_date_format
+        on the file's first chunk; detected from values when None
+
+    Returns:
+    np.ndarray: datetime64[D] days aligned with values
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy().astype("datetime64[D]")
+
+    start = time.perf_counter()
+    if date_format is None:
+        date_format = detect_date_format(values)
+
+    raw = values.to_numpy(dtype=object)
+    missing = pd.isna(raw)
+    if missing.any():
+        raw = np.where(missing, "", raw)
+    days = None
+    try:
+        prefixes = raw.astype(f"S{PREFIX_LENGTH}")
+    except UnicodeEncodeError:
+        prefixes = None
+    if prefixes is not None and date_format is not None:
+        day_format = DATE_FORMATS[date_format][1]
+        if day_format is None:
+            days = _parse_iso_days(prefixes)
+        else:
+            days = _parse_prefix_days(prefixes, day_format)
+    if days is None:
+        days = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+
+    failed = np.isnat(days) & ~missing
+    n_failed = int(failed.sum())
+    if n_failed:
+        days[failed] = (
+            pd.to_datetime(values[failed], format="mixed", errors="coerce")
+            .to_numpy()
+            .astype("datetime64[D]")
+        )
+
+    elapsed = time.perf_counter() - start
+    record("date_parse", elapsed, rows=len(values))
+    rate = len(values) / elapsed if elapsed else float("inf")
+    logger.info(
+        f"Parsed {len(values)} dates as {date_format} in {elapsed:.2f}s "
+        f"({rate:,.0f} rows/s), {n_failed} by fallback"
+    )
+    return days
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of warm psycopg2 connections.
+
+    Connections are opened lazily and reused across files, so the TLS
+    handshake to the hosted database is paid once per connection rather than
+    once per file. A connection that has been idle for a while is checked with
+    a cheap query before it is handed out, and replaced only if that fails.
+    Each borrower gets a connection to itself; when all max_connections are
+    in use, borrowers wait for one to be returned.
+    """
+
+    def __init__(
+        self,
+        conn_details,
+        max_connections: int = 4,
+        health_check_interval: float = 30.0,
+    ):
+        self.conn_details = conn_details
+        self.health_check_interval = health_check_interval
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        # (connection, time it was returned); the most recently used is last.
+        self._idle = []
+        self.connections_opened = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of the block.
+
+        An open transaction is rolled back when the block raises or forgets to
+        commit, so the next borrower always starts clean.
+        """
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if conn.closed:
+                continue
+            if time.monotonic() - returned_at < self.health_check_interval:
+                return conn
+            if self._is_alive(conn):
+                return conn
+            logger.info("Discarding dead database connection")
+            conn.close()
+        return self._connect()
+
+    def _checkin(self, conn):
+        if conn.closed:
+            return
+        try:
+            if (
+                conn.get_transaction_status()
+                != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            ):
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        start = time.perf_counter()
+        conn = psycopg2.connect(**self.conn_details)
+        with self._lock:
+            self.connections_opened += 1
+            opened = self.connections_opened
+        logger.info(
+            f"Opened database connection in {time.perf_counter() - start:.2f}s ({opened} opened this run)"
+        )
+        return conn
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """
+    Local, content-addressed cache of trip archives.
+
+    Entries are keyed by file name plus the S3 ETag (or last_modified when no
+    ETag is known), so a re-published file gets a new entry while re-runs of an
+    unchanged file never touch the network. Downloads stream to disk in chunks
+    and resume interrupted transfers with an HTTP Range request.
+
+    With max_bytes, least recently used entries are deleted once the cache
+    grows past it, except those still in use: every fetch() holds its entry
+    until the matching release(). max_bytes=0 deletes each archive as soon
+    as it is released.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        base_url: str = "https://s3.amazonaws.com/tripdata/",
+        chunk_size: int = 1 << 20,
+        timeout: int = 30,
+        max_bytes: int | None = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._in_use: dict[Path, int] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, file_name: str, version: str) -> Path:
+        digest = hashlib.sha256(f"{file_name}:{version}".encode()).hexdigest()[:16]
+        return self.cache_dir / f"{digest}-{Path(file_name).name}"
+
+    def fetch(self, file_name: str, etag=None, last_modified=None) -> Path:
+        """
+        Return a local path to the file, downloading it only if needed.
+
+        Parameters:
+        file_name (str): Key of the file in the bucket
+        etag (str): S3 ETag from the bucket listing
+        last_modified: Last modified timestamp from the bucket listing
+
+        Returns:
+        Path: Path to the complete file on disk, kept until release(path)
+        """
+        etag = _clean_etag(etag)
+        version = file_version(etag, last_modified)
+        path = self.path_for(file_name, version)
+        with self._lock:
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+        try:
+            if version and path.exists():
+                logger.info(f"Using cached download of {file_name}: {path}")
+                # Eviction goes by modification time.
+                os.utime(path)
+                return path
+
+            self._download(self.base_url + file_name, path, etag)
+            if etag and not _etag_matches(path, etag):
+                path.unlink()
+                raise ValueError(f"Downloaded {file_name} does not match ETag {etag}")
+        except Exception:
+            self.release(path)
+            raise
+        self._prune_stale(path)
+        self._evict()
+        return path
+
+    def release(self, path: Path):
+        """Mark a fetched file as no longer in use, letting it be evicted."""
+        with self._lock:
+            remaining = self._in_use.pop(path, 0) - 1
+            if remaining > 0:
+                self._in_use[path] = remaining
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries not in use beyond max_bytes."""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.iterdir():
+                if path.name.endswith(".part"):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+                if total <= self.max_bytes:
+                    break
+                if path in self._in_use:
+                    continue
+                logger.info(f"Evicting cached download {path}")
+                path.unlink(missing_ok=True)
+                total -= size
+
+    def _download(self, url: str, path: Path, etag=None):
+        part_path = path.with_name(path.name + ".part")
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            # Only resume if the remote file is still the one we started on.
+            if etag:
+                headers["If-Range"] = f'"{etag}"'
+
+        with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                # The partial file is already complete.
+                pass
+            else:
+                r.raise_for_status()
+                if offset and r.status_code == 206:
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                    mode = "ab"
+                else:
+                    logger.info(f"Downloading {url} to {path}")
+                    mode = "wb"
+                with open(part_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+
+        part_path.replace(path)
+
+    def _prune_stale(self, path: Path):
+        """Remove older versions of the same file."""
+        suffix = path.name.split("-", 1)[1]
+        # The glob also matches names that merely end in this one, such as
+        # JC-202510-citibike-tripdata.zip for 202510-citibike-tripdata.zip.
+        for other in self.cache_dir.glob(f"*-{suffix}"):
+            if other != path and other.name.split("-", 1)[1] == suffix:
+                logger.info(f"Removing stale cached download {other}")
+                other.unlink()
+
+
+def file_version(etag=None, last_modified=None) -> str:
+    """The S3 ETag of a file, or its last_modified when no ETag is known."""
+    etag = _clean_etag(etag)
+    return etag or (str(last_modified) if pd.notnull(last_modified) else "")
+
+
+def _clean_etag(etag):
+    if etag is None or pd.isnull(etag) or etag == "":
+        return None
+    return str(etag).strip('"')
+
+
+def _etag_matches(path: Path, etag: str) -> bool:
+    # Multipart uploads have ETags like "<md5>-<parts>" that are not a plain
+    # MD5 of the content, so only single-part ETags can be verified.
+    if "-" in etag:
+        return True
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest() == etag
@@ -0,0 +1,174 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ride_dedupe import (
+    day_numbers,
+    fingerprints_by_month,
+    isin_sorted,
+    key_fingerprints,
+    row_fingerprints,
+)
+from ride_keys import ride_id_bytes
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ARRAYS = ("ride_id", "start_day", "locale", "key_fp", "row_fp")
+# Snapshots are written uncompressed: fingerprints do not compress, and
+# zlib would cost more time than the diff itself.
+
+
+class FileSnapshots:
+    """
+    Per source file, the keys and fingerprints of the rows last loaded from
+    it, one .npz per file (about 40 bytes per row). diff() compares a reprocessed file
+    against its snapshot so only the rows that differ are uploaded.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _snapshot_path(self, file_name: str) -> Path:
+        return self.path / f"{Path(file_name).name}.npz"
+
+    def diff(self, file_name: str) -> "FileDiff":
+        path = self._snapshot_path(file_name)
+        previous = None
+        if path.exists():
+            with np.load(path) as data:
+                previous = {name: data[name] for name in SNAPSHOT_ARRAYS}
+        return FileDiff(self, file_name, previous)
+
+    def save(self, file_name: str, arrays: dict[str, np.ndarray]):
+        path = self._snapshot_path(file_name)
+        # Write under a temporary name so an interrupted save keeps the old snapshot.
+        tmp_path = path.with_name(f".{path.name}.tmp.npz")
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+
+class FileDiff:
+    """
+    Row-level diff of one file against its previous snapshot.
+
+    filter() passes on inserted and changed rows and drops the unchanged
+    ones, keeping every row's key for the new snapshot. Once all of the file
+    has been filtered, removed() gives the keys of rows the file no longer
+    contains, to be deleted in the same transaction. Without a previous
+    snapshot every row counts as inserted and nothing is removed.
+    """
+
+    def __init__(self, snapshots: FileSnapshots, file_name: str, previous):
+        self.snapshots = snapshots
+        self.file_name = file_name
+        self.previous = previous
+        if previous is not None:
+            self._previous_rows = np.sort(previous["row_fp"])
+            self._previous_keys = np.sort(previous["key_fp"])
+        self._parts = []
+        self._removed = None
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def filter(self, df: pd.DataFrame) -> pd.DataFrame:
+        if len(df) == 0:
+            return df
+        days = day_numbers(df["start_date"])
+        keys = key_fingerprints(df, days)
+        rows = row_fingerprints(df, days, keys)
+        self._parts.append(
+            {
+                "ride_id": ride_id_bytes(df),
+                "start_day": days,
+                "locale": df["locale"].to_numpy().astype("S"),
+                "key_fp": keys,
+                "row_fp": rows,
+            }
+        )
+        if self.previous is None:
+            self.inserted += len(df)
+            return df
+
+        unchanged = isin_sorted(rows, self._previous_rows)
+        existing = isin_sorted(keys[~unchanged], self._previous_keys)
+        self.unchanged += int(unchanged.sum())
+        self.changed += int(existing.sum())
+        self.inserted += int((~existing).sum())
+        return df[~unchanged]
+
+    def filter_output(self, output_obj) -> dict[str, pd.DataFrame]:
+        """filter() every frame, leaving out frames with nothing left to load."""
+        filtered = {}
+        for key, df in output_obj.items():
+            df = self.filter(df)
+            if len(df):
+                filtered[key] = df
+        return filtered
+
+    def _current(self) -> dict[str, np.ndarray]:
+        if not self._parts:
+            return {
+                "ride_id": np.empty(0, dtype="S1"),
+                "start_day": np.empty(0, dtype=np.int64),
+                "locale": np.empty(0, dtype="S1"),
+                "key_fp": np.empty(0, dtype=np.uint64),
+                "row_fp": np.empty(0, dtype=np.uint64),
+            }
+        return {
+            name: np.concatenate([part[name] for part in self._parts])
+            for name in SNAPSHOT_ARRAYS
+        }
+
+    def _removed_mask(self) -> np.ndarray:
+        if self._removed is None:
+            if self.previous is None:
+                self._removed = np.zeros(0, dtype=bool)
+            else:
+                current_keys = np.sort(self._current()["key_fp"])
+                self._removed = ~isin_sorted(self.previous["key_fp"], current_keys)
+        return self._removed
+
+    def removed(self) -> pd.DataFrame:
+        """ride_data keys of rows loaded from the file before but not present now."""
+        if self.previous is None:
+            return pd.DataFrame(columns=["ride_id", "start_date", "locale"])
+        mask = self._removed_mask()
+        return pd.DataFrame(
+            {
+                "ride_id": self.previous["ride_id"][mask].astype(str).astype(object),
+                "start_date": pd.Series(
+                    self.previous["start_day"][mask].astype("datetime64[D]")
+                ).dt.date,
+                "locale": self.previous["locale"][mask].astype(str).astype(object),
+            }
+        )
+
+    def stale_fingerprints(self) -> dict[str, np.ndarray]:
+        """
+        Fingerprints, by RideFilter month, of previously loaded rows that are
+        no longer in ride_data as they were: removed rows and the old
+        versions of changed ones.
+        """
+        if self.previous is None:
+            return {}
+        current_rows = np.sort(self._current()["row_fp"])
+        stale = ~isin_sorted(self.previous["row_fp"], current_rows)
+        return fingerprints_by_month(
+            self.previous["row_fp"][stale],
+            self.previous["locale"][stale].astype(str).astype(object),
+            self.previous["start_day"][stale],
+        )
+
+    def save(self):
+        """Replace the file's snapshot with what was filtered; call after commit."""
+        n_removed = int(self._removed_mask().sum())
+        logger.info(
+            f"[{self.file_name}] {self.inserted} rows inserted, {self.changed} changed, "
+            f"{n_removed} removed, {self.unchanged} unchanged"
+        )
+        self.snapshots.save(self.file_name, self._current())
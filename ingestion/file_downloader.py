@@ -1,6 +1,18 @@
-import requests
+import logging
+
 import pandas as pd
-from bs4 import BeautifulSoup
+
+from bucket_listing import BucketLister, listing_frame, parse_listing_page
+from file_manifest import (
+    CHANGED,
+    NEW,
+    TOUCHED,
+    ManifestWriter,
+    classify_files,
+    fetch_manifest,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class FileDownloader:
@@ -21,11 +33,18 @@ class FileDownloader:
         prev_files = self.get_prev_processed_files()
         # Files live on the website.
         live_files = self.get_live_files()
-        # Get new files which have not been processed. The difference between the two.
-        new_files = self.get_new_files(live_files, prev_files)
-        new_files["locale"] = new_files["file_name"].apply(
+        live_files["locale"] = live_files["file_name"].apply(
             lambda x: "JC" if x.startswith("JC") else "NYC"
         )
+        files = classify_files(live_files, prev_files)
+        counts = files["change"].value_counts()
+        logger.info(
+            "Live files: "
+            + ", ".join(f"{counts.get(c, 0)} {c}" for c in counts.index.sort_values())
+        )
+        self.record_touched_files(files[files["change"] == TOUCHED], prev_files)
+        # Get new files which have not been processed. The difference between the two.
+        new_files = files[files["change"].isin([NEW, CHANGED])].reset_index(drop=True)
         return new_files
 
     def get_prev_processed_files(self):
@@ -34,9 +53,8 @@ class FileDownloader:
         Returns:
             _type_: _description_
         """
-        result = self.supabase_client.table("processed_files").select("*").execute()
-        prev_files = pd.DataFrame(result.data)
-        return prev_files
+        # Only the columns change detection needs, paged by id.
+        return fetch_manifest(self.supabase_client)
 
     def get_live_files(self):
         """Get the current files from the citibike website.
@@ -44,33 +62,30 @@ class FileDownloader:
         Returns:
             _type_: _description_
         """
-        response = requests.get("https://s3.amazonaws.com/tripdata")
-        response.raise_for_status()  # Ensure we notice bad responses
-        current_files = self.parse_citibike_xml_to_df(response.text)
+        # Follows continuation tokens, so listings over 1000 keys are complete.
+        current_files = BucketLister(self.base_url).list_files()
         return current_files
 
     def get_new_files(self, live_files, prev_files):
-        # Method 1: Using merge with indicator
-        merged = live_files.merge(
-            prev_files,
-            on="file_name",
-            how="left",
-            suffixes=("_new", "_old"),
-            indicator=True,
-        )
+        """Live files that are new or whose content changed since they were processed."""
+        files = classify_files(live_files, prev_files)
+        return files[files["change"].isin([NEW, CHANGED])].drop(columns="change")
 
-        # Filter for rows that either:
-        # 1) Don't appear in old_df (_merge == 'left_only')
-        # 2) Appear in old_df but have newer last_modified date
-        filtered_df = merged[
-            (merged["_merge"] == "left_only")  # Not in old_df
-            | (
-                merged["last_modified_new"] > merged["last_modified_old"]
-            )  # Newer modification date
-        ][["file_name", "last_modified_new"]].rename(
-            columns={"last_modified_new": "last_modified"}
-        )
-        return filtered_df
+    def record_touched_files(self, touched, prev_files):
+        """
+        Move the recorded last_modified of files whose timestamp changed but
+        whose ETag did not, so they are neither reprocessed nor reclassified
+        on every run. Written in one batch; the stored row_count is kept.
+        """
+        if touched.empty:
+            return
+        row_counts = prev_files.drop_duplicates("file_name", keep="last").set_index(
+            "file_name"
+        )["row_count"]
+        writer = ManifestWriter(self.supabase_client, batch_size=len(touched))
+        for _, file in touched.iterrows():
+            writer.record(file, row_counts.get(file["file_name"]))
+        writer.flush()
 
     def parse_citibike_xml_to_df(self, xml_content):
         """
@@ -80,48 +95,11 @@ class FileDownloader:
             xml_content (str): The XML content from the S3 bucket listing
 
         Returns:
-            pd.DataFrame: DataFrame with columns 'filename', 'last_modified', 'size_bytes'
+            pd.DataFrame: DataFrame with columns 'file_name', 'last_modified', 'etag', 'size_bytes'
         """
 
-        # Parse the XML
-        soup = BeautifulSoup(xml_content, "xml")
-
-        # Find all Contents elements
-        contents = soup.find_all("Contents")
-
-        # Extract data from each file
-        file_data = []
-
-        for content in contents:
-            # Get the filename (Key)
-            key = content.find("Key")
-            filename = key.text if key else None
-
-            # Get the last modified date
-            last_modified = content.find("LastModified")
-            last_modified_date = last_modified.text if last_modified else None
-
-            # Get the file size
-            size = content.find("Size")
-            size_bytes = int(size.text) if size else None
-
-            # Add to our data list
-            if filename:  # Only add if we have a filename
-                file_data.append(
-                    {
-                        "file_name": filename,
-                        "last_modified": last_modified_date,
-                    }
-                )
-
-        # Create DataFrame
-        df = pd.DataFrame(file_data)
-
-        # Convert last_modified to datetime
-        if not df.empty and "last_modified" in df.columns:
-            df["last_modified"] = pd.to_datetime(df["last_modified"])
-
-        return df
+        columns, _ = parse_listing_page(xml_content)
+        return listing_frame(columns)
 
 
 if __name__ == '__main__':
@@ -6,9 +6,110 @@ from pathlib import Path
 import os
 import hashlib
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from archive_helpers import iter_archives, list_archives, open_archive
+from date_parsing import detect_date_format, parse_dates
+from instrumentation import FileStats, record, recording, stage
+from source_formats import (
+    SourceFormat,
+    read_header,
+    reader_for_header,
+    register_format,
+)
 
 logger = logging.getLogger(__name__)
 
+# Rows per chunk when streaming CSVs out of an archive.
+STREAM_CHUNK_SIZE = 500_000
+# float64, as a whole-member read infers: narrower coordinates move stations
+# near a cell edge into a neighbouring cell.
+STREAM_COORDINATE_DTYPE = "float64"
+
+NEW_FORMAT_REQUIRED_COLUMNS = [
+    "ride_id",
+    "started_at",
+    "start_lat",
+    "start_lng",
+    "end_lat",
+    "end_lng",
+]
+
+# Define column mappings with multiple possible names (all lowercase for comparison)
+OLD_FORMAT_COLUMN_MAPPINGS = {
+    "bikeid": ["bikeid", "bike_id", "bike id"],
+    "starttime": ["starttime", "start time", "start_time"],
+    "start_station_latitude": [
+        "start station latitude",
+        "start_station_latitude",
+        "start station lat",
+        "start_lat",
+    ],
+    "start_station_longitude": [
+        "start station longitude",
+        "start_station_longitude",
+        "start station lng",
+        "start station lon",
+        "start_lng",
+        "start_lon",
+    ],
+    "end_station_latitude": [
+        "end station latitude",
+        "end_station_latitude",
+        "end station lat",
+        "end_lat",
+    ],
+    "end_station_longitude": [
+        "end station longitude",
+        "end_station_longitude",
+        "end station lng",
+        "end station lon",
+        "end_lng",
+        "end_lon",
+    ],
+}
+
+
+def match_old_format_columns(columns):
+    """
+    Map the standard legacy column names onto the columns of a file.
+
+    Parameters:
+    columns (list): Column names from the CSV header
+
+    Returns:
+    dict: standard name -> actual column name
+    """
+    # Find actual column names in the DataFrame, lowercasing them only once
+    columns_by_lower = {}
+    for column in columns:
+        columns_by_lower.setdefault(column.lower(), column)
+    actual_columns = {}
+    missing_columns = []
+
+    for standard_name, possible_names in OLD_FORMAT_COLUMN_MAPPINGS.items():
+        matched_column = next(
+            (
+                columns_by_lower[name.lower()]
+                for name in possible_names
+                if name.lower() in columns_by_lower
+            ),
+            None,
+        )
+        if matched_column:
+            actual_columns[standard_name] = matched_column
+        else:
+            missing_columns.append(
+                f"{standard_name} (tried: {', '.join(possible_names)})"
+            )
+
+    if missing_columns:
+        raise ValueError(
+            f"Missing required columns: {missing_columns}. Available columns: {columns}"
+        )
+    return actual_columns
+
+
 def find_column_match(df_columns, possible_names):
     """Find matching column name from possibilities, case-insensitive"""
     df_columns_lower = [col.lower() for col in df_columns]
@@ -20,7 +121,46 @@ def find_column_match(df_columns, possible_names):
     return None
 
 
-def process_all_csvs_from_zip_url(zip_url, locale):
+def list_csv_members(zip_ref):
+    """List the CSV members of an open ZipFile, skipping system/metadata files."""
+    # Get ALL files in ZIP (including subfolders)
+    all_files = zip_ref.namelist()
+
+    # Filter for CSV files (case insensitive) and exclude system/metadata files
+    csv_files = []
+    for f in all_files:
+        # Skip directories
+        if f.endswith("/"):
+            continue
+        # Skip macOS metadata files
+        if "__MACOSX" in f or f.startswith("._"):
+            continue
+        # Skip Windows/Linux hidden files
+        if "/.DS_Store" in f or f.endswith(".DS_Store"):
+            continue
+        # Skip other common system files
+        if f.endswith(".thumbs.db") or f.endswith("Thumbs.db"):
+            continue
+        # Keep only CSV files
+        if f.lower().endswith(".csv"):
+            csv_files.append(f)
+    return csv_files
+
+
+def member_result_key(csv_file_path, existing_keys):
+    """Key a CSV member by filename, adding its folder if the filename is taken."""
+    # Use just the filename (without path) as key
+    filename_only = os.path.basename(csv_file_path)
+
+    # Handle duplicate filenames by adding folder info
+    if filename_only in existing_keys:
+        # Create unique key with folder path
+        folder_path = os.path.dirname(csv_file_path)
+        return f"{folder_path}/{filename_only}" if folder_path else filename_only
+    return filename_only
+
+
+def process_all_csvs_from_zip_url(zip_url, locale, hash_workers=1):
     """
     Download ZIP file from URL and process ALL CSV files found in any folder/subfolder.
 
@@ -40,7 +180,7 @@ def process_all_csvs_from_zip_url(zip_url, locale):
         # Create a BytesIO object from the downloaded content
         zip_data = io.BytesIO(response.content)
 
-        return process_all_csvs_from_zip_data(zip_data, locale)
+        return process_all_csvs_from_zip_data(zip_data, locale, hash_workers)
 
     except requests.RequestException as e:
         raise Exception(f"Error downloading ZIP file: {str(e)}")
@@ -48,7 +188,7 @@ def process_all_csvs_from_zip_url(zip_url, locale):
         raise Exception(f"Error processing ZIP file: {str(e)}")
 
 
-def process_all_csvs_from_zip_data(zip_data, locale):
+def process_all_csvs_from_zip_data(zip_data, locale, hash_workers=1):
     """
     Process all CSV files from ZIP data (works with both URL and local files).
 
@@ -65,27 +205,7 @@ def process_all_csvs_from_zip_data(zip_data, locale):
 
     try:
         with zipfile.ZipFile(zip_data, "r") as zip_ref:
-            # Get ALL files in ZIP (including subfolders)
-            all_files = zip_ref.namelist()
-
-            # Filter for CSV files (case insensitive) and exclude system/metadata files
-            csv_files = []
-            for f in all_files:
-                # Skip directories
-                if f.endswith("/"):
-                    continue
-                # Skip macOS metadata files
-                if "__MACOSX" in f or f.startswith("._"):
-                    continue
-                # Skip Windows/Linux hidden files
-                if "/.DS_Store" in f or f.endswith(".DS_Store"):
-                    continue
-                # Skip other common system files
-                if f.endswith(".thumbs.db") or f.endswith("Thumbs.db"):
-                    continue
-                # Keep only CSV files
-                if f.lower().endswith(".csv"):
-                    csv_files.append(f)
+            csv_files = list_csv_members(zip_ref)
 
             if not csv_files:
                 raise ValueError("No CSV files found in ZIP archive")
@@ -97,35 +217,13 @@ def process_all_csvs_from_zip_data(zip_data, locale):
             # Process each CSV file
             for csv_file_path in csv_files:
                 try:
-                    logger.info(f"\nProcessing: {csv_file_path}")
-
-                    # Read CSV directly from ZIP
-                    with zip_ref.open(csv_file_path) as csv_file:
-                        df = pd.read_csv(csv_file)
-
-                    # Process the DataFrame based on which format it uses.
-                    if "ride_id" in df.columns:
-                        logger.info("here")
-                        processed_df = process_dataframe(df, locale)
-                    else:
-                        logger.info("239821h")
-                        processed_df = process_dataframe_old_format(df, locale)
-
-                    # Use just the filename (without path) as key
-                    filename_only = os.path.basename(csv_file_path)
-
-                    # Handle duplicate filenames by adding folder info
-                    if filename_only in results:
-                        # Create unique key with folder path
-                        folder_path = os.path.dirname(csv_file_path)
-                        unique_key = (
-                            f"{folder_path}/{filename_only}"
-                            if folder_path
-                            else filename_only
-                        )
-                        results[unique_key] = processed_df
-                    else:
-                        results[filename_only] = processed_df
+                    processed_df = process_csv_member(
+                        zip_ref, csv_file_path, locale, hash_workers
+                    )
+                    if processed_df is None:
+                        continue
+
+                    results[member_result_key(csv_file_path, results)] = processed_df
 
                     processed_count += 1
                     logger.info(f"  ✓ Successfully processed {len(processed_df)} rows")
@@ -136,20 +234,7 @@ def process_all_csvs_from_zip_data(zip_data, locale):
                     failed_files.append((csv_file_path, str(e)))
                     continue
 
-            # Summary
-            logger.info(f"\n{'='*50}")
-            logger.info(f"PROCESSING SUMMARY:")
-            logger.info(f"Successfully processed: {processed_count} files")
-            logger.info(f"Failed: {len(failed_files)} files")
-
-            if failed_files:
-                logger.info(f"\nFailed files:")
-                for failed_file, error in failed_files:
-                    logger.info(f"  - {failed_file}: {error}")
-
-            if processed_count == 0:
-                raise ValueError("No CSV files could be processed successfully")
-
+            _log_processing_summary(processed_count, failed_files)
             return results
 
     except zipfile.BadZipFile:
@@ -158,28 +243,380 @@ def process_all_csvs_from_zip_data(zip_data, locale):
         raise Exception(f"Error processing ZIP file: {str(e)}")
 
 
-def process_dataframe(df, locale):
+def process_csv_member(zip_ref, csv_file_path, locale, hash_workers=1):
+    """
+    Read and process one CSV member in full.
+
+    Returns:
+    pd.DataFrame: Processed rows, or None if the member is not a trip file
+    """
+    logger.info(f"\nProcessing: {csv_file_path}")
+
+    reader = member_reader(zip_ref, csv_file_path)
+    if reader is None:
+        return None
+
+    # Read only the columns the format uses, directly from ZIP
+    size = zip_ref.getinfo(csv_file_path).file_size
+    with stage("csv_read", bytes=size) as read:
+        with zip_ref.open(csv_file_path) as csv_file:
+            df = reader.read_csv(csv_file)
+        read.rows = len(df)
+
+    with stage("parse", rows=len(df)):
+        return reader.process(df, locale, hash_workers)
+
+
+def _log_processing_summary(processed_count, failed_files):
+    logger.info(f"\n{'='*50}")
+    logger.info(f"PROCESSING SUMMARY:")
+    logger.info(f"Successfully processed: {processed_count} files")
+    logger.info(f"Failed: {len(failed_files)} files")
+
+    if failed_files:
+        logger.info(f"\nFailed files:")
+        for failed_file, error in failed_files:
+            logger.info(f"  - {failed_file}: {error}")
+
+    if processed_count == 0:
+        raise ValueError("No CSV files could be processed successfully")
+
+
+def compact_frame(df: pd.DataFrame) -> tuple[int, dict]:
+    """
+    A processed frame as its length and plain column arrays, for returning
+    it from a worker process. Columns holding one value throughout (locale)
+    are sent as that value.
+
+    Strings stay Python objects: re-creating them from fixed-width bytes in
+    the parent costs more than unpickling them does.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object and len(values) and (values == values[0]).all():
+            values = values[0]
+        columns[column] = values
+    return len(df), columns
+
+
+def expand_frame(compact: tuple[int, dict]) -> pd.DataFrame:
+    """The DataFrame compact_frame was built from."""
+    n_rows, columns = compact
+    return pd.DataFrame(columns, index=pd.RangeIndex(n_rows))
+
+
+def _process_archive_members(path, nested_zip_name, members, locale, hash_workers):
+    """
+    Process-pool task: open the archive at path, or the zip nested in it,
+    and process the given CSV members (all of them when members is None).
+
+    Returns:
+    tuple: ([(member, compact_frame or None if not a trip file, error)],
+        stage totals for the run report)
+    """
+    stats = FileStats(path)
+    outcomes = []
+    with recording(stats), open_archive(path, nested_zip_name) as zip_data:
+        with zipfile.ZipFile(zip_data, "r") as zip_ref:
+            if members is None:
+                members = list_csv_members(zip_ref)
+                if not members:
+                    raise ValueError("No CSV files found in ZIP archive")
+            for csv_file_path in members:
+                try:
+                    df = process_csv_member(
+                        zip_ref, csv_file_path, locale, hash_workers
+                    )
+                except Exception as e:
+                    outcomes.append((csv_file_path, None, str(e)))
+                    continue
+                compact = None if df is None else compact_frame(df)
+                outcomes.append((csv_file_path, compact, None))
+    return outcomes, stats.stages
+
+
+def process_archive_members_parallel(path, locale, hash_workers=1, workers=2):
+    """
+    process_archive_file with the archive's members fanned out to a process
+    pool: one task per nested zip, or per CSV member of a flat archive.
+
+    Each worker opens its own handle on the archive on disk and returns its
+    frames as compact arrays. Results are keyed, and failures reported, in
+    member order exactly as a serial run would.
+    """
+    nested_zips = list_archives(path)
+    if nested_zips:
+        tasks = [(f"{name}/", name, None) for name in nested_zips]
+    else:
+        with zipfile.ZipFile(path, "r") as zip_ref:
+            members = list_csv_members(zip_ref)
+        if not members:
+            raise Exception(
+                "Error processing ZIP file: No CSV files found in ZIP archive"
+            )
+        tasks = [("", None, [member]) for member in members]
+
+    outcomes_by_prefix = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        futures = [
+            pool.submit(
+                _process_archive_members, path, name, members, locale, hash_workers
+            )
+            for _, name, members in tasks
+        ]
+        for (prefix, _, _), future in zip(tasks, futures):
+            try:
+                outcomes, stages = future.result()
+            except zipfile.BadZipFile:
+                logger.info(f"{prefix or path} is not a valid ZIP archive, skipping.")
+                continue
+            except Exception as e:
+                raise Exception(f"Error processing ZIP file: {str(e)}")
+            for stage_name, totals in stages.items():
+                record(stage_name, **totals)
+            outcomes_by_prefix.setdefault(prefix, []).extend(outcomes)
+
+    df_by_file = {}
+    for prefix, outcomes in outcomes_by_prefix.items():
+        results = {}
+        failed_files = []
+        for csv_file_path, compact, error in outcomes:
+            if error is not None:
+                logger.info(f"  ✗ Failed to process {csv_file_path}: {error}")
+                failed_files.append((csv_file_path, error))
+            elif compact is not None:
+                results[member_result_key(csv_file_path, results)] = expand_frame(
+                    compact
+                )
+        try:
+            _log_processing_summary(len(results), failed_files)
+        except ValueError as e:
+            raise Exception(f"Error processing ZIP file: {str(e)}")
+        for csv_name, df in results.items():
+            df_by_file[f"{prefix}{csv_name}"] = df
+    return df_by_file
+
+
+def read_csv_header(zip_ref, csv_file_path):
+    """Read just the column names of a CSV member."""
+    return read_header(zip_ref, csv_file_path)
+
+
+def member_reader(zip_ref, csv_file_path):
+    """
+    Reader for a CSV member, picked from its header line alone.
+
+    Returns None, after logging, for CSVs that are not trip files, so they
+    are skipped without decompressing more than their first line.
+    """
+    header = read_csv_header(zip_ref, csv_file_path)
+    reader = reader_for_header(header)
+    if reader is None:
+        logger.info(f"  Skipping {csv_file_path}: not a trip file (columns: {header})")
+    else:
+        logger.info(f"  {csv_file_path}: {reader.format.name} format")
+    return reader
+
+
+def stream_csv_member(
+    zip_ref,
+    csv_file_path,
+    locale,
+    chunksize=STREAM_CHUNK_SIZE,
+    hash_workers=1,
+    reader=None,
+    skip_rows=0,
+):
+    """
+    Yield processed chunks of one CSV member, reading only the needed columns.
+
+    Coordinates are read as float64, exactly as process_csv_member reads
+    them, and locale is categorical. The start time format is detected once,
+    from the first chunk, and reused for the rest. Legacy members are first
+    scanned for missing bike ids, which set how every chunk's ids are hashed.
+    Members that are not trip files yield nothing.
+
+    reader is the member's CsvReader, if already picked by member_reader.
+    The first skip_rows rows, e.g. already uploaded by an interrupted run,
+    are skipped without being processed.
+    """
+    if reader is None:
+        reader = member_reader(zip_ref, csv_file_path)
+    if reader is None:
+        return
+    date_format = None
+    size = zip_ref.getinfo(csv_file_path).file_size
+    options = {}
+    if reader.format is LEGACY_FORMAT:
+        # Bike ids are typed per member, so a gap in a later chunk must be
+        # known before the first one is hashed: one pass over just that column.
+        with stage("bike_id_scan", bytes=size):
+            with zip_ref.open(csv_file_path) as csv_file:
+                options["bike_id_gaps"] = reader.has_missing(
+                    csv_file, "bikeid", chunksize
+                )
+    with zip_ref.open(csv_file_path) as csv_file:
+        chunks = reader.read_csv(
+            csv_file,
+            chunksize=chunksize,
+            coordinate_dtype=STREAM_COORDINATE_DTYPE,
+            skip_rows=skip_rows,
+        )
+        while True:
+            with stage("csv_read", bytes=size) as read:
+                chunk = next(chunks, None)
+                read.rows = 0 if chunk is None else len(chunk)
+            # The member's bytes count once, with its first chunk.
+            size = 0
+            if chunk is None:
+                break
+            if date_format is None:
+                date_format = detect_date_format(chunk[reader.format.start_column])
+                logger.info(f"{csv_file_path}: start times look like {date_format}")
+            with stage("parse", rows=len(chunk)):
+                processed = reader.process(
+                    chunk, locale, hash_workers, date_format, **options
+                )
+                processed["locale"] = processed["locale"].astype("category")
+            yield processed
+
+
+def stream_csvs_from_zip_data(
+    zip_data,
+    locale,
+    chunksize=STREAM_CHUNK_SIZE,
+    hash_workers=1,
+    resume_points=None,
+    on_member_done=None,
+):
+    """
+    Streaming counterpart of process_all_csvs_from_zip_data.
+
+    Parameters:
+    zip_data (io.BytesIO): ZIP file data
+    chunksize (int): Rows per chunk
+    resume_points (dict): Result key -> rows of the member to skip, or None
+        to skip the member entirely, as left by an interrupted run
+    on_member_done (callable): Called as on_member_done(key, error) after the
+        last chunk of each trip CSV has been consumed, or after it failed
+
+    Yields:
+    tuple: (result key, processed DataFrame chunk), keyed like process_all_csvs_from_zip_data
+    """
+    keys = set()
+    processed_count = 0
+    failed_files = []
+
+    try:
+        zip_ref = zipfile.ZipFile(zip_data, "r")
+    except zipfile.BadZipFile:
+        logger.info("File is not a valid ZIP archive, skipping.")
+        return
+
+    with zip_ref:
+        csv_files = list_csv_members(zip_ref)
+        if not csv_files:
+            raise ValueError("No CSV files found in ZIP archive")
+
+        logger.info(f"Found {len(csv_files)} CSV file(s) in ZIP archive")
+        for csv_file_path in csv_files:
+            rows = 0
+            key = None
+            try:
+                logger.info(f"Streaming: {csv_file_path}")
+                reader = member_reader(zip_ref, csv_file_path)
+                if reader is None:
+                    continue
+                key = member_result_key(csv_file_path, keys)
+                keys.add(key)
+                skip_rows = (resume_points or {}).get(key, 0)
+                if skip_rows is None:
+                    logger.info(f"  Skipping {csv_file_path}: already committed")
+                    processed_count += 1
+                    continue
+                if skip_rows:
+                    logger.info(f"  Resuming after {skip_rows} committed rows")
+                for chunk in stream_csv_member(
+                    zip_ref,
+                    csv_file_path,
+                    locale,
+                    chunksize,
+                    hash_workers,
+                    reader,
+                    skip_rows,
+                ):
+                    rows += len(chunk)
+                    yield key, chunk
+                processed_count += 1
+                logger.info(f"  ✓ Successfully streamed {rows} rows")
+            except Exception as e:
+                logger.info(f"  ✗ Failed to process {csv_file_path}: {str(e)}")
+                failed_files.append((csv_file_path, str(e)))
+                error = e
+            else:
+                error = None
+            # Outside the try, so a failing callback is not taken for a bad CSV.
+            if on_member_done is not None:
+                on_member_done(key, error)
+
+    logger.info(
+        f"Streamed {processed_count} files successfully, {len(failed_files)} failed"
+    )
+    if processed_count == 0:
+        raise ValueError("No CSV files could be processed successfully")
+
+
+def process_archive_file(path, file_name, locale, hash_workers=1, member_workers=1):
+    """
+    Process every CSV in a downloaded file, including CSVs in nested zips.
+
+    Parameters:
+    path (str): Local path to the downloaded file
+    file_name (str): Name of the file in the bucket
+    locale: Locale identifier
+    member_workers (int): Process the archive's members on this many
+        processes (process_archive_members_parallel)
+
+    Returns:
+    dict: Dictionary where keys are CSV names (prefixed with the nested zip name, if any) and values are processed DataFrames
+    """
+    # Check if it's a zip file
+    if not file_name.endswith(".zip"):
+        # Not a zip, process directly
+        return process_all_csvs_from_zip_data(path, locale, hash_workers) or {}
+
+    if member_workers > 1:
+        return process_archive_members_parallel(
+            path, locale, hash_workers, member_workers
+        )
+
+    df_by_file = {}
+    for prefix, zip_data in iter_archives(path):
+        results = process_all_csvs_from_zip_data(zip_data, locale, hash_workers)
+        # Merge results with unique keys
+        for csv_name, df in (results or {}).items():
+            df_by_file[f"{prefix}{csv_name}"] = df
+    return df_by_file
+
+
+def process_dataframe(df, locale, date_format=None):
     """
     Process DataFrame to create the desired output format.
 
     Parameters:
     df (pd.DataFrame): Input DataFrame
+    date_format (str): date_parsing.DATE_FORMATS name of started_at,
+        detected from df when None
 
     Returns:
     pd.DataFrame: Processed DataFrame
     """
 
-    required_columns = [
-        "ride_id",
-        "started_at",
-        "start_lat",
-        "start_lng",
-        "end_lat",
-        "end_lng",
-    ]
-
     # Check if all required columns exist
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [
+        col for col in NEW_FORMAT_REQUIRED_COLUMNS if col not in df.columns
+    ]
 
     if missing_columns:
         raise ValueError(f"Missing required columns: {missing_columns}")
@@ -191,7 +628,7 @@ def process_dataframe(df, locale):
     result_df["ride_id"] = df["ride_id"]
 
     # Convert started_at to date only (remove time component)
-    result_df["start_date"] = pd.to_datetime(df["started_at"]).dt.date
+    result_df["start_date"] = parse_dates(df["started_at"], date_format)
 
     # Set local to constant "JC"
     result_df["locale"] = locale
@@ -214,85 +651,120 @@ def create_ride_id_hash(row):
     return hash_object.hexdigest()[:16]
 
 
-def process_dataframe_old_format(df, locale):
+def _hash_ride_keys(start_time, bike_id):
+    sha256 = hashlib.sha256
+    return [
+        sha256(f"{s}_{b}".encode()).hexdigest()[:16]
+        for s, b in zip(start_time, bike_id)
+    ]
+
+
+def _hash_ride_keys_packed(start_time, bike_id):
+    # One joined string pickles back far cheaper than a list of small strings.
+    return "".join(_hash_ride_keys(start_time, bike_id))
+
+
+def create_ride_id_hashes(start_time, bike_id, workers=1, chunk_size=500_000):
+    """
+    Batched equivalent of create_ride_id_hash over whole columns.
+
+    Produces exactly the same 16-hex-char IDs, so rows already in ride_data
+    still match on upsert.
+
+    Parameters:
+    start_time (pd.Series): Raw start time column
+    bike_id (pd.Series): Raw bike id column
+    workers (int): Hash chunks of chunk_size rows on this many processes
+
+    Returns:
+    pd.Series: ride_id hashes aligned with start_time
+    """
+    with stage("ride_id_hash", rows=len(start_time)):
+        hashes = _create_ride_id_hashes(start_time, bike_id, workers, chunk_size)
+    return pd.Series(hashes, index=start_time.index, dtype=object)
+
+
+def _create_ride_id_hashes(start_time, bike_id, workers, chunk_size):
+    # tolist() yields plain Python scalars, which format exactly like the
+    # values create_ride_id_hash sees.
+    starts = start_time.tolist()
+    bikes = bike_id.tolist()
+    if workers > 1 and len(starts) > chunk_size:
+        bounds = range(0, len(starts), chunk_size)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            packed = pool.map(
+                _hash_ride_keys_packed,
+                [starts[i : i + chunk_size] for i in bounds],
+                [bikes[i : i + chunk_size] for i in bounds],
+            )
+            hashes = [
+                blob[i : i + 16] for blob in packed for i in range(0, len(blob), 16)
+            ]
+    else:
+        hashes = _hash_ride_keys(starts, bikes)
+    return hashes
+
+
+def inferred_bike_ids(bike_id: pd.Series, member_has_gaps=None) -> pd.Series:
+    """
+    A bike id column read as text, typed as read_csv infers it for a whole
+    member: its string form feeds the ride_id hash, so ids must keep the
+    formatting of rows already in ride_data. Numeric ids are integers, or
+    floats ("123.0") in a member with any id missing; other ids stay text.
+
+    member_has_gaps is None when bike_id is the whole member.
+    """
+    if member_has_gaps is None:
+        member_has_gaps = bool(bike_id.isna().any())
+    numbers = pd.to_numeric(bike_id, errors="coerce")
+    if (numbers.isna() != bike_id.isna()).any():
+        return bike_id
+    if member_has_gaps or not (numbers % 1 == 0).all():
+        return numbers.astype("float64")
+    return numbers.astype("int64")
+
+
+def process_dataframe_old_format(
+    df,
+    locale,
+    hash_workers=1,
+    date_format=None,
+    actual_columns=None,
+    bike_id_gaps=None,
+):
     """
     Process DataFrame to create the desired output format.
 
     Parameters:
     df (pd.DataFrame): Input DataFrame
     locale: Locale identifier
+    hash_workers (int): Processes used to hash ride_ids
+    date_format (str): date_parsing.DATE_FORMATS name of the start time
+        column, detected from df when None
+    actual_columns (dict): Standard name -> column of df, matched from
+        df's columns when None
+    bike_id_gaps (bool): Whether the CSV member df was read from has missing
+        bike ids, or None when df is the whole member (inferred_bike_ids)
 
     Returns:
     pd.DataFrame: Processed DataFrame
     """
 
-    # Define column mappings with multiple possible names (all lowercase for comparison)
-    column_mappings = {
-        "bikeid": ["bikeid", "bike_id", "bike id"],
-        "starttime": ["starttime", "start time", "start_time"],
-        "start_station_latitude": [
-            "start station latitude",
-            "start_station_latitude",
-            "start station lat",
-            "start_lat",
-        ],
-        "start_station_longitude": [
-            "start station longitude",
-            "start_station_longitude",
-            "start station lng",
-            "start station lon",
-            "start_lng",
-            "start_lon",
-        ],
-        "end_station_latitude": [
-            "end station latitude",
-            "end_station_latitude",
-            "end station lat",
-            "end_lat",
-        ],
-        "end_station_longitude": [
-            "end station longitude",
-            "end_station_longitude",
-            "end station lng",
-            "end station lon",
-            "end_lng",
-            "end_lon",
-        ],
-    }
-
-    # Find actual column names in the DataFrame
-    actual_columns = {}
-    missing_columns = []
-
-    for standard_name, possible_names in column_mappings.items():
-        matched_column = find_column_match(df.columns.tolist(), possible_names)
-        if matched_column:
-            actual_columns[standard_name] = matched_column
-        else:
-            missing_columns.append(
-                f"{standard_name} (tried: {', '.join(possible_names)})"
-            )
-
-    if missing_columns:
-        raise ValueError(
-            f"Missing required columns: {missing_columns}. Available columns: {df.columns.tolist()}"
-        )
+    if actual_columns is None:
+        actual_columns = match_old_format_columns(df.columns.tolist())
 
     # Create new DataFrame with only the needed columns
     result_df = pd.DataFrame()
 
     # Generate unique ride_id using hash of starttime and bikeid
-    # Create a temporary series for the hash function
-    temp_df = pd.DataFrame(
-        {
-            "start_time": df[actual_columns["starttime"]],
-            "bike_id": df[actual_columns["bikeid"]],
-        }
+    result_df["ride_id"] = create_ride_id_hashes(
+        df[actual_columns["starttime"]],
+        inferred_bike_ids(df[actual_columns["bikeid"]], bike_id_gaps),
+        workers=hash_workers,
     )
-    result_df["ride_id"] = temp_df.apply(create_ride_id_hash, axis=1)
 
     # Convert started_at to date only (remove time component)
-    result_df["start_date"] = pd.to_datetime(df[actual_columns["starttime"]]).dt.date
+    result_df["start_date"] = parse_dates(df[actual_columns["starttime"]], date_format)
 
     result_df["locale"] = locale
 
@@ -305,6 +777,53 @@ def process_dataframe_old_format(df, locale):
     return result_df
 
 
+# Frames from a CsvReader already carry the standard column names.
+_LEGACY_STANDARD_COLUMNS = {name: name for name in OLD_FORMAT_COLUMN_MAPPINGS}
+
+# 2021-02 onwards, NYC and JC alike.
+NEW_FORMAT = register_format(
+    SourceFormat(
+        "current",
+        columns={name: [name] for name in NEW_FORMAT_REQUIRED_COLUMNS},
+        process=lambda df, locale, hash_workers, date_format: process_dataframe(
+            df, locale, date_format
+        ),
+        start_column="started_at",
+        dtypes={"ride_id": str, "started_at": str},
+        coordinate_columns=["start_lat", "start_lng", "end_lat", "end_lng"],
+    )
+)
+
+# 2013-2021: "starttime" / "start station latitude" headers, and the
+# "Start Time" / "Start Station Latitude" ones used from late 2016 and by JC,
+# told apart by CsvReader per distinct header.
+LEGACY_FORMAT = register_format(
+    SourceFormat(
+        "legacy",
+        columns=OLD_FORMAT_COLUMN_MAPPINGS,
+        process=lambda df, locale, hash_workers, date_format, bike_id_gaps=None: (
+            process_dataframe_old_format(
+                df,
+                locale,
+                hash_workers,
+                date_format,
+                _LEGACY_STANDARD_COLUMNS,
+                bike_id_gaps,
+            )
+        ),
+        start_column="starttime",
+        # bikeid is read as text, so chunks don't each infer their own dtype,
+        # and typed per member by inferred_bike_ids before hashing.
+        dtypes={"starttime": str, "bikeid": str},
+        coordinate_columns=[
+            name
+            for name in OLD_FORMAT_COLUMN_MAPPINGS
+            if name.endswith(("latitude", "longitude"))
+        ],
+    )
+)
+
+
 def download_and_save_zip(zip_url, local_path):
     """
     Download ZIP file and save locally.
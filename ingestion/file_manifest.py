@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from postgrest.types import ReturnMethod
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_FILES_TABLE = "processed_files"
+# Only what change detection needs; id drives the keyset pagination.
+MANIFEST_COLUMNS = [
+    "id",
+    "file_name",
+    "locale",
+    "last_modified",
+    "etag",
+    "size_bytes",
+    "row_count",
+]
+RECORD_COLUMNS = MANIFEST_COLUMNS[1:]
+
+# Classification of a live file against the manifest.
+NEW = "new"
+CHANGED = "changed"
+TOUCHED = "touched"
+UNCHANGED = "unchanged"
+
+
+def fetch_manifest(supabase_client, page_size=1000) -> pd.DataFrame:
+    """
+    Read processed_files with keyset pagination on id.
+
+    Each page asks for the rows after the last id seen, so the cost per page
+    stays constant however large the table grows, and only MANIFEST_COLUMNS
+    are transferred.
+    """
+    rows = []
+    last_id = None
+    while True:
+        query = (
+            supabase_client.table(PROCESSED_FILES_TABLE)
+            .select(",".join(MANIFEST_COLUMNS))
+            .order("id")
+            .limit(page_size)
+        )
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.execute().data
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        last_id = page[-1]["id"]
+
+    manifest = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+    manifest["last_modified"] = pd.to_datetime(
+        manifest["last_modified"], utc=True, format="ISO8601"
+    )
+    logger.info(f"Fetched {len(manifest)} processed file records")
+    return manifest
+
+
+def classify_files(live_files: pd.DataFrame, manifest: pd.DataFrame) -> pd.DataFrame:
+    """
+    Label each live file as new, changed, touched or unchanged.
+
+    - new: not in the manifest
+    - changed: the content differs, i.e. a different ETag or size. Records
+      written before ETags were stored fall back to a newer last_modified.
+    - touched: last_modified moved but the ETag is the same, so the content
+      is identical and the file does not need processing
+    - unchanged: nothing moved
+
+    Returns:
+    pd.DataFrame: live_files with a "change" column
+    """
+    previous = manifest[["file_name", "last_modified", "etag", "size_bytes"]]
+    merged = live_files.merge(
+        previous.drop_duplicates("file_name", keep="last"),
+        on="file_name",
+        how="left",
+        suffixes=("", "_old"),
+        indicator=True,
+    )
+    is_new = merged["_merge"] == "left_only"
+    has_etags = merged["etag"].notna() & merged["etag_old"].notna()
+    content_differs = has_etags & (
+        (merged["etag"] != merged["etag_old"])
+        | (
+            merged["size_bytes_old"].notna()
+            & (merged["size_bytes"] != merged["size_bytes_old"])
+        )
+    )
+    newer = (merged["last_modified"] > merged["last_modified_old"]).fillna(False)
+
+    merged["change"] = np.select(
+        [
+            is_new,
+            content_differs | (~has_etags & newer),
+            has_etags & newer,
+        ],
+        [NEW, CHANGED, TOUCHED],
+        default=UNCHANGED,
+    )
+    return merged[[*live_files.columns, "change"]]
+
+
+def processed_file_record(file: pd.Series, row_count=None) -> dict:
+    """processed_files row for a file from the new files list."""
+    record = {}
+    for column in RECORD_COLUMNS:
+        value = row_count if column == "row_count" else file.get(column)
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            record[column] = None
+        elif column == "last_modified":
+            record[column] = pd.Timestamp(value).isoformat()
+        elif column in ("size_bytes", "row_count"):
+            record[column] = int(value)
+        else:
+            record[column] = str(value)
+    return record
+
+
+class ManifestWriter:
+    """
+    Buffers processed_files records and upserts them in batches, instead of
+    one round trip per file. Records are flushed whenever batch_size of them
+    are pending or flush_interval seconds have passed since the last flush,
+    so a killed run loses at most that window; call flush() at the end of
+    each stage for the rest.
+    """
+
+    def __init__(self, supabase_client, batch_size=50, flush_interval=30.0):
+        self.supabase_client = supabase_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, file: pd.Series, row_count=None):
+        with self._lock:
+            self.pending.append(processed_file_record(file, row_count))
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+            if len(self.pending) < self.batch_size and not due:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self.pending = self.pending, []
+            self._flushed_at = time.monotonic()
+        # A file listed twice keeps its last record; upsert rejects duplicate keys.
+        batch = list({(r["file_name"], r["locale"]): r for r in batch}.values())
+        if not batch:
+            return
+        try:
+            self.supabase_client.table(PROCESSED_FILES_TABLE).upsert(
+                batch,
+                on_conflict="file_name,locale",
+                returning=ReturnMethod.minimal,
+            ).execute()
+        except Exception:
+            # Keep the records so a later flush can retry them.
+            with self._lock:
+                self.pending = batch + self.pending
+            raise
+        logger.info(f"Recorded {len(batch)} processed files")
@@ -1,40 +1,275 @@
+import numpy as np
 import pandas as pd
 import h3
 import logging
+import os
+
+from instrumentation import stage
+from ride_keys import RIDE_ID_LOWER, has_compact_ride_ids, ride_id_keys
 
 logger = logging.getLogger(__name__)
 
+# H3 reserves index 0 as the null cell, so it doubles as our "no cell" marker.
+H3_NULL = 0
 
-def apply_h3_latlng_to_cell(df_by_file, resolution=9) -> dict[str, pd.DataFrame]:
-    output_obj = {}
-    for key in df_by_file.keys():
-        logger.info(f"[{key}] entries: {df_by_file[key].shape[0]}")
-        resolution = 9
-        df_in_loop = df_by_file[key].copy()
-        df_in_loop["h3_cell_start"] = df_in_loop.apply(
-            lambda row: (
-                h3.latlng_to_cell(row["start_lat"], row["start_lng"], resolution)
-                if pd.notnull(row["start_lat"]) and pd.notnull(row["start_lng"])
-                else None
+COORDINATE_COLUMNS = ["start_lat", "start_lng", "end_lat", "end_lng"]
+CELL_COLUMNS = ["h3_cell_start", "h3_cell_end"]
+
+
+def latlng_to_cells(lat, lng, resolution=9) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert whole lat/lng columns to H3 cells in one batch.
+
+    Parameters:
+    lat, lng (array-like): Coordinates, NaN where missing
+    resolution (int): H3 resolution
+
+    Returns:
+    tuple: (int64 array of H3 cells with H3_NULL where missing, boolean valid mask)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    valid = np.isfinite(lat) & np.isfinite(lng)
+
+    cells = np.full(lat.shape[0], H3_NULL, dtype=np.int64)
+    n_valid = int(valid.sum())
+    if n_valid:
+        to_cell = h3.api.basic_int.latlng_to_cell
+        cells[valid] = np.fromiter(
+            (
+                to_cell(a, b, resolution)
+                for a, b in zip(lat[valid].tolist(), lng[valid].tolist())
             ),
-            axis=1,
+            dtype=np.int64,
+            count=n_valid,
         )
-        df_in_loop["h3_cell_end"] = df_in_loop.apply(
-            lambda row: (
-                h3.latlng_to_cell(row["end_lat"], row["end_lng"], resolution)
-                if pd.notnull(row["end_lat"]) and pd.notnull(row["end_lng"])
-                else None
-            ),
-            axis=1,
+    return cells, valid
+
+
+def cells_to_str(cells: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Format int64 H3 cells as the hex strings stored in ride_data (None where missing)."""
+    out = np.full(cells.shape[0], None, dtype=object)
+    # Trips repeat a few thousand cells, so format each distinct cell once.
+    codes, unique_cells = pd.factorize(cells[valid])
+    labels = np.array(
+        [format(cell, "x") for cell in unique_cells.tolist()], dtype=object
+    )
+    out[valid] = labels[codes]
+    return out
+
+
+def is_integer_cells(values) -> bool:
+    """Whether a cell column holds int64 cells rather than hex strings."""
+    return pd.api.types.is_integer_dtype(values)
+
+
+def cell_labels(values) -> np.ndarray:
+    """
+    Hex strings (None where missing) of a cell column in either form: int64
+    cells with H3_NULL for missing, or the strings themselves.
+    """
+    if not is_integer_cells(values):
+        return np.asarray(values, dtype=object)
+    cells = np.asarray(values, dtype=np.int64)
+    return cells_to_str(cells, cells != H3_NULL)
+
+
+def str_to_cells(labels) -> np.ndarray:
+    """Parse H3 hex strings (as stored in the database) into int64 cells."""
+    return np.fromiter(
+        (int(label, 16) for label in labels), dtype=np.int64, count=len(labels)
+    )
+
+
+class H3CellCache:
+    """
+    Memoizes (lat, lng) -> H3 cell for the fixed set of docking stations.
+
+    Coordinates are deduplicated per batch, so the number of H3 calls scales
+    with the number of unique stations rather than the number of rides. One
+    instance is meant to be shared across every file in a run, and can be
+    persisted to an .npz file between runs.
+    """
+
+    def __init__(self, resolution=9, path=None):
+        self.resolution = resolution
+        # np.savez appends .npz to any other name, so load from where it saves.
+        if path and not str(path).endswith(".npz"):
+            path = f"{path}.npz"
+        self.path = path
+        self.cells: dict[complex, int] = {}
+        # Cells looked up since the last take_new().
+        self._new: dict[complex, int] = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.cells)
+
+    def load(self):
+        with np.load(self.path) as data:
+            if int(data["resolution"]) != self.resolution:
+                logger.info(
+                    f"Ignoring H3 cache at {self.path}: built for resolution {int(data['resolution'])}"
+                )
+                return
+            self.cells.update(zip(data["keys"].tolist(), data["cells"].tolist()))
+        logger.info(f"Loaded {len(self.cells)} cached H3 cells from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        np.savez(
+            self.path,
+            resolution=self.resolution,
+            keys=np.fromiter(self.cells.keys(), dtype=np.complex128),
+            cells=np.fromiter(self.cells.values(), dtype=np.int64),
         )
+        logger.info(f"Saved {len(self.cells)} H3 cells to {self.path}")
+
+    def lookup(self, lat, lng) -> tuple[np.ndarray, np.ndarray]:
+        """Same contract as latlng_to_cells, but only unseen coordinates hit H3."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        valid = np.isfinite(lat) & np.isfinite(lng)
+        cells = np.full(lat.shape[0], H3_NULL, dtype=np.int64)
+        if not valid.any():
+            return cells, valid
 
-        df_in_loop.drop(
-            columns=["start_lat", "start_lng", "end_lat", "end_lng"], inplace=True
+        # Pack each coordinate pair into one complex number so np.unique can
+        # deduplicate pairs without a structured array.
+        keys, inverse = np.unique(lat[valid] + 1j * lng[valid], return_inverse=True)
+        unique_keys = keys.tolist()
+        missing = [k for k in unique_keys if k not in self.cells]
+        if missing:
+            missing_arr = np.array(missing)
+            new_cells, _ = latlng_to_cells(
+                missing_arr.real, missing_arr.imag, self.resolution
+            )
+            found = dict(zip(missing, new_cells.tolist()))
+            self.cells.update(found)
+            self._new.update(found)
+        self.misses += len(missing)
+        self.hits += len(unique_keys) - len(missing)
+
+        unique_cells = np.fromiter(
+            (self.cells[k] for k in unique_keys), dtype=np.int64, count=len(keys)
         )
-        # Remove duplicates. These are infrequent and probably just bad data.
-        dupes = df_in_loop.duplicated(subset=["ride_id"])
-        logger.info(f"  - Removing {dupes.sum()} duplicate ride_id entries")
-        df_in_loop = df_in_loop[~dupes]
+        cells[valid] = unique_cells[inverse]
+        return cells, valid
+
+    def take_new(self) -> dict[complex, int]:
+        """The cells looked up since the last call, to merge() into another cache."""
+        new, self._new = self._new, {}
+        return new
+
+    def merge(self, cells: dict[complex, int]):
+        """Add cells looked up by another cache, such as a parse worker's."""
+        self.cells.update(cells)
+
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        logger.info(
+            f"H3 cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate, {len(self.cells)} cached coordinates)"
+        )
+
+
+def assign_trip_cells(
+    df: pd.DataFrame, resolution=9, cell_cache: H3CellCache | None = None
+) -> tuple[np.ndarray, ...]:
+    """
+    Convert the start and end coordinate pairs of a trip frame in a single pass.
+
+    Returns:
+    tuple: (start_cells, start_valid, end_cells, end_valid)
+    """
+    n = len(df)
+    lat = np.concatenate([df["start_lat"].to_numpy(), df["end_lat"].to_numpy()])
+    lng = np.concatenate([df["start_lng"].to_numpy(), df["end_lng"].to_numpy()])
+    if cell_cache is not None:
+        cells, valid = cell_cache.lookup(lat, lng)
+    else:
+        cells, valid = latlng_to_cells(lat, lng, resolution)
+    return cells[:n], valid[:n], cells[n:], valid[n:]
+
+
+def apply_h3_latlng_to_cell(
+    df_by_file,
+    resolution=9,
+    cell_cache: H3CellCache | None = None,
+    keep_coordinates=False,
+    integer_cells=False,
+    compact_ride_ids=False,
+) -> dict[str, pd.DataFrame]:
+    """
+    Replace the coordinates of each frame with h3_cell_start / h3_cell_end.
+
+    Cells are hex strings (None where missing), or with integer_cells int64
+    cells (H3_NULL where missing), which stay compact until cell_labels
+    formats them at the COPY boundary. compact_ride_ids likewise turns
+    ride_ids into 64-bit keys plus a RIDE_ID_LOWER case column
+    (ride_keys.ride_id_keys), where every one of a frame's ride_ids is 16
+    hex digits.
+    """
+    output_obj = {}
+    for key in df_by_file.keys():
+        df = df_by_file[key]
+        logger.info(f"[{key}] entries: {df.shape[0]}")
+        with stage("h3_assign", rows=df.shape[0]):
+            start_cells, start_valid, end_cells, end_valid = assign_trip_cells(
+                df, resolution, cell_cache
+            )
+
+            # Selecting the remaining columns builds the output frame without
+            # copying the coordinate columns we are about to discard.
+            df_in_loop = df[
+                [
+                    col
+                    for col in df.columns
+                    if keep_coordinates or col not in COORDINATE_COLUMNS
+                ]
+            ]
+            if integer_cells:
+                df_in_loop = df_in_loop.assign(
+                    h3_cell_start=start_cells, h3_cell_end=end_cells
+                )
+            else:
+                df_in_loop = df_in_loop.assign(
+                    h3_cell_start=cells_to_str(start_cells, start_valid),
+                    h3_cell_end=cells_to_str(end_cells, end_valid),
+                )
+
+            if compact_ride_ids:
+                with stage("ride_id_keys", rows=df_in_loop.shape[0]):
+                    keys = ride_id_keys(df_in_loop["ride_id"])
+                if keys is None:
+                    logger.info(
+                        "  - ride_ids are not all 16 hex digits, keeping strings"
+                    )
+                else:
+                    keys, lower = keys
+                    df_in_loop = df_in_loop.assign(
+                        ride_id=keys, **{RIDE_ID_LOWER: lower}
+                    )
+
+            # Remove duplicates. These are infrequent and probably just bad data.
+            ride_id_columns = ["ride_id"]
+            if has_compact_ride_ids(df_in_loop):
+                ride_id_columns.append(RIDE_ID_LOWER)
+            dupes = df_in_loop.duplicated(subset=ride_id_columns)
+            logger.info(f"  - Removing {dupes.sum()} duplicate ride_id entries")
+            df_in_loop = df_in_loop[~dupes]
 
         output_obj[key] = df_in_loop
     return output_obj
+
+
+def drop_coordinates(output_obj) -> dict[str, pd.DataFrame]:
+    """Remove the coordinate columns kept by apply_h3_latlng_to_cell(keep_coordinates=True)."""
+    return {
+        key: df.drop(columns=COORDINATE_COLUMNS, errors="ignore")
+        for key, df in output_obj.items()
+    }
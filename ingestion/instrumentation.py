@@ -0,0 +1,335 @@
+import cProfile
+import csv
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REPORT_CSV_COLUMNS = [
+    "file_name",
+    "stage",
+    "seconds",
+    "calls",
+    "rows",
+    "bytes",
+    "rows_per_second",
+    "peak_rss_mb",
+]
+
+# The FileStats that stage() records into, per thread.
+_local = threading.local()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    # VmHWM resets on exec, unlike ru_maxrss which a spawned worker inherits.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """Restart VmHWM from the current RSS, where the kernel allows it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class _StageRecord:
+    """Yielded by stage(); set rows / bytes once they are known."""
+
+    def __init__(self, rows=0, bytes=0):
+        self.rows = rows
+        self.bytes = bytes
+
+
+class FileStats:
+    """
+    Wall time, rows and bytes per stage of one file, plus the file's overall
+    wall time and peak RSS. Stages may nest (date_parse and ride_id_hash
+    run inside parse), so their times are not meant to add up to the file's.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.stages: dict[str, dict] = {}
+        self.status = "ok"
+        self.error = None
+        self.rows = 0
+        self.wall_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds=0.0, rows=0, bytes=0, calls=1):
+        with self._lock:
+            totals = self.stages.setdefault(
+                stage, {"seconds": 0.0, "calls": 0, "rows": 0, "bytes": 0}
+            )
+            totals["seconds"] += seconds
+            totals["calls"] += calls
+            totals["rows"] += rows
+            totals["bytes"] += bytes
+
+    def merge(self, stages: dict[str, dict], peak_rss_mb=0.0):
+        """Add stage totals recorded elsewhere, e.g. in a parse worker process."""
+        for stage, totals in stages.items():
+            self.add(stage, **totals)
+        self.peak_rss_mb = max(self.peak_rss_mb, peak_rss_mb)
+
+    def fail(self, error):
+        self.status = "failed"
+        self.error = str(error)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                stage: _summarize(totals) for stage, totals in self.stages.items()
+            }
+        return {
+            "file_name": self.file_name,
+            "status": self.status,
+            "error": self.error,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "rows": self.rows,
+            "rows_per_second": _rate({"rows": self.rows, "seconds": self.wall_seconds}),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "stages": stages,
+        }
+
+
+def _summarize(totals) -> dict:
+    return {
+        **totals,
+        "seconds": round(totals["seconds"], 3),
+        "rows_per_second": _rate(totals),
+    }
+
+
+def _rate(totals) -> float | None:
+    if not totals["rows"] or not totals["seconds"]:
+        return None
+    return round(totals["rows"] / totals["seconds"], 1)
+
+
+@contextmanager
+def recording(stats: FileStats | None):
+    """Record stage() calls made by this thread into stats."""
+    previous = getattr(_local, "stats", None)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def stage(name, rows=0, bytes=0):
+    """
+    Time a stage of the current file. A no-op unless the calling thread is
+    inside recording(), so library functions can be instrumented freely.
+    """
+    record = _StageRecord(rows, bytes)
+    stats = getattr(_local, "stats", None)
+    if stats is None:
+        yield record
+        return
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        stats.add(name, time.perf_counter() - start, record.rows, record.bytes)
+
+
+def record(name, seconds=0.0, rows=0, bytes=0, calls=1):
+    """Add to a stage of the current file, for code that times itself."""
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        stats.add(name, seconds, rows, bytes, calls)
+
+
+def record_failure(error):
+    """Mark the current file as failed, for errors that are logged and swallowed."""
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        stats.fail(error)
+
+
+class RunReport:
+    """
+    Per-file, per-stage timings of a run, written to <path>.json and
+    <path>.csv after every file, so a run that hits the workflow timeout
+    still leaves a report behind.
+
+    Files named in profile_files (or every file, with "*") are also run
+    under cProfile, and their stats saved as <path>.profiles/<file>.prof
+    for snakeviz or pstats.
+    """
+
+    def __init__(self, path=None, profile_files=()):
+        self.path = Path(path) if path else None
+        self.profile_files = set(profile_files)
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.files: dict[str, FileStats] = {}
+        self._lock = threading.Lock()
+        # Pipeline threads finish files concurrently, and each write goes
+        # through the same temporary files.
+        self._write_lock = threading.Lock()
+
+    def stats(self, file_name) -> FileStats:
+        with self._lock:
+            if file_name not in self.files:
+                self.files[file_name] = FileStats(file_name)
+            return self.files[file_name]
+
+    def should_profile(self, file_name) -> bool:
+        return "*" in self.profile_files or file_name in self.profile_files
+
+    def profile_path(self, file_name) -> Path | None:
+        if self.path is None or not self.should_profile(file_name):
+            return None
+        directory = self.path.with_name(f"{self.path.name}.profiles")
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f"{Path(file_name).name}.prof"
+
+    @contextmanager
+    def file(self, file_name, profile=True, reset_rss=True):
+        """
+        Record work on a file by the calling thread: its wall time, peak
+        RSS, any stage() calls made meanwhile and, if requested, a profile.
+
+        Pipeline stages each enter this for their part of a file, with
+        profile=False (cProfile only sees the calling thread) and
+        reset_rss=False (the peak is shared with files in flight).
+        """
+        stats = self.stats(file_name)
+        profile_path = self.profile_path(file_name) if profile else None
+        profiler = cProfile.Profile() if profile_path else None
+        if reset_rss:
+            reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            with recording(stats):
+                if profiler:
+                    profiler.enable()
+                try:
+                    yield stats
+                finally:
+                    if profiler:
+                        profiler.disable()
+        except Exception as e:
+            stats.fail(e)
+            raise
+        finally:
+            stats.wall_seconds += time.perf_counter() - start
+            stats.peak_rss_mb = max(stats.peak_rss_mb, peak_rss_mb())
+            if profiler:
+                profiler.dump_stats(profile_path)
+                logger.info(f"Saved profile of {file_name} to {profile_path}")
+            self.write()
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            files = [stats.as_dict() for stats in self.files.values()]
+        stages = {}
+        for file in files:
+            for stage_name, totals in file["stages"].items():
+                combined = stages.setdefault(
+                    stage_name, {"seconds": 0.0, "calls": 0, "rows": 0, "bytes": 0}
+                )
+                for key in combined:
+                    combined[key] += totals[key]
+        stages = {
+            stage_name: _summarize(totals) for stage_name, totals in stages.items()
+        }
+        return {
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(time.perf_counter() - self._start, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "files_ok": sum(file["status"] == "ok" for file in files),
+            "files_failed": sum(file["status"] == "failed" for file in files),
+            "rows": sum(file["rows"] for file in files),
+            "stages": stages,
+            "files": files,
+        }
+
+    def csv_rows(self, report: dict) -> list[dict]:
+        rows = []
+        for file in report["files"]:
+            rows.append(
+                {
+                    "file_name": file["file_name"],
+                    "stage": "total",
+                    "seconds": file["wall_seconds"],
+                    "calls": 1,
+                    "rows": file["rows"],
+                    "bytes": "",
+                    "rows_per_second": file["rows_per_second"],
+                    "peak_rss_mb": file["peak_rss_mb"],
+                }
+            )
+            for stage_name, totals in file["stages"].items():
+                rows.append(
+                    {
+                        "file_name": file["file_name"],
+                        "stage": stage_name,
+                        "seconds": totals["seconds"],
+                        "calls": totals["calls"],
+                        "rows": totals["rows"],
+                        "bytes": totals["bytes"],
+                        "rows_per_second": totals["rows_per_second"],
+                        "peak_rss_mb": "",
+                    }
+                )
+        return rows
+
+    def write(self):
+        """Write the report so far; a no-op without a path."""
+        if self.path is None:
+            return
+        with self._write_lock:
+            self._write(self.as_dict())
+
+    def _write(self, report: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        json_path = self.path.with_name(f"{self.path.name}.json")
+        csv_path = self.path.with_name(f"{self.path.name}.csv")
+        # Replace the files whole, so an interrupted write keeps the last report.
+        tmp_path = json_path.with_name(f".{json_path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, json_path)
+        tmp_path = csv_path.with_name(f".{csv_path.name}.tmp")
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.csv_rows(report))
+        os.replace(tmp_path, csv_path)
+
+    def log_summary(self):
+        report = self.as_dict()
+        for stage_name, totals in sorted(
+            report["stages"].items(), key=lambda item: -item[1]["seconds"]
+        ):
+            rate = totals["rows_per_second"]
+            logger.info(
+                f"Stage {stage_name:<14} {totals['seconds']:10.1f}s "
+                f"{totals['rows']:>12,} rows"
+                + (f" ({rate:,.0f} rows/s)" if rate else "")
+            )
+        if self.path is not None:
+            logger.info(f"Run report written to {self.path}.json / .csv")
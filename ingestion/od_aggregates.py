@@ -0,0 +1,145 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from copy_helpers import copy_source, copy_sql
+from geo_helpers import H3_NULL, cell_labels, is_integer_cells
+
+logger = logging.getLogger(__name__)
+
+MONTHLY_TABLE = '"citi-bike-monthly"'
+OD_KEY = ["h3_cell_start", "h3_cell_end", "date_month"]
+
+
+def count_od_pairs(df: pd.DataFrame) -> pd.Series:
+    """
+    Rides per (h3_cell_start, h3_cell_end, date_month) in an H3-tagged frame.
+
+    Trips missing either cell are skipped, as in aggregate_monthly_ride_data.
+    Integer cells are grouped as they are and only the distinct cells of the
+    result are formatted, so counts are always keyed by hex strings.
+    """
+    trips = df[["h3_cell_start", "h3_cell_end", "start_date"]]
+    integer_cells = is_integer_cells(trips["h3_cell_start"])
+    if integer_cells:
+        trips = trips[
+            (trips["h3_cell_start"] != H3_NULL) & (trips["h3_cell_end"] != H3_NULL)
+        ].dropna(subset=["start_date"])
+    else:
+        trips = trips.dropna()
+    date_month = (
+        pd.to_datetime(trips["start_date"]).to_numpy().astype("datetime64[M]")
+    ).astype("datetime64[D]")
+    counts = (
+        trips.assign(start_date=date_month)
+        .groupby(
+            ["h3_cell_start", "h3_cell_end", "start_date"], sort=False, observed=True
+        )
+        .size()
+        .rename_axis(OD_KEY)
+    )
+    if integer_cells:
+        counts.index = counts.index.set_levels(
+            [cell_labels(level) for level in counts.index.levels[:2]], level=[0, 1]
+        )
+    return counts
+
+
+def od_counts_from_rows(rows, date_month) -> pd.Series:
+    """(h3_cell_start, h3_cell_end, count) query rows for one month as a Series."""
+    rows = list(rows)
+    index = pd.MultiIndex.from_arrays(
+        [
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            np.full(len(rows), np.datetime64(date_month, "D")),
+        ],
+        names=OD_KEY,
+    )
+    return pd.Series([row[2] for row in rows], index=index, dtype=np.int64)
+
+
+class ODCounter:
+    """
+    Running (h3_cell_start, h3_cell_end, date_month) -> count deltas for one file.
+
+    Counts are added while the file's frames are still in memory and combined
+    into one Series when the file is merged.
+    """
+
+    # Partial counts kept before they are folded together.
+    MAX_PARTS = 16
+
+    def __init__(self):
+        self._parts = []
+
+    def add(self, counts: pd.Series):
+        self._parts.append(counts)
+        if len(self._parts) > self.MAX_PARTS:
+            self._parts = [self.total()]
+
+    def subtract(self, counts: pd.Series):
+        self.add(-counts)
+
+    def total(self) -> pd.Series:
+        """Net count per key, without keys whose changes cancel out."""
+        if not self._parts:
+            return pd.Series(
+                [],
+                index=pd.MultiIndex.from_arrays([[], [], []], names=OD_KEY),
+                dtype=np.int64,
+            )
+        counts = pd.concat(self._parts).groupby(level=OD_KEY, sort=False).sum()
+        return counts[counts != 0]
+
+
+def apply_monthly_deltas(cur, deltas: pd.Series):
+    """
+    Add count deltas to citi-bike-monthly, in the caller's transaction.
+
+    Only the (cell pair, month) rows in deltas are touched, so the cost scales
+    with the new data rather than with the ride_data partitions behind it.
+    Rows whose count drops to zero are removed.
+    """
+    if deltas.empty:
+        return 0
+
+    delta_df = deltas.rename("count").reset_index()
+    delta_df["date_month"] = pd.to_datetime(delta_df["date_month"]).dt.date
+    cur.execute("""
+        CREATE TEMP TABLE od_deltas (
+            h3_cell_start varchar, h3_cell_end varchar, date_month date, count integer
+        ) ON COMMIT DROP
+        """)
+    cur.copy_expert(
+        copy_sql("od_deltas", delta_df.columns, "csv"),
+        copy_source(delta_df, "csv"),
+    )
+    cur.execute(f"""
+        INSERT INTO {MONTHLY_TABLE} (h3_cell_start, h3_cell_end, date_month, count)
+        SELECT h3_cell_start, h3_cell_end, date_month, count FROM od_deltas
+        ON CONFLICT (h3_cell_start, h3_cell_end, date_month)
+        DO UPDATE SET
+            count = {MONTHLY_TABLE}.count + EXCLUDED.count,
+            created_at = now()
+        """)
+    cur.execute(f"""
+        DELETE FROM {MONTHLY_TABLE} m
+        USING od_deltas d
+        WHERE m.h3_cell_start = d.h3_cell_start
+          AND m.h3_cell_end = d.h3_cell_end
+          AND m.date_month = d.date_month
+          AND m.count <= 0
+        """)
+    cur.execute("DROP TABLE od_deltas")
+    logger.info(f"Applied {len(delta_df)} OD count deltas to {MONTHLY_TABLE}")
+    return len(delta_df)
+
+
+def refresh_monthly_totals(conn):
+    """Rebuild the monthly_totals view from citi-bike-monthly."""
+    with conn.cursor() as cur:
+        cur.execute("REFRESH MATERIALIZED VIEW monthly_totals")
+    conn.commit()
+    logger.info("Refreshed monthly_totals")
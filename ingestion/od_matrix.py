@@ -0,0 +1,264 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from geo_helpers import str_to_cells
+from od_aggregates import MONTHLY_TABLE, count_od_pairs
+
+logger = logging.getLogger(__name__)
+
+CELL_TYPES = ("arrivals", "departures", "both")
+
+
+class CellDictionary:
+    """
+    Sorted array of int64 H3 cells. A cell's integer code is its position in
+    the array, so encoding is a binary search and decoding is an index.
+    """
+
+    def __init__(self, cells: np.ndarray):
+        self.cells = np.unique(np.asarray(cells, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def encode(self, cells: np.ndarray) -> np.ndarray:
+        """Codes of the given cells, -1 for cells not in the dictionary."""
+        cells = np.asarray(cells, dtype=np.int64)
+        if not len(self.cells):
+            return np.full(len(cells), -1, dtype=np.int64)
+        codes = np.minimum(np.searchsorted(self.cells, cells), len(self.cells) - 1)
+        return np.where(self.cells[codes] == cells, codes, -1)
+
+    def labels(self, codes) -> list[str]:
+        """H3 hex strings for the given codes."""
+        return [format(cell, "x") for cell in self.cells[codes].tolist()]
+
+
+class _CSR:
+    """Compressed sparse rows of (row, column, count) triples."""
+
+    def __init__(self, rows, cols, counts, n):
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.data = counts[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+        self.row_sums = np.bincount(rows, weights=counts, minlength=n).astype(np.int64)
+
+    def gather(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Column indices and counts of every entry in the given rows."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        total = int(lengths.sum())
+        # Position k of the output is entry k - (entries in earlier rows) of its row.
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        offsets += np.arange(total)
+        return self.indices[offsets], self.data[offsets]
+
+
+class MonthlyODMatrix:
+    """
+    One month of citi-bike-monthly as a sparse origin x destination matrix.
+
+    Counts are held twice, as CSR by origin and CSR by destination, so both
+    "where do trips from these cells go" and "where do trips to these cells
+    come from" are a row gather plus a bincount.
+    """
+
+    def __init__(self, cells: CellDictionary, origins, destinations, counts):
+        n = len(cells)
+        self.cells = cells
+        self.by_origin = _CSR(origins, destinations, counts, n)
+        self.by_destination = _CSR(destinations, origins, counts, n)
+
+    @classmethod
+    def from_counts(cls, df: pd.DataFrame) -> "MonthlyODMatrix":
+        """Build from h3_cell_start / h3_cell_end / count rows of one month."""
+        df = df.dropna(subset=["h3_cell_start", "h3_cell_end"])
+        # Parse each distinct label once rather than once per row.
+        labels, uniques = pd.factorize(
+            np.concatenate(
+                [
+                    df["h3_cell_start"].to_numpy(object),
+                    df["h3_cell_end"].to_numpy(object),
+                ]
+            )
+        )
+        unique_cells = str_to_cells(list(uniques))
+        cells = CellDictionary(unique_cells)
+        codes = cells.encode(unique_cells)[labels]
+        return cls(
+            cells,
+            codes[: len(df)],
+            codes[len(df) :],
+            df["count"].to_numpy(dtype=np.int64),
+        )
+
+    def _members(self, cells) -> np.ndarray:
+        """Boolean mask over cell codes of the given H3 strings."""
+        member = np.zeros(len(self.cells), dtype=bool)
+        codes = self.cells.encode(str_to_cells(list(cells)))
+        member[codes[codes >= 0]] = True
+        return member
+
+    def destinations_from(self, cells) -> pd.Series:
+        """
+        Trips from the given cells per destination cell, leaving out trips
+        that stay within the set (analyze_trip_flows_v3 'arrivals').
+        """
+        return self._flows(self.by_origin, self._members(cells))
+
+    def origins_to(self, cells) -> pd.Series:
+        """Trips into the given cells per origin cell (analyze_trip_flows_v3 'departures')."""
+        return self._flows(self.by_destination, self._members(cells))
+
+    def _flows(self, csr: _CSR, member: np.ndarray) -> pd.Series:
+        other, counts = csr.gather(np.flatnonzero(member))
+        outside = ~member[other]
+        totals = np.bincount(
+            other[outside], weights=counts[outside], minlength=len(self.cells)
+        ).astype(np.int64)
+        nonzero = np.flatnonzero(totals)
+        return pd.Series(
+            totals[nonzero], index=self.cells.labels(nonzero), dtype=np.int64
+        )
+
+    def cell_total(self, cells, cell_type="both") -> int:
+        """
+        Trips departing from, arriving in, or touching ("both") the given
+        cells (get_h3_cell_monthly_counts).
+        """
+        member = self._members(cells)
+        departures = int(self.by_origin.row_sums[member].sum())
+        arrivals = int(self.by_destination.row_sums[member].sum())
+        if cell_type == "departures":
+            return departures
+        if cell_type == "arrivals":
+            return arrivals
+        destinations, counts = self.by_origin.gather(np.flatnonzero(member))
+        internal = int(counts[member[destinations]].sum())
+        return departures + arrivals - internal
+
+    def flow_total(self, origins=None, destinations=None) -> int:
+        """
+        Trips between cell sets, excluding round trips (monthly_agg_v2).
+
+        With both sets, trips from origins to destinations. With one set,
+        trips leaving it (origins) or entering it (destinations).
+        """
+        if origins is not None and destinations is not None:
+            origin_member = self._members(origins)
+            dest_member = self._members(destinations)
+            rows = np.flatnonzero(origin_member)
+            cols, counts = self.by_origin.gather(rows)
+            row_of_entry = np.repeat(
+                rows, np.diff(self.by_origin.indptr)[rows].astype(np.int64)
+            )
+            keep = dest_member[cols] & (cols != row_of_entry)
+            return int(counts[keep].sum())
+        if origins is not None:
+            return int(self._flows(self.by_origin, self._members(origins)).sum())
+        if destinations is not None:
+            return int(
+                self._flows(self.by_destination, self._members(destinations)).sum()
+            )
+        raise ValueError("At least one of origins or destinations is required")
+
+
+class ODMatrixIndex:
+    """
+    In-process engine for flow queries over citi-bike-monthly.
+
+    Months are loaded on first use through load_month(date_month), which
+    returns that month's h3_cell_start / h3_cell_end / count rows, and the
+    max_months most recently used matrices are kept.
+    """
+
+    def __init__(self, load_month, max_months=24):
+        self.load_month = load_month
+        self.max_months = max_months
+        self._months: OrderedDict[pd.Timestamp, MonthlyODMatrix] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def month(self, date_month) -> MonthlyODMatrix:
+        key = pd.Timestamp(date_month).to_period("M").to_timestamp()
+        matrix = self._months.get(key)
+        if matrix is not None:
+            self.hits += 1
+            self._months.move_to_end(key)
+            return matrix
+
+        self.misses += 1
+        matrix = MonthlyODMatrix.from_counts(self.load_month(key.date()))
+        self._months[key] = matrix
+        if len(self._months) > self.max_months:
+            self._months.popitem(last=False)
+        return matrix
+
+    def destinations_from(self, date_month, cells) -> pd.Series:
+        return self.month(date_month).destinations_from(cells)
+
+    def origins_to(self, date_month, cells) -> pd.Series:
+        return self.month(date_month).origins_to(cells)
+
+    def monthly_totals(
+        self, cells, start_month, end_month, cell_type="both"
+    ) -> pd.Series:
+        """Per-month cell_total over an inclusive month range; empty months omitted."""
+        if cell_type not in CELL_TYPES:
+            raise ValueError(f"cell_type must be one of {CELL_TYPES}")
+        cells = list(cells)
+        totals = {
+            month.date(): self.month(month).cell_total(cells, cell_type)
+            for month in pd.date_range(start_month, end_month, freq="MS")
+        }
+        return _nonzero_series(totals)
+
+    def monthly_flow_totals(self, year, origins=None, destinations=None) -> pd.Series:
+        """Per-month flow_total for one year; empty months omitted."""
+        totals = {
+            month.date(): self.month(month).flow_total(origins, destinations)
+            for month in pd.date_range(f"{year}-01-01", f"{year}-12-01", freq="MS")
+        }
+        return _nonzero_series(totals)
+
+
+def _nonzero_series(totals: dict) -> pd.Series:
+    series = pd.Series(totals, dtype=np.int64).rename_axis("date_month")
+    return series[series != 0]
+
+
+def db_month_loader(db_pool):
+    """load_month for ODMatrixIndex reading citi-bike-monthly through a ConnectionPool."""
+
+    def load(date_month) -> pd.DataFrame:
+        with db_pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT h3_cell_start, h3_cell_end, count
+                FROM {MONTHLY_TABLE}
+                WHERE date_month = %s
+                """,
+                (date_month,),
+            )
+            rows = cur.fetchall()
+        return pd.DataFrame(rows, columns=["h3_cell_start", "h3_cell_end", "count"])
+
+    return load
+
+
+def trip_store_month_loader(trip_store):
+    """load_month for ODMatrixIndex aggregating a month from a ParquetTripStore."""
+
+    def load(date_month) -> pd.DataFrame:
+        trips = trip_store.read(
+            columns=["h3_cell_start", "h3_cell_end", "start_date"],
+            filters=[("year", "=", date_month.year), ("month", "=", date_month.month)],
+        )
+        return count_od_pairs(trips).rename("count").reset_index()
+
+    return load
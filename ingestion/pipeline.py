@@ -0,0 +1,256 @@
+import cProfile
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from file_helpers import process_archive_file
+from geo_helpers import H3CellCache, apply_h3_latlng_to_cell
+from instrumentation import FileStats, peak_rss_mb, recording
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input.
+_DONE = object()
+
+# Per-process H3 cache for parse workers, created by _init_parse_worker.
+# The cells each file adds are sent back with it and merged into the
+# processor's cache, which is the one saved at the end of the run.
+_worker_cell_cache = None
+
+
+def _init_parse_worker(resolution, cells):
+    global _worker_cell_cache
+    _worker_cell_cache = H3CellCache(resolution=resolution)
+    _worker_cell_cache.merge(cells)
+
+
+def _parse_file(
+    path,
+    file_name,
+    locale,
+    hash_workers,
+    member_workers=1,
+    keep_coordinates=False,
+    integer_cells=False,
+    compact_ride_ids=False,
+    profile_path=None,
+):
+    """
+    Parse stage, run in a worker process: CSVs -> H3-tagged frames.
+
+    Returns (frames or None, stage totals, worker peak RSS in MB, error or
+    None, H3 cells looked up for this file); the stage totals, RSS and error
+    go into the run report in the calling thread.
+    """
+    stats = FileStats(file_name)
+    profiler = cProfile.Profile() if profile_path else None
+    with recording(stats):
+        if profiler:
+            profiler.enable()
+        try:
+            df_by_file = process_archive_file(
+                path, file_name, locale, hash_workers, member_workers
+            )
+            output = None
+            if df_by_file:
+                output = apply_h3_latlng_to_cell(
+                    df_by_file,
+                    cell_cache=_worker_cell_cache,
+                    keep_coordinates=keep_coordinates,
+                    integer_cells=integer_cells,
+                    compact_ride_ids=compact_ride_ids,
+                )
+        except Exception as e:
+            logger.error(f"Error processing {file_name}: {str(e)}")
+            stats.fail(e)
+            output = None
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+    new_cells = _worker_cell_cache.take_new()
+    return output, stats.stages, peak_rss_mb(), stats.error, new_cells
+
+
+class FilePipeline:
+    """
+    Runs BikeShareProcessor's per-file work as overlapping stages:
+
+    - download: a thread pool fetching files into the download cache
+    - parse: a process pool for CSV parsing, hashing and H3 assignment
+    - upload: writer threads, each borrowing its own pooled database connection
+
+    Stages are connected by bounded queues, so a fast stage blocks instead of
+    piling up parsed files in memory. Per-file semantics match
+    process_files_df: a file that fails to download or parse is logged and
+    skipped, an upload error stops the run, and a file is only marked as
+    processed after its upload has committed.
+    """
+
+    def __init__(
+        self,
+        processor,
+        download_workers=2,
+        parse_workers=2,
+        upload_workers=2,
+        queue_size=2,
+    ):
+        self.processor = processor
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.errors = []
+
+    def run(self, files: pd.DataFrame):
+        download_q = queue.Queue()
+        parse_q = queue.Queue(maxsize=self.queue_size)
+        upload_q = queue.Queue(maxsize=self.queue_size)
+        for _, file in files.iterrows():
+            download_q.put(file)
+
+        with ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            # Forking while the stage threads hold locks can deadlock workers.
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_worker,
+            initargs=(
+                self.processor.cell_cache.resolution,
+                self.processor.cell_cache.cells,
+            ),
+        ) as pool:
+            stages = [
+                (self.download_workers, self._download_worker, (download_q, parse_q)),
+                (self.parse_workers, self._parse_worker, (parse_q, upload_q, pool)),
+                (self.upload_workers, self._upload_worker, (upload_q,)),
+            ]
+            threads = []
+            for workers, target, args in stages:
+                threads.append(
+                    [
+                        threading.Thread(target=target, args=args, daemon=True)
+                        for _ in range(workers)
+                    ]
+                )
+            for stage_threads in threads:
+                for t in stage_threads:
+                    t.start()
+
+            # Shut the stages down in order: once every worker of a stage has
+            # finished, tell each worker of the next stage there is no more input.
+            for _ in range(self.download_workers):
+                download_q.put(_DONE)
+            next_queues = [parse_q, upload_q, None]
+            next_workers = [self.parse_workers, self.upload_workers, 0]
+            for stage_threads, next_q, n_next in zip(
+                threads, next_queues, next_workers
+            ):
+                for t in stage_threads:
+                    t.join()
+                for _ in range(n_next):
+                    # Workers drain their queue until _DONE, so this cannot block forever.
+                    next_q.put(_DONE)
+
+        if self.errors:
+            raise self.errors[0]
+
+    def _report_file(self, file):
+        # Files are in flight on several threads at once: profiling happens
+        # in the parse worker, and the peak RSS is the process's.
+        return self.processor.run_report.file(
+            file["file_name"], profile=False, reset_rss=False
+        )
+
+    def _put(self, q, item):
+        """Put with backpressure, giving up if the pipeline is stopping."""
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _download_worker(self, download_q, parse_q):
+        while (file := download_q.get()) is not _DONE:
+            if self.stop.is_set():
+                continue
+            logger.info(f"Downloading file: {file['file_name']}")
+            try:
+                with self._report_file(file):
+                    path = self.processor.download_file(file)
+            except Exception as e:
+                logger.error(f"Error downloading {file['file_name']}: {str(e)}")
+                continue
+            if not self._put(parse_q, (file, path)):
+                self.processor.download_cache.release(path)
+
+    def _parse_worker(self, parse_q, upload_q, pool):
+        while (item := parse_q.get()) is not _DONE:
+            file, path = item
+            if self.stop.is_set():
+                self.processor.download_cache.release(path)
+                continue
+            logger.info(
+                f"Processing file: {file['file_name']} for locale {file['locale']}"
+            )
+            report = self.processor.run_report
+            try:
+                with self._report_file(file) as stats:
+                    output, stages, worker_rss_mb, error, new_cells = pool.submit(
+                        _parse_file,
+                        path,
+                        file["file_name"],
+                        file["locale"],
+                        self.processor.hash_workers,
+                        self.processor.member_workers,
+                        self.processor.trip_store is not None,
+                        self.processor.integer_cells,
+                        self.processor.compact_ride_ids,
+                        report.profile_path(file["file_name"]),
+                    ).result()
+                    self.processor.cell_cache.merge(new_cells)
+                    stats.merge(stages, worker_rss_mb)
+                    if error is not None:
+                        stats.fail(error)
+                    if output:
+                        output = self.processor.store_trips(file, output)
+            except Exception as e:
+                logger.error(f"Error processing {file['file_name']}: {str(e)}")
+                output = None
+            finally:
+                # Parsed rows no longer need the archive.
+                self.processor.download_cache.release(path)
+            if not output:
+                logger.info(
+                    f"No data processed for {file['file_name']}, skipping upload."
+                )
+                continue
+            self._put(upload_q, (file, output))
+
+    def _upload_worker(self, upload_q):
+        while (item := upload_q.get()) is not _DONE:
+            if self.stop.is_set():
+                continue
+            file, output = item
+            try:
+                with self._report_file(file) as stats:
+                    # Each worker borrows its own connection from the shared pool.
+                    with self.processor.db_pool.connection() as conn:
+                        self.processor.upload_output_obj(
+                            output,
+                            table_name="ride_data",
+                            conn=conn,
+                            source_file=file["file_name"],
+                        )
+                    stats.rows = sum(len(df) for df in output.values())
+                    self.processor.mark_file_as_processed(file, stats.rows)
+            except Exception as e:
+                logger.error(f"Error uploading {file['file_name']}: {str(e)}")
+                self.errors.append(e)
+                self.stop.set()
@@ -1,111 +1,220 @@
-from io import StringIO
 import logging
+import os
+import shutil
+from contextlib import nullcontext
+import tempfile
 from datetime import datetime
+from functools import partial
 import pandas as pd
-from supabase import create_client, Client
-import json
 import psycopg2
+from supabase import create_client, Client
 
-from file_helpers import process_all_csvs_from_zip_data, process_all_csvs_from_zip_url
-from geo_helpers import apply_h3_latlng_to_cell
+from archive_helpers import iter_archives
+from checkpoints import CheckpointStore
+from copy_helpers import copy_columns, copy_source, copy_sql
+from db_pool import ConnectionPool
+from download_cache import DownloadCache
+from file_manifest import ManifestWriter
+from file_diff import FileSnapshots
+from file_helpers import process_archive_file, stream_csvs_from_zip_data
+from geo_helpers import H3CellCache, apply_h3_latlng_to_cell, drop_coordinates
+from instrumentation import RunReport, record_failure, stage
+from od_aggregates import refresh_monthly_totals
+from pipeline import FilePipeline
+from ride_dedupe import RideFilter
+from staged_upload import StagedFileUpload
+from trip_store import ParquetTripStore
 
 logger = logging.getLogger(__name__)
 
 
 class BikeShareProcessor:
-    def __init__(self, conn_details, supabase_client):
+    def __init__(
+        self,
+        conn_details,
+        supabase_client,
+        h3_cache_path=None,
+        hash_workers=1,
+        member_workers=1,
+        stream_chunk_size=None,
+        download_cache_dir=None,
+        download_cache_max_bytes=None,
+        pipeline_config=None,
+        copy_format="csv",
+        upload_mode="chunk",
+        aggregate_od=False,
+        trip_store_dir=None,
+        ride_filter_dir=None,
+        diff_snapshot_dir=None,
+        integer_cells=False,
+        compact_ride_ids=False,
+        run_report_path=None,
+        profile_files=(),
+        checkpoints=False,
+    ):
         self.conn_details = conn_details
-        self.create_new_connection()
+        # FilePipeline options (worker counts, queue size); None processes
+        # files one after another.
+        self.pipeline_config = pipeline_config
+        # How chunks are encoded for COPY: "csv", "text_stream" or "binary".
+        self.copy_format = copy_format
+        # "chunk" upserts and commits every 10k rows; "file" stages a whole
+        # file and merges it in one transaction (StagedFileUpload).
+        self.upload_mode = upload_mode
+        # Apply each file's OD counts to citi-bike-monthly as it is merged.
+        # Needs per-file uploads, which see the whole file in one transaction.
+        if aggregate_od and upload_mode != "file":
+            raise ValueError("aggregate_od requires upload_mode='file'")
+        self.aggregate_od = aggregate_od
+        self.monthly_totals_stale = False
+        self.hash_workers = hash_workers
+        # Parse the members of one archive on this many processes; only
+        # whole-file parsing, streamed files are read member by member.
+        self.member_workers = member_workers
+        # When set, files are streamed through the pipeline in chunks of this many rows.
+        self.stream_chunk_size = stream_chunk_size
+        # One connection per upload worker, plus one for the sequential path.
+        upload_workers = (pipeline_config or {}).get("upload_workers", 0)
+        self.db_pool = ConnectionPool(conn_details, max_connections=upload_workers + 1)
         self.supabase_client = supabase_client
+        # processed_files records are batched and written when a stage ends.
+        self.manifest_writer = ManifestWriter(supabase_client)
+        # Shared across every file in the run; optionally persisted between runs.
+        self.cell_cache = H3CellCache(path=h3_cache_path)
+        # Without a persistent cache directory, downloads go to a scratch
+        # directory that is removed at the end of the run, and each archive
+        # is deleted as soon as its file has been processed.
+        self.temp_download_dir = None
+        if not download_cache_dir:
+            self.temp_download_dir = tempfile.mkdtemp(prefix="citibike-")
+            download_cache_max_bytes = 0
+        self.download_cache = DownloadCache(
+            download_cache_dir or self.temp_download_dir,
+            max_bytes=download_cache_max_bytes,
+        )
+        # Optional local Parquet copy of every processed file.
+        self.trip_store = ParquetTripStore(trip_store_dir) if trip_store_dir else None
+        # Optional persistent record of loaded rows; rows already in ride_data
+        # with the same H3 cells are dropped before COPY.
+        self.ride_filter = RideFilter(ride_filter_dir) if ride_filter_dir else None
+        # Diff mode: keep a snapshot of each file's rows and, when it is
+        # re-published, upload only what changed and delete what was removed.
+        # Deletes must share the file's transaction, hence per-file uploads.
+        if diff_snapshot_dir and upload_mode != "file":
+            raise ValueError("diff_snapshot_dir requires upload_mode='file'")
+        self.file_snapshots = (
+            FileSnapshots(diff_snapshot_dir) if diff_snapshot_dir else None
+        )
+        # Keep H3 cells as int64 from assignment to COPY, where they are
+        # formatted; OD counting, fingerprints and binary COPY then work on
+        # integers instead of strings.
+        self.integer_cells = integer_cells
+        # Likewise ride_ids as 64-bit keys (ride_keys.py), formatted at COPY.
+        self.compact_ride_ids = compact_ride_ids
+        # Per-file, per-stage timings, written as <path>.json / .csv; files
+        # in profile_files ("*" for all) are also profiled with cProfile.
+        self.run_report = RunReport(run_report_path, profile_files)
+        # Record each committed chunk of a streamed file, so a run that dies
+        # part way through resumes from the first uncommitted chunk. Needs
+        # chunk uploads: a staged file commits all at once anyway.
+        if checkpoints and not (stream_chunk_size and upload_mode == "chunk"):
+            raise ValueError(
+                "checkpoints require stream_chunk_size and upload_mode='chunk'"
+            )
+        self.checkpoints = CheckpointStore() if checkpoints else None
 
-    def reset_connection(self):
-        """Create a new connection"""
-        try:
-            self.conn.close()
-        except:
-            pass
-        self.create_new_connection()
-        self.connection_created_at = datetime.now()
-        logger.info("Database connection reset successfully")
+    def process_files_df(self, files: pd.DataFrame):
+        if self.pipeline_config is not None:
+            try:
+                FilePipeline(self, **self.pipeline_config).run(files)
+            finally:
+                self.cleanup()
+            return
 
-    def create_new_connection(self):
-        self.conn = psycopg2.connect(**self.conn_details)
+        try:
+            for _, file in files.iterrows():
+                with self.run_report.file(file["file_name"]) as stats:
+                    stats.rows = self.process_file(file)
+        finally:
+            self.cleanup()
+
+    def process_file(self, file: pd.Series) -> int:
+        """Process and upload one file. Returns the number of rows uploaded."""
+        if self.stream_chunk_size:
+            with self.db_pool.connection() as conn:
+                row_count = self.process_file_streaming(file, conn)
+            if row_count:
+                self.mark_file_as_processed(file, row_count)
+            self.cell_cache.log_stats()
+            return row_count
+        output = self.fetch_and_process_file(file)
+        self.cell_cache.log_stats()
+        if not output:
+            logger.info(f"No data processed for {file['file_name']}, skipping upload.")
+            return 0
+        with self.db_pool.connection() as conn:
+            self.upload_output_obj(
+                output,
+                table_name="ride_data",
+                conn=conn,
+                source_file=file["file_name"],
+            )
+        row_count = sum(len(df) for df in output.values())
+        self.mark_file_as_processed(file, row_count)
+        return row_count
 
-    def process_files_df(self, files: pd.DataFrame):
-        for _, file in files.iterrows():
-            self.reset_connection()
-            output = self.fetch_and_process_file(file)
-            if output:
-                self.upload_output_obj(output, table_name="ride_data")
-                self.mark_file_as_processed(file)
-            else:
-                logger.info(
-                    f"No data processed for {file['file_name']}, skipping upload."
-                )
+    def cleanup(self):
+        """
+        Record processed files, persist the H3 cache, close connections and
+        remove scratch downloads.
+        """
+        self.manifest_writer.flush()
+        self.run_report.write()
+        self.run_report.log_summary()
+        self.cell_cache.save()
+        if self.ride_filter is not None:
+            self.ride_filter.log_stats()
+            self.ride_filter.save()
+        if self.monthly_totals_stale:
+            with self.db_pool.connection() as conn:
+                refresh_monthly_totals(conn)
+            self.monthly_totals_stale = False
+        self.db_pool.close()
+        if self.temp_download_dir:
+            shutil.rmtree(self.temp_download_dir, ignore_errors=True)
+
+    def download_file(self, file: pd.Series):
+        """Download a file into the download cache and return its local path."""
+        with stage("download") as download:
+            path = self.download_cache.fetch(
+                file["file_name"],
+                etag=file.get("etag"),
+                last_modified=file.get("last_modified"),
+            )
+            download.bytes = os.path.getsize(path)
+        return path
 
     def fetch_and_process_file(self, file: pd.Series):
         """
         Process file that may contain nested zip files.
         Handles both direct CSVs and zip files containing other zip files.
         """
-        import zipfile
-        import requests
-        from io import BytesIO
-
         logger.info(f"Processing file: {file['file_name']} for locale {file['locale']}")
-        url = f"https://s3.amazonaws.com/tripdata/{file['file_name']}"
 
         try:
-            # Download the file
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-
-            # Check if it's a zip file
-            if not file["file_name"].endswith(".zip"):
-                # Not a zip, process directly
-                df_by_file = process_all_csvs_from_zip_url(url, locale=file["locale"])
-            else:
-                # It's a zip file - check for nested zips
-                outer_zip = zipfile.ZipFile(BytesIO(response.content))
-
-                # Filter out __MACOSX and other system files
-                zip_files = [
-                    name
-                    for name in outer_zip.namelist()
-                    if name.endswith(".zip")
-                    and not name.startswith("__MACOSX")
-                    and not "__MACOSX" in name
-                    and not name.startswith(".")
-                ]
-
-                if not zip_files:
-                    # No nested zips, process normally using existing function
-                    df_by_file = process_all_csvs_from_zip_data(
-                        BytesIO(response.content), locale=file["locale"]
-                    )
-                else:
-                    # Has nested zips - process each one using existing function
-                    logger.info(f"Found {len(zip_files)} nested zip files")
-                    df_by_file = {}
-
-                    for nested_zip_name in zip_files:
-                        logger.info(f"Processing nested zip: {nested_zip_name}")
-
-                        # Extract the nested zip
-                        nested_zip_bytes = outer_zip.read(nested_zip_name)
-
-                        # Use existing function to process the nested zip
-                        nested_results = process_all_csvs_from_zip_data(
-                            BytesIO(nested_zip_bytes), locale=file["locale"]
-                        )
-
-                        # Merge results with unique keys
-                        for csv_name, df in nested_results.items():
-                            # Create unique key with nested zip name
-                            unique_key = f"{nested_zip_name}/{csv_name}"
-                            df_by_file[unique_key] = df
-
-                    outer_zip.close()
+            # Download the file (or reuse the cached copy)
+            path = self.download_file(file)
+            try:
+                df_by_file = process_archive_file(
+                    path,
+                    file["file_name"],
+                    file["locale"],
+                    self.hash_workers,
+                    self.member_workers,
+                )
+            finally:
+                # Parsed rows no longer need the archive.
+                self.download_cache.release(path)
 
             if not df_by_file:
                 logger.info(
@@ -113,35 +222,296 @@ class BikeShareProcessor:
                 )
                 return None
             else:
-                output = apply_h3_latlng_to_cell(df_by_file)
-                return output
+                output = apply_h3_latlng_to_cell(
+                    df_by_file,
+                    cell_cache=self.cell_cache,
+                    keep_coordinates=self.trip_store is not None,
+                    integer_cells=self.integer_cells,
+                    compact_ride_ids=self.compact_ride_ids,
+                )
+                return self.store_trips(file, output)
 
         except Exception as e:
             logger.error(f"Error processing {file['file_name']}: {str(e)}")
+            record_failure(e)
             return None
 
-    def upload_output_obj(self, output_obj: dict[str, pd.DataFrame], table_name: str):
-        for key in output_obj.keys():
-            logger.info(f"Uploading {key} with {output_obj[key].shape[0]} records")
-            self.upload_df(output_obj[key], table_name, 10_000)
+    def process_file_streaming(self, file: pd.Series, conn) -> int:
+        """
+        Stream a file through parsing, H3 assignment and upload one chunk at a
+        time, so memory stays bounded by the chunk size rather than the archive.
+
+        With checkpoints, members and chunks committed by an earlier run are
+        skipped, and the file only counts as processed once all are done.
+
+        Returns:
+        int: number of rows uploaded, 0 if none were or the file could not
+        be downloaded, read or parsed. Database errors are raised.
+        """
+        logger.info(f"Streaming file: {file['file_name']} for locale {file['locale']}")
+        total_rows = 0
+        # The first chunk replaces what the store holds for this file.
+        store_mode = "overwrite"
+        path = None
 
-    def upload_df(self, df: pd.DataFrame, table_name: str, chunk_size=50_000):
+        try:
+            checkpoint = self.checkpoints.load(conn, file) if self.checkpoints else None
+            if checkpoint and checkpoint.complete:
+                logger.info(f"{file['file_name']} was committed in full by an earlier run")
+                return checkpoint.rows
+            if checkpoint and checkpoint.members:
+                logger.info(
+                    f"Resuming {file['file_name']} after {checkpoint.rows} committed rows"
+                )
+                # Rows already in the store would be written twice.
+                store_mode = "append"
+            path = self.download_file(file)
+            staged_file = self.upload_mode == "file"
+            staged = (
+                StagedFileUpload(
+                    conn, "ride_data", self.copy_format, self.aggregate_od
+                )
+                if staged_file
+                else nullcontext()
+            )
+            # Chunk uploads go through upload_output_obj, which dedupes each
+            # chunk itself; a staged file is diffed and deduped as a whole.
+            diff = self.file_diff(file["file_name"]) if staged_file else None
+            dedupe = (
+                self.ride_filter.batch() if self.ride_filter and staged_file else None
+            )
+            with staged as upload:
+                for prefix, zip_data in iter_archives(
+                    path, skip=checkpoint.archive_done if checkpoint else None
+                ):
+                    for csv_name, chunk in stream_csvs_from_zip_data(
+                        zip_data,
+                        locale=file["locale"],
+                        chunksize=self.stream_chunk_size,
+                        hash_workers=self.hash_workers,
+                        resume_points=(
+                            checkpoint.resume_points(prefix) if checkpoint else None
+                        ),
+                        on_member_done=(
+                            checkpoint.member_callback(prefix) if checkpoint else None
+                        ),
+                    ):
+                        output = apply_h3_latlng_to_cell(
+                            {f"{prefix}{csv_name}": chunk},
+                            cell_cache=self.cell_cache,
+                            keep_coordinates=self.trip_store is not None,
+                            integer_cells=self.integer_cells,
+                            compact_ride_ids=self.compact_ride_ids,
+                        )
+                        output = self.store_trips(file, output, store_mode)
+                        store_mode = "append"
+                        if upload:
+                            if diff:
+                                output = diff.filter_output(output)
+                            if dedupe:
+                                output = dedupe.filter_output(output)
+                            for df in output.values():
+                                upload.copy(df)
+                        else:
+                            # The checkpoint row commits with the chunk's rows.
+                            record_chunk = (
+                                partial(
+                                    checkpoint.record_chunk,
+                                    member=f"{prefix}{csv_name}",
+                                    rows=len(chunk),
+                                )
+                                if checkpoint
+                                else None
+                            )
+                            self.upload_output_obj(
+                                output,
+                                table_name="ride_data",
+                                conn=conn,
+                                before_commit=record_chunk,
+                            )
+                        total_rows += len(chunk)
+                    if checkpoint:
+                        checkpoint.finish_archive(prefix)
+                if upload:
+                    if diff:
+                        upload.delete(diff.removed())
+                    upload.merge()
+            self.record_upload(diff, dedupe)
+            self.monthly_totals_stale |= self.aggregate_od and total_rows > 0
+
+        except psycopg2.Error:
+            # Connection, upload and merge failures stop the run, as they do
+            # for whole-file uploads; only this file's own errors are skipped.
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming {file['file_name']}: {str(e)}")
+            record_failure(e)
+            return 0
+        finally:
+            if path is not None:
+                self.download_cache.release(path)
+
+        logger.info(f"Streamed {total_rows} rows from {file['file_name']}")
+        if checkpoint:
+            return checkpoint.rows if checkpoint.finish() else 0
+        return total_rows
+
+    def store_trips(self, file, output_obj, mode="overwrite"):
+        """
+        Write a file's H3-tagged frames, coordinates included, to the trip
+        store, and return them without coordinates, ready for upload.
+        """
+        if self.trip_store is None:
+            return output_obj
+        for df in output_obj.values():
+            with stage("trip_store", rows=len(df)):
+                self.trip_store.write(df, file["file_name"], mode=mode)
+            mode = "append"
+        return drop_coordinates(output_obj)
+
+    def upload_output_obj(
+        self,
+        output_obj: dict[str, pd.DataFrame],
+        table_name: str,
+        conn=None,
+        source_file=None,
+        before_commit=None,
+    ):
+        """
+        Upload a file's frames. source_file (the archive name) enables diff
+        mode, which uploads only the rows that differ from its last upload.
+
+        before_commit(cursor), if given, runs in the transaction holding the
+        frames' rows, just before it commits. Chunk uploads then commit once
+        for all of the frames instead of every 10k rows.
+        """
+        if conn is None:
+            with self.db_pool.connection() as conn:
+                return self.upload_output_obj(
+                    output_obj,
+                    table_name,
+                    conn=conn,
+                    source_file=source_file,
+                    before_commit=before_commit,
+                )
+        diff = self.file_diff(source_file)
+        if diff:
+            output_obj = diff.filter_output(output_obj)
+        removed = diff.removed() if diff else None
+        dedupe = self.ride_filter.batch() if self.ride_filter else None
+        if dedupe:
+            output_obj = dedupe.filter_output(output_obj)
+        result = None
+        if not output_obj and (removed is None or removed.empty):
+            if before_commit:
+                with conn.cursor() as cur:
+                    before_commit(cur)
+                conn.commit()
+        elif self.upload_mode == "file":
+            result = self.upload_output_obj_staged(
+                output_obj,
+                table_name,
+                conn=conn,
+                removed=removed,
+                before_commit=before_commit,
+            )
+        else:
+            for key in output_obj.keys():
+                logger.info(f"Uploading {key} with {output_obj[key].shape[0]} records")
+                self.upload_df(
+                    output_obj[key],
+                    table_name,
+                    10_000,
+                    conn=conn,
+                    commit=before_commit is None,
+                )
+            if before_commit:
+                with conn.cursor() as cur:
+                    before_commit(cur)
+                conn.commit()
+        self.record_upload(diff, dedupe)
+        return result
+
+    def file_diff(self, source_file):
+        """FileDiff of source_file against its last upload, None outside diff mode."""
+        if self.file_snapshots is None or source_file is None:
+            return None
+        return self.file_snapshots.diff(source_file)
+
+    def record_upload(self, diff=None, dedupe=None):
+        """
+        Update the ride filter and the file's diff snapshot. Only called
+        once the upload has committed, so neither claims rows that are not
+        in ride_data.
+        """
+        if dedupe:
+            dedupe.commit()
+        if diff:
+            if self.ride_filter:
+                self.ride_filter.discard(diff.stale_fingerprints())
+            diff.save()
+
+    def upload_output_obj_staged(
+        self,
+        output_obj: dict[str, pd.DataFrame],
+        table_name: str,
+        conn=None,
+        removed=None,
+        before_commit=None,
+    ):
+        """
+        Upload every frame of a file in one staging table and one transaction,
+        deleting the removed keys (a diff's removed rows) in the same one.
+        """
+        with StagedFileUpload(
+            conn, table_name, self.copy_format, self.aggregate_od
+        ) as upload:
+            for key in output_obj.keys():
+                logger.info(f"Staging {key} with {output_obj[key].shape[0]} records")
+                upload.copy(output_obj[key])
+            if removed is not None:
+                upload.delete(removed)
+            result = upload.merge()
+            if before_commit:
+                before_commit(upload.cur)
+        self.monthly_totals_stale |= self.aggregate_od
+        return result
+
+    def upload_df(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        chunk_size=50_000,
+        conn=None,
+        commit=True,
+    ):
         for i in range(0, len(df), chunk_size):
             logger.info(f"uploading chunk {i/ chunk_size}")
             chunk = df.iloc[i : i + chunk_size]
-            self.bulk_insert_with_staging(chunk, table_name)
+            self.bulk_insert_with_staging(chunk, table_name, conn=conn, commit=commit)
 
-    def bulk_insert_with_staging(self, df: pd.DataFrame, table_name: str):
+    def bulk_insert_with_staging(
+        self, df: pd.DataFrame, table_name: str, conn=None, commit=True
+    ):
         """
         High-performance bulk insert using staging table and COPY with UPSERT capability.
         Updates existing records and inserts new ones.
+
+        Borrows a pooled connection unless one is passed, e.g. by a pipeline upload worker.
+        With commit=False the upsert is left for the caller to commit.
         """
         if len(df) == 0:
             return {"inserted": 0, "updated": 0}
 
         logger.debug(f"Bulk upserting {len(df)} records to {table_name}")
 
-        with self.conn.cursor() as cur:
+        if conn is None:
+            with self.db_pool.connection() as conn:
+                return self.bulk_insert_with_staging(
+                    df, table_name, conn=conn, commit=commit
+                )
+
+        with conn.cursor() as cur:
             # Create temporary staging table
             staging_table = f"staging_{table_name}_{int(datetime.now().timestamp())}"
 
@@ -153,18 +523,15 @@ class BikeShareProcessor:
             )
 
             # Use COPY to load data into staging table (fastest method)
-            output = StringIO()
-            df.to_csv(output, sep="\t", header=False, index=False, na_rep="\\N")
-            output.seek(0)
-
-            # Build COPY command with correct column list
-            columns = ", ".join(df.columns)
-            copy_sql = f"COPY {staging_table} ({columns}) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')"
-
-            cur.copy_expert(copy_sql, output)
+            all_columns = copy_columns(df)
+            columns = ", ".join(all_columns)
+            with stage("copy", rows=len(df)):
+                cur.copy_expert(
+                    copy_sql(staging_table, all_columns, self.copy_format),
+                    copy_source(df, self.copy_format),
+                )
 
             # Get all columns except the conflict resolution columns for the UPDATE SET clause
-            all_columns = list(df.columns)
             conflict_columns = [
                 "ride_id",
                 "start_date",
@@ -185,12 +552,15 @@ class BikeShareProcessor:
                 DO UPDATE SET {set_clause}
             """
 
-            cur.execute(upsert_sql)
-
-            cur.execute(upsert_sql)
-            total_processed = len(df)
+            with stage("upsert", rows=len(df)):
+                cur.execute(upsert_sql)
+                total_processed = len(df)
 
-            self.conn.commit()
+                if commit:
+                    conn.commit()
+                else:
+                    # The next chunk in this transaction stages under the same name.
+                    cur.execute(f"DROP TABLE {staging_table}")
 
             logger.info(
                 f"Successfully processed {total_processed} records in {table_name}"
@@ -198,27 +568,17 @@ class BikeShareProcessor:
 
             return {"total_processed": total_processed}
 
-    def mark_file_as_processed(self, file_obj):
+    def mark_file_as_processed(self, file_obj, row_count=None):
+        """
+        Queue the file's processed_files record. The manifest writer flushes
+        it within a batch or a flush interval, and cleanup() writes the rest.
+        """
         logger.info(f"Marking file {file_obj['file_name']} as completed")
-        result = (
-            supabase.table("processed_files")
-            .upsert(
-                self.get_processed_file_record(file_obj),
-                on_conflict="file_name,locale",
-            )
-            .execute()
-        )
-        logger.info(result)
-
-    def get_processed_file_record(self, file_df_entry):
-        json_str = file_df_entry.to_json(date_format="iso")
-        data = json.loads(json_str)
-        return data
+        self.manifest_writer.record(file_obj, row_count)
 
 
 if __name__ == "__main__":
     import dotenv
-    import os
     import sys
 
     # Configure logging
@@ -253,5 +613,40 @@ if __name__ == "__main__":
     supabase_url = os.getenv("SUPABASE_URL")
     supabase_key = os.getenv("SUPABASE_ANON_KEY")
     supabase: Client = create_client(supabase_url, supabase_key)
-    processor = BikeShareProcessor(conn_details=conn_details, supabase_client=supabase)
+    pipeline_config = None
+    if os.getenv("PIPELINE_PARSE_WORKERS"):
+        pipeline_config = {
+            "download_workers": int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "2")),
+            "parse_workers": int(os.getenv("PIPELINE_PARSE_WORKERS")),
+            "upload_workers": int(os.getenv("PIPELINE_UPLOAD_WORKERS", "2")),
+            "queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", "2")),
+        }
+    processor = BikeShareProcessor(
+        conn_details=conn_details,
+        supabase_client=supabase,
+        h3_cache_path=os.getenv("H3_CACHE_PATH"),
+        hash_workers=int(os.getenv("RIDE_ID_HASH_WORKERS", "1")),
+        member_workers=int(os.getenv("ARCHIVE_MEMBER_WORKERS", "1")),
+        stream_chunk_size=int(os.getenv("STREAM_CHUNK_SIZE", "0")) or None,
+        download_cache_dir=os.getenv("DOWNLOAD_CACHE_DIR"),
+        download_cache_max_bytes=(
+            int(float(os.getenv("DOWNLOAD_CACHE_MAX_GB")) * 1024**3)
+            if os.getenv("DOWNLOAD_CACHE_MAX_GB")
+            else None
+        ),
+        pipeline_config=pipeline_config,
+        copy_format=os.getenv("COPY_FORMAT", "csv"),
+        upload_mode=os.getenv("UPLOAD_MODE", "chunk"),
+        aggregate_od=os.getenv("AGGREGATE_OD") == "1",
+        trip_store_dir=os.getenv("TRIP_STORE_DIR"),
+        ride_filter_dir=os.getenv("RIDE_FILTER_DIR"),
+        diff_snapshot_dir=os.getenv("DIFF_SNAPSHOT_DIR"),
+        integer_cells=os.getenv("H3_INTEGER_CELLS") == "1",
+        compact_ride_ids=os.getenv("COMPACT_RIDE_IDS") == "1",
+        run_report_path=os.getenv("RUN_REPORT_PATH"),
+        checkpoints=os.getenv("CHECKPOINTS") == "1",
+        profile_files=[
+            name for name in os.getenv("PROFILE_FILES", "").split(",") if name
+        ],
+    )
     processor.process_files_df(files_df)
@@ -0,0 +1,359 @@
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from geo_helpers import cell_labels, is_integer_cells
+from ride_keys import ride_id_hashes
+
+logger = logging.getLogger(__name__)
+
+# Columns of a ride_data row. A row whose fingerprint is already known has
+# the same key and the same H3 cells as a row already loaded, so upserting
+# it again would change nothing.
+FINGERPRINT_COLUMNS = [
+    "ride_id",
+    "start_date",
+    "locale",
+    "h3_cell_start",
+    "h3_cell_end",
+]
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def day_numbers(values) -> np.ndarray:
+    """Days since the epoch of dates, datetimes or date strings (NaT -> min int64)."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        # NaT is already min int64.
+        return values.astype("datetime64[D]").view(np.int64)
+    # Parse each distinct value once; a file holds a few hundred distinct dates.
+    codes, uniques = pd.factorize(values)
+    days = (
+        pd.to_datetime(pd.Series(uniques, dtype=object))
+        .to_numpy()
+        .astype("datetime64[D]")
+        .view(np.int64)
+    )
+    return np.where(codes >= 0, days[codes], np.iinfo(np.int64).min)
+
+
+def _month_keys(locales: np.ndarray, days: np.ndarray) -> tuple[np.ndarray, list]:
+    """
+    Locale and month of each row, as integer codes into a list of labels
+    like "NYC_2024-01".
+    """
+    locale_codes, locale_uniques = pd.factorize(locales)
+    month_codes, month_uniques = pd.factorize(
+        days.astype("datetime64[D]").astype("datetime64[M]").view(np.int64)
+    )
+    codes, pairs = pd.factorize(locale_codes * len(month_uniques) + month_codes)
+    labels = [
+        f"{locale_uniques[pair // len(month_uniques)]}_"
+        f"{np.datetime64(int(month_uniques[pair % len(month_uniques)]), 'M')}"
+        for pair in pairs.tolist()
+    ]
+    return codes, labels
+
+
+def key_fingerprints(df: pd.DataFrame, days: np.ndarray | None = None) -> np.ndarray:
+    """
+    64-bit fingerprint of each row's ride_data key (ride_id, start_date,
+    locale), the same whether ride_ids are strings or compact keys.
+    """
+    if days is None:
+        days = day_numbers(df["start_date"])
+    # ride_ids are unique, so factorizing them first would only cost time.
+    fingerprint = ride_id_hashes(df)
+    for values in (days, df["locale"].to_numpy(object)):
+        fingerprint = _combine(fingerprint, values)
+    return fingerprint
+
+
+def row_fingerprints(
+    df: pd.DataFrame, days: np.ndarray | None = None, keys: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    64-bit fingerprint of each row over FINGERPRINT_COLUMNS, extending its
+    key_fingerprints (which can be passed in if already computed).
+
+    Dates are hashed as day numbers, so the fingerprint does not depend on
+    whether start_date holds date objects or datetime64 values. Likewise
+    cells hash as their hex strings whether held as strings or int64.
+    """
+    fingerprint = key_fingerprints(df, days) if keys is None else keys
+    for column in ("h3_cell_start", "h3_cell_end"):
+        fingerprint = _mix(fingerprint, _cell_hashes(df[column]))
+    return fingerprint
+
+
+def _cell_hashes(values: pd.Series) -> np.ndarray:
+    if not is_integer_cells(values):
+        return pd.util.hash_array(values.to_numpy(object))
+    # Hash the label of each distinct cell once.
+    codes, cells = pd.factorize(values.to_numpy())
+    return pd.util.hash_array(cell_labels(cells))[codes]
+
+
+def _combine(fingerprint: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return _mix(fingerprint, pd.util.hash_array(values))
+
+
+def _mix(fingerprint: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    return pd.util.hash_array((fingerprint * _MIX) ^ hashes)
+
+
+def fingerprints_by_month(
+    fingerprints: np.ndarray, locales: np.ndarray, days: np.ndarray
+) -> dict[str, np.ndarray]:
+    """Split fingerprints by the locale and month RideFilter stores them under."""
+    month_codes, months = _month_keys(locales, days)
+    return {
+        month: fingerprints[month_codes == code] for code, month in enumerate(months)
+    }
+
+
+def isin_sorted(values: np.ndarray, sorted_values: np.ndarray) -> np.ndarray:
+    """np.isin against an already sorted array, by binary search."""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    # Sorted needles walk the array in order, which is far kinder to the
+    # cache than random binary searches.
+    order = np.argsort(values)
+    needles = values[order]
+    positions = np.minimum(
+        np.searchsorted(sorted_values, needles), len(sorted_values) - 1
+    )
+    found = np.empty(len(values), dtype=bool)
+    found[order] = sorted_values[positions] == needles
+    return found
+
+
+def _sorted_union(values: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """Sorted distinct values of both arrays (np.union1d without a hash table)."""
+    combined = np.concatenate([values, new])
+    combined.sort()
+    return combined[np.r_[True, combined[1:] != combined[:-1]]]
+
+
+class BloomFilter:
+    """
+    Word-blocked Bloom filter over uint64 fingerprints.
+
+    Each fingerprint sets n_hashes bits inside a single 64-bit word, so adding
+    or testing a batch is one gather over the word array rather than n_hashes
+    scattered probes per row. Blocking raises the false positive rate a
+    little, which the sizing makes up for with at least 30% more bits.
+    """
+
+    def __init__(self, capacity=50_000_000, error_rate=0.01, words=None, n_hashes=None):
+        if words is None:
+            n_bits = 1.3 * -capacity * math.log(error_rate) / math.log(2) ** 2
+            # A power of two words, so the word index is a shift, not a modulo.
+            words = np.zeros(2 ** math.ceil(math.log2(n_bits / 64)), dtype=np.uint64)
+            n_hashes = max(1, min(10, round(-math.log2(error_rate))))
+        self.words = words
+        self.n_hashes = int(n_hashes)
+        self._index_shift = np.uint64(64 - int(len(words)).bit_length() + 1)
+
+    def _locate(self, fingerprints: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Word index and bit mask of each fingerprint."""
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        index = (fingerprints >> self._index_shift).astype(np.intp)
+        # Bit positions come from a remix, independent of the word index.
+        bits = fingerprints * _MIX
+        mask = np.zeros(len(fingerprints), dtype=np.uint64)
+        for _ in range(self.n_hashes):
+            mask |= np.left_shift(np.uint64(1), bits >> np.uint64(58))
+            bits <<= np.uint64(6)
+        return index, mask
+
+    def add(self, fingerprints: np.ndarray):
+        index, mask = self._locate(fingerprints)
+        if not len(index):
+            return
+        # OR together the masks aimed at the same word, then set each word
+        # once; ufunc.at would do the same one element at a time.
+        order = np.argsort(index)
+        index, mask = index[order], mask[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        self.words[index[starts]] |= np.bitwise_or.reduceat(mask, starts)
+
+    def might_contain(self, fingerprints: np.ndarray) -> np.ndarray:
+        """Boolean mask; False means definitely not added."""
+        index, mask = self._locate(fingerprints)
+        return (self.words[index] & mask) == mask
+
+
+class RideFilter:
+    """
+    Persistent record of the ride_data rows already loaded, used to drop
+    unchanged rows before they reach COPY and ON CONFLICT.
+
+    A Bloom filter answers "definitely new" for most rows of a new month
+    without touching disk. Rows it flags are checked exactly against sorted
+    fingerprint arrays kept per locale and month, of which only the
+    max_months most recently used are held in memory.
+
+    Fingerprints are only added once the rows are committed (see
+    DedupeBatch.commit), so the filter never claims a row the database does
+    not hold. It does not see writes made outside the pipeline: delete the
+    directory to start over after editing ride_data by hand.
+    """
+
+    def __init__(self, path, capacity=50_000_000, error_rate=0.01, max_months=12):
+        self.path = path
+        self.max_months = max_months
+        os.makedirs(os.path.join(path, "months"), exist_ok=True)
+        self.bloom_path = os.path.join(path, "bloom.npz")
+        if os.path.exists(self.bloom_path):
+            with np.load(self.bloom_path) as data:
+                self.bloom = BloomFilter(
+                    words=data["words"], n_hashes=int(data["n_hashes"])
+                )
+            logger.info(f"Loaded ride filter from {self.path}")
+        else:
+            self.bloom = BloomFilter(capacity, error_rate)
+        self._months: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._dirty = set()
+        self._bloom_dirty = False
+        self._lock = threading.Lock()
+        self.rows_checked = 0
+        self.rows_skipped = 0
+
+    def batch(self) -> "DedupeBatch":
+        return DedupeBatch(self)
+
+    def _month_path(self, month: str) -> str:
+        return os.path.join(self.path, "months", f"{month}.npy")
+
+    def _month(self, month: str) -> np.ndarray:
+        known = self._months.get(month)
+        if known is not None:
+            self._months.move_to_end(month)
+            return known
+        path = self._month_path(month)
+        known = np.load(path) if os.path.exists(path) else np.empty(0, np.uint64)
+        self._months[month] = known
+        while len(self._months) > self.max_months:
+            evicted, values = self._months.popitem(last=False)
+            if evicted in self._dirty:
+                self._save_month(evicted, values)
+        return known
+
+    def _save_month(self, month: str, values: np.ndarray):
+        # Write under a temporary name so an interrupted save keeps the old array.
+        tmp_path = self._month_path(month) + ".tmp.npy"
+        np.save(tmp_path, values)
+        os.replace(tmp_path, self._month_path(month))
+        self._dirty.discard(month)
+
+    def known(
+        self, fingerprints: np.ndarray, month_codes: np.ndarray, months: list
+    ) -> np.ndarray:
+        """Boolean mask of fingerprints already committed."""
+        with self._lock:
+            known = self.bloom.might_contain(fingerprints)
+            for code in np.unique(month_codes[known]):
+                in_month = known & (month_codes == code)
+                values = self._month(months[code])
+                known[in_month] = isin_sorted(fingerprints[in_month], values)
+            return known
+
+    def add(self, fingerprints_by_month: dict[str, np.ndarray]):
+        with self._lock:
+            for month, fingerprints in fingerprints_by_month.items():
+                self.bloom.add(fingerprints)
+                self._months[month] = _sorted_union(self._month(month), fingerprints)
+                self._dirty.add(month)
+            self._bloom_dirty = True
+
+    def discard(self, fingerprints_by_month: dict[str, np.ndarray]):
+        """
+        Forget rows deleted from ride_data. They stay in the Bloom filter,
+        which cannot remove entries, but the exact check no longer finds them.
+        """
+        with self._lock:
+            for month, fingerprints in fingerprints_by_month.items():
+                values = self._month(month)
+                self._months[month] = values[~np.isin(values, fingerprints)]
+                self._dirty.add(month)
+
+    def save(self):
+        with self._lock:
+            for month in list(self._dirty):
+                self._save_month(month, self._months[month])
+            if self._bloom_dirty:
+                np.savez(
+                    self.bloom_path,
+                    words=self.bloom.words,
+                    n_hashes=self.bloom.n_hashes,
+                )
+                self._bloom_dirty = False
+        logger.info(f"Saved ride filter to {self.path}")
+
+    def log_stats(self):
+        rate = self.rows_skipped / self.rows_checked if self.rows_checked else 0.0
+        logger.info(
+            f"Ride filter: skipped {self.rows_skipped} of {self.rows_checked} rows already loaded ({rate:.1%})"
+        )
+
+
+class DedupeBatch:
+    """
+    Rows uploaded in one transaction. filter() drops rows already loaded and
+    remembers the rest; commit() records them once the upload has committed.
+    """
+
+    def __init__(self, ride_filter: RideFilter):
+        self.ride_filter = ride_filter
+        self.pending: dict[str, list[np.ndarray]] = {}
+        self.rows_checked = 0
+        self.rows_skipped = 0
+
+    def filter(self, df: pd.DataFrame) -> pd.DataFrame:
+        if len(df) == 0:
+            return df
+        days = day_numbers(df["start_date"])
+        fingerprints = row_fingerprints(df, days)
+        month_codes, months = _month_keys(df["locale"].to_numpy(object), days)
+        known = self.ride_filter.known(fingerprints, month_codes, months)
+        for code, month in enumerate(months):
+            new = ~known & (month_codes == code)
+            self.pending.setdefault(month, []).append(fingerprints[new])
+
+        skipped = int(known.sum())
+        self.rows_checked += len(df)
+        self.rows_skipped += skipped
+        with self.ride_filter._lock:
+            self.ride_filter.rows_checked += len(df)
+            self.ride_filter.rows_skipped += skipped
+        return df[~known] if skipped else df
+
+    def filter_output(self, output_obj) -> dict[str, pd.DataFrame]:
+        """filter() every frame, leaving out frames with nothing left to load."""
+        filtered = {}
+        for key, df in output_obj.items():
+            kept = self.filter(df)
+            if len(kept) < len(df):
+                logger.info(
+                    f"[{key}] Skipping {len(df) - len(kept)} of {len(df)} rows already loaded"
+                )
+            if len(kept):
+                filtered[key] = kept
+        return filtered
+
+    def commit(self):
+        """Record every row passed by filter() as loaded."""
+        pending, self.pending = self.pending, {}
+        fingerprints_by_month = {
+            month: np.concatenate(parts) for month, parts in pending.items()
+        }
+        self.ride_filter.add(
+            {month: f for month, f in fingerprints_by_month.items() if len(f)}
+        )
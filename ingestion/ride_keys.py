@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+# Every ride_id is 16 hex digits: uppercase as published in the current
+# layout, lowercase as create_ride_id_hash writes the legacy ones.
+RIDE_ID_LENGTH = 16
+
+# A compact ride_id is the 64-bit number its digits spell, held as uint64.
+# The case its digits are written in goes alongside in this boolean column,
+# so each key maps back to exactly the string stored in ride_data, and the
+# pair survives concatenation, pickling and slicing like any other column.
+RIDE_ID_LOWER = "ride_id_lower"
+
+_UPPER_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+_LOWER_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# Value of each ASCII hex digit, -1 for any other byte.
+_NIBBLES = np.full(256, -1, dtype=np.int8)
+for _digits in (_UPPER_DIGITS, _LOWER_DIGITS):
+    _NIBBLES[_digits] = np.arange(16)
+
+
+def has_compact_ride_ids(df: pd.DataFrame) -> bool:
+    """Whether a frame holds its ride_ids as compact keys rather than strings."""
+    return RIDE_ID_LOWER in df.columns
+
+
+def ride_id_keys(values) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Compact keys of a column of ride_id strings and whether each is written
+    in lowercase, or None if any of them is missing, not 16 hex digits, or
+    mixes upper and lower case.
+    """
+    values = np.asarray(values, dtype=object)
+    if len(values) == 0 or pd.isna(values).any():
+        return None
+    try:
+        # One byte more than a ride_id, to catch longer values.
+        raw = values.astype(f"S{RIDE_ID_LENGTH + 1}")
+    except UnicodeEncodeError:
+        return None
+    chars = raw.view(np.uint8).reshape(-1, RIDE_ID_LENGTH + 1)
+    if chars[:, -1].any():
+        return None
+    chars = chars[:, :-1]
+    nibbles = _NIBBLES[chars]
+    # Shorter values are NUL-padded, which is not a digit either.
+    if (nibbles < 0).any():
+        return None
+    upper = ((chars >= ord("A")) & (chars <= ord("F"))).any(axis=1)
+    lower = ((chars >= ord("a")) & (chars <= ord("f"))).any(axis=1)
+    if (upper & lower).any():
+        return None
+    nibbles = nibbles.astype(np.uint8)
+    octets = np.ascontiguousarray((nibbles[:, 0::2] << 4) | nibbles[:, 1::2])
+    keys = octets.view(">u8").ravel().astype(np.uint64)
+    return keys, lower
+
+
+def ride_id_digits(keys, lower) -> np.ndarray:
+    """The ASCII digits of compact keys, as an (n, 16) uint8 array."""
+    keys = np.asarray(keys, dtype=np.uint64)
+    octets = keys.astype(">u8").view(np.uint8).reshape(-1, 8)
+    digits = np.empty((len(keys), RIDE_ID_LENGTH), dtype=np.uint8)
+    digits[:, 0::2] = _UPPER_DIGITS[octets >> 4]
+    digits[:, 1::2] = _UPPER_DIGITS[octets & 0xF]
+    lower = np.asarray(lower, dtype=bool)
+    if lower.any():
+        digits[lower, 0::2] = _LOWER_DIGITS[octets[lower] >> 4]
+        digits[lower, 1::2] = _LOWER_DIGITS[octets[lower] & 0xF]
+    return digits
+
+
+def ride_id_bytes(df: pd.DataFrame) -> np.ndarray:
+    """A frame's ride_ids, in either form, as fixed-width bytes."""
+    if not has_compact_ride_ids(df):
+        return df["ride_id"].to_numpy(object).astype("S")
+    digits = ride_id_digits(df["ride_id"].to_numpy(), df[RIDE_ID_LOWER].to_numpy())
+    return digits.view(f"S{RIDE_ID_LENGTH}").ravel()
+
+
+def ride_id_labels(df: pd.DataFrame) -> np.ndarray:
+    """A frame's ride_ids, in either form, as the strings stored in ride_data."""
+    if not has_compact_ride_ids(df):
+        return df["ride_id"].to_numpy(object)
+    return ride_id_bytes(df).astype(str).astype(object)
+
+
+def with_ride_id_labels(df: pd.DataFrame) -> pd.DataFrame:
+    """df with string ride_ids, as stored in ride_data."""
+    if not has_compact_ride_ids(df):
+        return df
+    return df.assign(ride_id=ride_id_labels(df)).drop(columns=RIDE_ID_LOWER)
+
+
+def ride_id_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    pd.util.hash_array of a frame's ride_id strings, formatting compact keys
+    first, so fingerprints (and the ride filters and diff snapshots built on
+    them) are the same in both modes.
+    """
+    return pd.util.hash_array(ride_id_labels(df), categorize=False)
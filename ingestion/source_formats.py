@@ -0,0 +1,170 @@
+import csv
+import io
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Longest header line read when sniffing a member; trip headers are < 300 bytes.
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class SourceFormat:
+    """
+    A CSV layout the pipeline can read.
+
+    Parameters:
+    name (str): Name used in logs
+    columns (dict): Standard column name -> header names it may appear
+        under, matched case-insensitively in order of preference. Only
+        these columns are read.
+    process (callable): process(df, locale, hash_workers, date_format,
+        **options) turning a frame with standard column names into trips
+    start_column (str): Standard name of the start time column
+    dtypes (dict): Read dtypes by standard column name
+    coordinate_columns (list): Standard names of the coordinate columns,
+        whose dtype streaming fixes per chunk
+    """
+
+    def __init__(
+        self,
+        name,
+        columns,
+        process,
+        start_column,
+        dtypes=None,
+        coordinate_columns=(),
+    ):
+        self.name = name
+        self.columns = columns
+        self.process = process
+        self.start_column = start_column
+        self.dtypes = dtypes or {}
+        self.coordinate_columns = list(coordinate_columns)
+        self._aliases = {
+            standard: [alias.lower() for alias in aliases]
+            for standard, aliases in columns.items()
+        }
+        self._readers = {}
+
+    def match(self, header) -> dict | None:
+        """standard name -> header name for every column, or None if any is missing."""
+        # The first column of a given lowercased name wins, as in a manual lookup.
+        by_lower = {}
+        for column in header:
+            by_lower.setdefault(column.lower(), column)
+        matched = {}
+        for standard, aliases in self._aliases.items():
+            actual = next((by_lower[a] for a in aliases if a in by_lower), None)
+            if actual is None:
+                return None
+            matched[standard] = actual
+        return matched
+
+    def reader(self, header) -> "CsvReader | None":
+        """Compiled reader for a header, cached per distinct header."""
+        header = tuple(header)
+        if header not in self._readers:
+            columns = self.match(header)
+            self._readers[header] = (
+                CsvReader(self, columns) if columns is not None else None
+            )
+        return self._readers[header]
+
+
+class CsvReader:
+    """
+    A SourceFormat bound to one header: usecols, dtypes and the renaming to
+    standard column names are worked out once and reused for every member
+    and chunk with that header.
+    """
+
+    def __init__(self, source_format: SourceFormat, columns: dict):
+        self.format = source_format
+        self.columns = columns
+        self.usecols = list(columns.values())
+        self.dtype = {
+            columns[name]: dtype for name, dtype in source_format.dtypes.items()
+        }
+        self.coordinate_columns = [
+            columns[name] for name in source_format.coordinate_columns
+        ]
+        self._standard_names = {
+            actual: standard for standard, actual in columns.items()
+        }
+
+    def _standardize(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Assigning the labels renames in place, without copying the data.
+        df.columns = [self._standard_names[column] for column in df.columns]
+        return df
+
+    def read_csv(self, csv_file, chunksize=None, coordinate_dtype=None, skip_rows=0):
+        """
+        Read the format's columns from csv_file under their standard names,
+        starting skip_rows rows after the header.
+
+        Returns a DataFrame, or an iterator of DataFrames when chunksize is set.
+        """
+        dtype = dict(self.dtype)
+        if coordinate_dtype is not None:
+            dtype.update(
+                {column: coordinate_dtype for column in self.coordinate_columns}
+            )
+        frames = pd.read_csv(
+            csv_file,
+            usecols=self.usecols,
+            dtype=dtype,
+            chunksize=chunksize,
+            skiprows=range(1, skip_rows + 1) if skip_rows else None,
+        )
+        if chunksize is None:
+            return self._standardize(frames)
+        return (self._standardize(chunk) for chunk in frames)
+
+    def has_missing(self, csv_file, column, chunksize=None) -> bool:
+        """Whether any value of a standard column is missing in csv_file."""
+        chunks = pd.read_csv(
+            csv_file,
+            usecols=[self.columns[column]],
+            dtype=str,
+            chunksize=chunksize or 1_000_000,
+        )
+        return any(chunk.iloc[:, 0].isna().any() for chunk in chunks)
+
+    def process(
+        self, df, locale, hash_workers=1, date_format=None, **options
+    ) -> pd.DataFrame:
+        """format.process, with any format-specific options passed through."""
+        return self.format.process(df, locale, hash_workers, date_format, **options)
+
+
+# Tried in registration order; the first format whose columns all match wins.
+SOURCE_FORMATS: list[SourceFormat] = []
+
+
+def register_format(source_format: SourceFormat) -> SourceFormat:
+    SOURCE_FORMATS.append(source_format)
+    return source_format
+
+
+def reader_for_header(header) -> CsvReader | None:
+    """Reader of the first registered format matching header, if any."""
+    for source_format in SOURCE_FORMATS:
+        reader = source_format.reader(header)
+        if reader is not None:
+            return reader
+    return None
+
+
+def read_header(zip_ref, member) -> list[str]:
+    """
+    Column names of a CSV member, from its first line only.
+
+    Only the first compressed block or so is inflated, so a member can be
+    rejected without decompressing the rest of it.
+    """
+    with zip_ref.open(member) as raw:
+        line = raw.readline(MAX_HEADER_BYTES)
+    text = line.decode("utf-8-sig", errors="replace")
+    return next(csv.reader(io.StringIO(text)), [])
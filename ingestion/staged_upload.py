@@ -0,0 +1,283 @@
+import logging
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from copy_helpers import copy_columns, copy_source, copy_sql
+from instrumentation import record, stage
+from od_aggregates import (
+    ODCounter,
+    apply_monthly_deltas,
+    count_od_pairs,
+    od_counts_from_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# Unique constraint of ride_data that upserts resolve conflicts on.
+RIDE_DATA_CONFLICT_COLUMNS = ["ride_id", "start_date", "locale"]
+
+
+class StagedFileUpload:
+    """
+    Upload every chunk of one source file through a single staging table.
+
+    Chunks are COPYed into the staging table as they arrive; merge() then runs
+    one INSERT ... ON CONFLICT per month, each covering a single
+    ride_data_YYYY_MM partition. Everything happens in one transaction that
+    commits when the block exits cleanly, so a file is either fully uploaded
+    or not at all.
+
+        with StagedFileUpload(conn, "ride_data") as upload:
+            for chunk in chunks:
+                upload.copy(chunk)
+            upload.merge()
+
+    With aggregate_od, the file's origin-destination counts are applied to
+    citi-bike-monthly in the same transaction: counts of the new rows are
+    taken from the frames as they are copied, minus the counts of any stored
+    rows the merge overwrites or deletes.
+
+    Rows passed to delete() are removed from ride_data in the same
+    transaction, before the month's merge.
+    """
+
+    def __init__(self, conn, table_name: str, copy_format="csv", aggregate_od=False):
+        self.conn = conn
+        self.table_name = table_name
+        self.copy_format = copy_format
+        self.staging_table = f"staging_{table_name}_{int(datetime.now().timestamp())}"
+        self.removed_table = None
+        self.columns = None
+        self.rows_copied = 0
+        self.rows_removed = 0
+        self.rows_merged = 0
+        self.rows_deleted = 0
+        self.copy_seconds = 0.0
+        self.merge_seconds = 0.0
+        self.od_counts = ODCounter() if aggregate_od else None
+        self.cur = None
+
+    def __enter__(self):
+        self.cur = self.conn.cursor()
+        # No indexes: the same ride can appear in several chunks of a file, and
+        # merge() resolves those duplicates itself. LIKE copies id's NOT NULL
+        # but not its identity, so id is dropped: the merge leaves it to the
+        # parent table to generate.
+        self.cur.execute(
+            f"""
+            CREATE TEMP TABLE {self.staging_table} (LIKE {self.table_name} INCLUDING DEFAULTS)
+            ON COMMIT DROP
+            """
+        )
+        self.cur.execute(f"ALTER TABLE {self.staging_table} DROP COLUMN id")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                with stage("commit"):
+                    self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.cur.close()
+        return False
+
+    def copy(self, df: pd.DataFrame):
+        """COPY a chunk into the staging table."""
+        if len(df) == 0:
+            return
+        columns = copy_columns(df)
+        if self.columns is None:
+            self.columns = columns
+        elif columns != self.columns:
+            raise ValueError(f"Chunk columns {columns} do not match {self.columns}")
+
+        if self.od_counts is not None:
+            self.od_counts.add(count_od_pairs(df))
+
+        start = time.perf_counter()
+        self.cur.copy_expert(
+            copy_sql(self.staging_table, columns, self.copy_format),
+            copy_source(df, self.copy_format),
+        )
+        elapsed = time.perf_counter() - start
+        record("copy", elapsed, rows=len(df))
+        self.copy_seconds += elapsed
+        self.rows_copied += len(df)
+
+    def delete(self, keys: pd.DataFrame):
+        """Stage ride_data keys (ride_id, start_date, locale) to delete in merge()."""
+        if len(keys) == 0:
+            return
+        if self.removed_table is None:
+            self.removed_table = f"{self.staging_table}_removed"
+            self.cur.execute(
+                f"""
+                CREATE TEMP TABLE {self.removed_table} ON COMMIT DROP AS
+                SELECT {", ".join(RIDE_DATA_CONFLICT_COLUMNS)} FROM {self.table_name}
+                WITH NO DATA
+                """
+            )
+        keys = keys[RIDE_DATA_CONFLICT_COLUMNS]
+        with stage("copy_removed", rows=len(keys)):
+            self.cur.copy_expert(
+                copy_sql(self.removed_table, keys.columns, self.copy_format),
+                copy_source(keys, self.copy_format),
+            )
+        self.rows_removed += len(keys)
+
+    def merge(self):
+        """Delete removed rows and upsert the staged rows, month by month."""
+        if not self.rows_copied and not self.rows_removed:
+            return {"total_processed": 0}
+
+        start = time.perf_counter()
+        months = set()
+        for table, n_rows in (
+            (self.staging_table, self.rows_copied),
+            (self.removed_table, self.rows_removed),
+        ):
+            if n_rows:
+                self.cur.execute(
+                    f"SELECT DISTINCT date_trunc('month', start_date)::date FROM {table}"
+                )
+                months.update(row[0] for row in self.cur.fetchall())
+        months = sorted(month for month in months if month is not None)
+        for month in months:
+            target = self._partition_for(month)
+            if self.rows_removed:
+                self._delete_month(target, month)
+            if self.od_counts is not None and self.rows_copied:
+                self.od_counts.subtract(self._replaced_od_counts(target, month))
+            if self.rows_copied:
+                self.rows_merged += self._merge_month(month)
+        if self.od_counts is not None:
+            apply_monthly_deltas(self.cur, self.od_counts.total())
+        elapsed = time.perf_counter() - start
+        record("merge", elapsed, rows=self.rows_copied + self.rows_removed)
+        self.merge_seconds += elapsed
+
+        logger.info(
+            f"Merged {self.rows_merged} of {self.rows_copied} staged records into "
+            f"{self.table_name} ({len(months)} months): "
+            f"COPY {self.copy_seconds:.2f}s, merge {self.merge_seconds:.2f}s"
+        )
+        if self.rows_removed:
+            logger.info(
+                f"Deleted {self.rows_deleted} of {self.rows_removed} removed records from {self.table_name}"
+            )
+        return {
+            "total_processed": self.rows_merged,
+            "total_deleted": self.rows_deleted,
+            "copy_seconds": self.copy_seconds,
+            "merge_seconds": self.merge_seconds,
+        }
+
+    def _merge_month(self, month) -> int:
+        columns = ", ".join(self.columns)
+        conflict = ", ".join(RIDE_DATA_CONFLICT_COLUMNS)
+        set_clause = ", ".join(
+            f"{col} = EXCLUDED.{col}"
+            for col in self.columns
+            if col not in RIDE_DATA_CONFLICT_COLUMNS
+        )
+        # A ride staged twice would make ON CONFLICT update the same row twice,
+        # which Postgres rejects. Keep the last copy, as successive per-chunk
+        # upserts would have. ctid follows insertion order in the staging table.
+        # Rows go in through the parent, which routes them by start_date: only
+        # it generates ids, and the partitions' id has no default.
+        self.cur.execute(
+            f"""
+            INSERT INTO {self.table_name} ({columns})
+            SELECT DISTINCT ON ({conflict}) {columns}
+            FROM {self.staging_table}
+            WHERE start_date >= %(month)s
+              AND start_date < %(month)s + INTERVAL '1 month'
+            ORDER BY {conflict}, ctid DESC
+            ON CONFLICT ({conflict})
+            DO UPDATE SET {set_clause}
+            """,
+            {"month": month},
+        )
+        return self.cur.rowcount
+
+    def _delete_month(self, target, month):
+        """Delete a month's removed rows, subtracting their OD counts."""
+        conflict = ", ".join(RIDE_DATA_CONFLICT_COLUMNS)
+        self.cur.execute(
+            f"""
+            WITH deleted AS (
+                DELETE FROM {target} r
+                USING (
+                    SELECT DISTINCT {conflict}
+                    FROM {self.removed_table}
+                    WHERE start_date >= %(month)s
+                      AND start_date < %(month)s + INTERVAL '1 month'
+                ) d
+                WHERE (r.ride_id, r.start_date, r.locale) = (d.ride_id, d.start_date, d.locale)
+                RETURNING r.h3_cell_start, r.h3_cell_end
+            )
+            SELECT h3_cell_start, h3_cell_end, count(*)
+            FROM deleted
+            GROUP BY h3_cell_start, h3_cell_end
+            """,
+            {"month": month},
+        )
+        rows = self.cur.fetchall()
+        self.rows_deleted += sum(row[2] for row in rows)
+        if self.od_counts is not None:
+            self.od_counts.subtract(
+                od_counts_from_rows(
+                    (row for row in rows if row[0] is not None and row[1] is not None),
+                    month,
+                )
+            )
+
+    def _replaced_od_counts(self, target, month) -> pd.Series:
+        """
+        OD counts of the rows a month's merge replaces: rides already stored in
+        the target, and staged copies superseded by a later copy of the ride.
+        """
+        conflict = ", ".join(RIDE_DATA_CONFLICT_COLUMNS)
+        self.cur.execute(
+            f"""
+            SELECT h3_cell_start, h3_cell_end, count(*)
+            FROM (
+                SELECT r.h3_cell_start, r.h3_cell_end
+                FROM {target} r
+                JOIN (
+                    SELECT DISTINCT {conflict}
+                    FROM {self.staging_table}
+                    WHERE start_date >= %(month)s
+                      AND start_date < %(month)s + INTERVAL '1 month'
+                ) s USING ({conflict})
+                UNION ALL
+                SELECT h3_cell_start, h3_cell_end
+                FROM (
+                    SELECT h3_cell_start, h3_cell_end, row_number() OVER (
+                        PARTITION BY {conflict} ORDER BY ctid DESC
+                    ) AS copy_rank
+                    FROM {self.staging_table}
+                    WHERE start_date >= %(month)s
+                      AND start_date < %(month)s + INTERVAL '1 month'
+                ) staged
+                WHERE copy_rank > 1
+            ) replaced
+            WHERE h3_cell_start IS NOT NULL AND h3_cell_end IS NOT NULL
+            GROUP BY h3_cell_start, h3_cell_end
+            """,
+            {"month": month},
+        )
+        return od_counts_from_rows(self.cur.fetchall(), month)
+
+    def _partition_for(self, month) -> str:
+        """The month's partition, or the parent table if it has none yet."""
+        partition = f"{self.table_name}_{month:%Y_%m}"
+        self.cur.execute("SELECT to_regclass(%s)", (partition,))
+        if self.cur.fetchone()[0] is None:
+            logger.info(f"No partition {partition}, merging into {self.table_name}")
+            return self.table_name
+        return partition
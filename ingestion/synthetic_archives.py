@@ -0,0 +1,255 @@
+import calendar
+import io
+import logging
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Headers of the layouts Citi Bike has published, as they appear in the CSVs.
+LAYOUTS = {
+    # 2021-02 onwards, NYC and JC
+    "current": [
+        "ride_id",
+        "rideable_type",
+        "started_at",
+        "ended_at",
+        "start_station_name",
+        "start_station_id",
+        "end_station_name",
+        "end_station_id",
+        "start_lat",
+        "start_lng",
+        "end_lat",
+        "end_lng",
+        "member_casual",
+    ],
+    # 2013 to 2016-09
+    "legacy_lower": [
+        "tripduration",
+        "starttime",
+        "stoptime",
+        "start station id",
+        "start station name",
+        "start station latitude",
+        "start station longitude",
+        "end station id",
+        "end station name",
+        "end station latitude",
+        "end station longitude",
+        "bikeid",
+        "usertype",
+        "birth year",
+        "gender",
+    ],
+    # 2016-10 to 2021-01, and JC throughout
+    "legacy_title": [
+        "Trip Duration",
+        "Start Time",
+        "Stop Time",
+        "Start Station ID",
+        "Start Station Name",
+        "Start Station Latitude",
+        "Start Station Longitude",
+        "End Station ID",
+        "End Station Name",
+        "End Station Latitude",
+        "End Station Longitude",
+        "Bike ID",
+        "User Type",
+        "Birth Year",
+        "Gender",
+    ],
+}
+
+# strftime formats of the start / stop times, by date_parsing.DATE_FORMATS name.
+TIME_FORMATS = {
+    "iso": "%Y-%m-%d %H:%M:%S",
+    "us_seconds": "%-m/%-d/%Y %-H:%M:%S",
+    "us_minutes": "%-m/%-d/%Y %-H:%M",
+}
+
+# Rough service areas and station counts.
+SERVICE_AREAS = {
+    "NYC": {"lat": (40.63, 40.88), "lng": (-74.03, -73.86), "stations": 2_000},
+    "JC": {"lat": (40.69, 40.76), "lng": (-74.09, -74.02), "stations": 80},
+}
+
+# Bikes in service; legacy ride_ids hash start time and bike id together.
+N_BIKES = 30_000
+
+
+def archive_name(locale, year, month=None, nested=False) -> str:
+    """Bucket key of an archive: yearly ones hold a nested zip per month."""
+    period = f"{year}" if nested or month is None else f"{year}{month:02d}"
+    prefix = "JC-" if locale == "JC" else ""
+    suffix = ".csv.zip" if locale == "JC" else ".zip"
+    return f"{prefix}{period}-citibike-tripdata{suffix}"
+
+
+def synthetic_trip_csv(
+    layout,
+    n_rows,
+    year,
+    month,
+    locale="NYC",
+    time_format="iso",
+    duplicate_rate=0.0,
+    null_rate=0.001,
+    seed=0,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Rows of one published trip CSV for a month, in the given layout.
+
+    Every ride is distinct as the pipeline keys it: ride_ids are unique in
+    the current layout, and (start time, bike id) pairs are in the legacy
+    ones, at the resolution time_format prints. A duplicate_rate share of
+    the rows then repeats an earlier row, as the published files do now and
+    then, and a null_rate share has no end coordinates.
+
+    Returns:
+    tuple: (DataFrame, number of distinct rides in it)
+    """
+    rng = np.random.default_rng(seed)
+    area = SERVICE_AREAS[locale]
+    n_stations = area["stations"]
+    station_lat = rng.uniform(*area["lat"], n_stations).round(6)
+    station_lng = rng.uniform(*area["lng"], n_stations).round(6)
+
+    n_duplicates = int(n_rows * duplicate_rate)
+    n_rides = n_rows - n_duplicates
+    step = 60 if time_format == "us_minutes" else 1
+    n_slots = calendar.monthrange(year, month)[1] * 24 * 3600 // step
+    # Unique (start slot, bike) pairs keep the legacy ride_id hashes distinct.
+    keys = rng.choice(n_slots * N_BIKES, n_rides, replace=False)
+    seconds = (keys // N_BIKES) * step
+    bike_id = 14_000 + keys % N_BIKES
+    duration = rng.integers(120, 3_600, n_rides)
+    start = rng.integers(0, n_stations, n_rides)
+    end = rng.integers(0, n_stations, n_rides)
+    end_lat = station_lat[end]
+    end_lng = station_lng[end]
+    missing = rng.random(n_rides) < null_rate
+    end_lat[missing] = np.nan
+    end_lng[missing] = np.nan
+
+    started = pd.Timestamp(year, month, 1) + pd.to_timedelta(seconds, unit="s")
+    stopped = started + pd.to_timedelta(duration, unit="s")
+    started = started.strftime(TIME_FORMATS[time_format])
+    stopped = stopped.strftime(TIME_FORMATS[time_format])
+
+    if layout == "current":
+        ride_id = [f"{x:016X}" for x in rng.integers(0, 2**63, n_rides).tolist()]
+        columns = [
+            ride_id,
+            rng.choice(["classic_bike", "electric_bike"], n_rides),
+            started,
+            stopped,
+            "W 21 St & 6 Ave",
+            (5_000 + start).astype(str),
+            "Broadway & E 14 St",
+            (5_000 + end).astype(str),
+            station_lat[start],
+            station_lng[start],
+            end_lat,
+            end_lng,
+            rng.choice(["member", "casual"], n_rides),
+        ]
+    else:
+        columns = [
+            duration,
+            started,
+            stopped,
+            3_000 + start,
+            "W 21 St & 6 Ave",
+            station_lat[start],
+            station_lng[start],
+            3_000 + end,
+            "Broadway & E 14 St",
+            end_lat,
+            end_lng,
+            bike_id,
+            rng.choice(["Subscriber", "Customer"], n_rides),
+            rng.integers(1950, 2005, n_rides),
+            rng.integers(0, 3, n_rides),
+        ]
+    df = pd.DataFrame(dict(zip(LAYOUTS[layout], columns)))
+    if n_duplicates:
+        repeats = df.iloc[rng.integers(0, n_rides, n_duplicates)]
+        df = pd.concat([df, repeats]).iloc[rng.permutation(n_rows)]
+    return df.reset_index(drop=True), n_rides
+
+
+def _zip_csv(csv_name, df) -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(csv_name, df.to_csv(index=False))
+    return data.getvalue()
+
+
+def write_archive(
+    directory,
+    layout="current",
+    n_rows=100_000,
+    locale="NYC",
+    year=2024,
+    month=5,
+    nested=False,
+    n_months=3,
+    time_format="iso",
+    duplicate_rate=0.0,
+    null_rate=0.001,
+    seed=0,
+) -> tuple[Path, int]:
+    """
+    Write a trip archive the way Citi Bike publishes it.
+
+    A flat archive is a monthly zip of one CSV. A nested one is a yearly zip
+    of n_months monthly zips, starting at month, with n_rows split between
+    them and stored uncompressed. A flat archive also holds a station list
+    CSV, which the pipeline has to skip.
+
+    Returns:
+    tuple: (path of the archive, distinct rides it holds)
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / archive_name(locale, year, month, nested)
+    months = range(month, month + n_months) if nested else [month]
+    stations = pd.DataFrame({"station_id": np.arange(100), "name": "W 21 St & 6 Ave"})
+    n_rides = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for i, member_month in enumerate(months):
+            df, member_rides = synthetic_trip_csv(
+                layout,
+                n_rows // len(months),
+                year,
+                member_month,
+                locale,
+                time_format,
+                duplicate_rate,
+                null_rate,
+                seed=seed + i,
+            )
+            n_rides += member_rides
+            csv_name = f"{year}{member_month:02d}-citibike-tripdata.csv"
+            if locale == "JC":
+                csv_name = f"JC-{csv_name}"
+            if nested:
+                zip_ref.writestr(
+                    f"{csv_name.removesuffix('.csv')}.zip",
+                    _zip_csv(csv_name, df),
+                    compress_type=zipfile.ZIP_STORED,
+                )
+            else:
+                zip_ref.writestr(csv_name, df.to_csv(index=False))
+        if not nested:
+            zip_ref.writestr("stations.csv", stations.to_csv(index=False))
+    logger.info(
+        f"Wrote {path.name}: {layout}, {n_rows} rows, {n_rides} rides, "
+        f"{path.stat().st_size / 2**20:.1f} MB"
+    )
+    return path, n_rides
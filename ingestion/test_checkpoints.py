@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+import psycopg2
+import pytest
+
+from benchmark import (
+    E2E_SCHEMA,
+    _create_e2e_schema,
+    _drop_e2e_schema,
+    write_published_archive,
+)
+from checkpoints import FileCheckpoint
+
+DSN = os.environ.get("BENCH_PG_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="set BENCH_PG_DSN to a local Postgres")
+
+FILE = pd.Series(
+    {"file_name": "202405-citibike-tripdata.zip", "locale": "NYC", "etag": "v1"}
+)
+
+
+@pytest.fixture
+def processor(tmp_path):
+    from processor import BikeShareProcessor
+
+    _create_e2e_schema(DSN, [pd.Timestamp(2024, 5, 1)])
+    processor = BikeShareProcessor(
+        conn_details={"dsn": DSN, "options": f"-c search_path={E2E_SCHEMA}"},
+        supabase_client=None,
+        stream_chunk_size=100,
+        download_cache_dir=tmp_path,
+        checkpoints=True,
+    )
+    # Already downloaded, so the cache never goes to the network.
+    path = processor.download_cache.path_for(FILE["file_name"], FILE["etag"])
+    path.write_bytes(write_published_archive(250))
+    yield processor
+    processor.db_pool.close()
+    _drop_e2e_schema(DSN)
+
+
+def _committed(processor):
+    with processor.db_pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM ride_data")
+        n_rows = cur.fetchone()[0]
+        cur.execute("SELECT coalesce(sum(rows), 0) FROM ingest_checkpoints")
+        checkpoint_rows = cur.fetchone()[0]
+        conn.rollback()
+    return n_rows, checkpoint_rows
+
+
+def test_checkpoint_commits_with_its_chunk(processor, monkeypatch):
+    record_chunk = FileCheckpoint.record_chunk
+    calls = []
+
+    def fail_second_chunk(self, cur, member, rows):
+        calls.append(member)
+        if len(calls) == 2:
+            raise psycopg2.OperationalError("connection lost")
+        record_chunk(self, cur, member, rows)
+
+    monkeypatch.setattr(FileCheckpoint, "record_chunk", fail_second_chunk)
+    with pytest.raises(psycopg2.OperationalError):
+        with processor.db_pool.connection() as conn:
+            processor.process_file_streaming(FILE, conn)
+    assert _committed(processor) == (100, 100)
+
+    monkeypatch.setattr(FileCheckpoint, "record_chunk", record_chunk)
+    with processor.db_pool.connection() as conn:
+        assert processor.process_file_streaming(FILE, conn) == 250
+    assert _committed(processor) == (250, 250)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_dates
+
+
+def test_iso_dates():
+    values = ["2014-01-01 00:00:06", "2016-01-01 00:00:41.0000", "2021-02-28"]
+    expected = np.array(["2014-01-01", "2016-01-01", "2021-02-28"], "datetime64[D]")
+    assert (parse_dates(values, "iso") == expected).all()
+
+
+def test_iso_stray_values_fall_back():
+    # numpy's string cast crashed on a bad value past the first ~1000 rows.
+    values = ["2016-01-01 00:00:00"] * 1_000 + [
+        "1/2/2016 0:01",
+        "started_at",
+        "NULL",
+        "2021-02-30 00:00:00",
+        "2016-13-01",
+        None,
+    ]
+    days = parse_dates(values, "iso")
+    assert (days[:1_000] == np.datetime64("2016-01-01")).all()
+    assert days[1_000] == np.datetime64("2016-01-02")
+    assert np.isnat(days[1_001:]).all()
+
+
+def test_us_dates_match_pandas():
+    values = pd.Series(["1/1/2015 0:01:26", "12/31/2015 23:59:59", "2/29/2016 1:00:00"])
+    expected = pd.to_datetime(values).to_numpy().astype("datetime64[D]")
+    assert (parse_dates(values, "us_seconds") == expected).all()
@@ -0,0 +1,59 @@
+import os
+
+from download_cache import DownloadCache
+
+
+def test_prune_stale_keeps_other_files(tmp_path):
+    cache = DownloadCache(tmp_path)
+    current = cache.path_for("202510-citibike-tripdata.zip", "v2")
+    stale = cache.path_for("202510-citibike-tripdata.zip", "v1")
+    jc = cache.path_for("JC-202510-citibike-tripdata.zip", "v1")
+    for path in (current, stale, jc):
+        path.write_bytes(b"zip")
+
+    cache._prune_stale(current)
+
+    assert sorted(tmp_path.iterdir()) == sorted([current, jc])
+
+
+def _cached(cache, name, size, mtime):
+    path = cache.path_for(name, "v1")
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=250)
+    oldest = _cached(cache, "a.zip", 100, 1)
+    middle = _cached(cache, "b.zip", 100, 2)
+    newest = _cached(cache, "c.zip", 100, 3)
+
+    cache._evict()
+
+    assert sorted(tmp_path.iterdir()) == sorted([middle, newest])
+    assert not oldest.exists()
+
+
+def test_keeps_entries_in_use(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=0)
+    path = _cached(cache, "a.zip", 100, 1)
+    cache._in_use[path] = 2
+
+    cache.release(path)
+    assert path.exists()
+
+    cache.release(path)
+    assert not path.exists()
+
+
+def test_fetch_hit_pins_entry(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=0)
+    path = _cached(cache, "a.zip", 100, 1)
+
+    assert cache.fetch("a.zip", etag="v1") == path
+    cache._evict()
+    assert path.exists()
+
+    cache.release(path)
+    assert not path.exists()
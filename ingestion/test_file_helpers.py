@@ -0,0 +1,96 @@
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from file_helpers import (
+    create_ride_id_hash,
+    create_ride_id_hashes,
+    process_csv_member,
+    stream_csv_member,
+)
+
+LEGACY_HEADER = (
+    "starttime,bikeid,start station latitude,start station longitude,"
+    "end station latitude,end station longitude"
+)
+
+
+def _archive(lines):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("trips.csv", "\n".join([LEGACY_HEADER, *lines]) + "\n")
+    return zipfile.ZipFile(buffer)
+
+
+def _legacy_lines(n, missing_bike_id=None):
+    lines = [
+        f"2016-01-01 00:00:{i:02d},{17000 + i},40.7484405,-73.9856644,"
+        f"40.68917525,-73.98367119"
+        for i in range(n)
+    ]
+    if missing_bike_id is not None:
+        lines[missing_bike_id] = (
+            f"2016-01-01 00:00:{missing_bike_id:02d},,"
+            "40.7484405,-73.9856644,40.68917525,-73.98367119"
+        )
+    return lines
+
+
+def test_streamed_chunks_match_whole_member():
+    # The gap is in the last chunk, after the first ones have been hashed.
+    zip_ref = _archive(_legacy_lines(6, missing_bike_id=4))
+
+    whole = process_csv_member(zip_ref, "trips.csv", "NYC")
+    streamed = pd.concat(
+        stream_csv_member(zip_ref, "trips.csv", "NYC", chunksize=2),
+        ignore_index=True,
+    )
+
+    assert streamed["ride_id"].tolist() == whole["ride_id"].tolist()
+    for column in ("start_lat", "start_lng", "end_lat", "end_lng"):
+        assert streamed[column].tolist() == whole[column].tolist()
+    assert whole["start_lat"].dtype == "float64"
+
+
+@pytest.mark.parametrize(
+    "missing_bike_id, ride_id",
+    [
+        # Rows loaded from a member with gaps hashed read_csv's float ids.
+        (4, "d5ebbe0f7c3cd339"),  # "2016-01-01 00:00:00_17000.0"
+        (None, "be5fc4ff496b6326"),  # "2016-01-01 00:00:00_17000"
+    ],
+)
+def test_legacy_ride_ids_match_loaded_rows(missing_bike_id, ride_id):
+    zip_ref = _archive(_legacy_lines(6, missing_bike_id))
+    whole = process_csv_member(zip_ref, "trips.csv", "NYC")
+    streamed = next(stream_csv_member(zip_ref, "trips.csv", "NYC", chunksize=2))
+    assert whole["ride_id"].iloc[0] == ride_id
+    assert streamed["ride_id"].iloc[0] == ride_id
+
+
+def _expected_hashes(start_time, bike_id):
+    rows = pd.DataFrame({"start_time": start_time, "bike_id": bike_id})
+    return rows.apply(create_ride_id_hash, axis=1).tolist()
+
+
+@pytest.mark.parametrize(
+    "bike_id",
+    [
+        pd.Series([14529, 17109, 20342, 14529, 33512]),
+        pd.Series([14529.0, np.nan, 20342.0, 14529.0, 33512.0]),
+        pd.Series(["14529", "17109", None, "B-20342", "33512"]),
+    ],
+    ids=["int", "float_with_nan", "str"],
+)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ride_id_hashes_match_row_hash(bike_id, workers):
+    start_time = pd.Series(
+        [f"2016-01-0{i + 1} 00:00:0{i}" for i in range(len(bike_id))],
+        index=bike_id.index,
+    )
+    hashes = create_ride_id_hashes(start_time, bike_id, workers=workers, chunk_size=2)
+    assert hashes.tolist() == _expected_hashes(start_time, bike_id)
+    assert hashes.index.equals(start_time.index)
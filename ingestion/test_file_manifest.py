@@ -0,0 +1,49 @@
+import pandas as pd
+
+from file_manifest import ManifestWriter
+
+
+class _Table:
+    def __init__(self, batches):
+        self.batches = batches
+
+    def upsert(self, batch, **kwargs):
+        self.batches.append(batch)
+        return self
+
+    def execute(self):
+        pass
+
+
+class _Client:
+    def __init__(self):
+        self.batches = []
+
+    def table(self, name):
+        return _Table(self.batches)
+
+
+def _file(name):
+    return pd.Series({"file_name": name, "locale": "nyc", "etag": '"abc"'})
+
+
+def test_flushes_once_the_interval_passes():
+    client = _Client()
+    writer = ManifestWriter(client, batch_size=100, flush_interval=0)
+    writer.record(_file("a.zip"), 10)
+    writer.record(_file("b.zip"), 20)
+    assert [[r["file_name"] for r in batch] for batch in client.batches] == [
+        ["a.zip"],
+        ["b.zip"],
+    ]
+
+
+def test_buffers_within_the_interval():
+    client = _Client()
+    writer = ManifestWriter(client, batch_size=2, flush_interval=3600)
+    writer.record(_file("a.zip"))
+    assert client.batches == []
+    writer.record(_file("b.zip"))
+    writer.record(_file("c.zip"))
+    writer.flush()
+    assert [len(batch) for batch in client.batches] == [2, 1]
@@ -0,0 +1,27 @@
+from geo_helpers import H3CellCache
+
+
+def test_cell_cache_round_trips_without_npz_suffix(tmp_path):
+    cache = H3CellCache(path=tmp_path / "h3_cache")
+    cache.lookup([40.7484405], [-73.9856644])
+    cache.save()
+
+    reloaded = H3CellCache(path=tmp_path / "h3_cache")
+    assert reloaded.cells == cache.cells
+    assert (tmp_path / "h3_cache.npz").exists()
+
+
+def test_cell_cache_merges_new_cells(tmp_path):
+    parent = H3CellCache(path=tmp_path / "h3_cache")
+    parent.lookup([40.7484405], [-73.9856644])
+    worker = H3CellCache()
+    worker.merge(parent.cells)
+
+    worker.lookup([40.7484405, 40.7061927], [-73.9856644, -74.0091604])
+    new = worker.take_new()
+    assert len(new) == 1
+    assert worker.take_new() == {}
+
+    parent.merge(new)
+    parent.save()
+    assert H3CellCache(path=tmp_path / "h3_cache").cells == worker.cells
@@ -0,0 +1,27 @@
+import json
+import threading
+
+from instrumentation import RunReport
+
+
+def test_concurrent_writes(tmp_path):
+    report = RunReport(tmp_path / "run_report")
+    errors = []
+
+    def finish_files(worker):
+        try:
+            for i in range(50):
+                with report.file(f"{worker}-{i}.zip", reset_rss=False) as stats:
+                    stats.rows = 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=finish_files, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(tmp_path / "run_report.json") as f:
+        assert json.load(f)["rows"] == 200
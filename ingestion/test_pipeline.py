@@ -0,0 +1,18 @@
+import pipeline
+from benchmark import write_published_archive
+
+
+def test_parse_file_returns_new_cells(tmp_path):
+    path = tmp_path / "202405-citibike-tripdata.zip"
+    path.write_bytes(write_published_archive(200))
+    pipeline._init_parse_worker(9, {})
+
+    output, _, _, error, new_cells = pipeline._parse_file(
+        path, path.name, "NYC", hash_workers=1
+    )
+    assert error is None and output
+    assert new_cells and new_cells == pipeline._worker_cell_cache.cells
+
+    # A second file only sends the cells the worker had not seen yet.
+    *_, new_cells = pipeline._parse_file(path, path.name, "NYC", hash_workers=1)
+    assert new_cells == {}
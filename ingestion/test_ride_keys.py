@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from copy_helpers import COPY_FORMATS, copy_source
+from ride_keys import (
+    RIDE_ID_LOWER,
+    ride_id_hashes,
+    ride_id_keys,
+    ride_id_labels,
+)
+
+
+def _ride_ids(n, case, seed=0):
+    alphabet = b"0123456789ABCDEF" if case == "upper" else b"0123456789abcdef"
+    picks = np.random.default_rng(seed).integers(0, 16, size=(n, 16))
+    digits = np.frombuffer(alphabet, dtype="S1")[picks]
+    ride_ids = digits.view("S16").ravel().astype(str).astype(object)
+    # The extremes of the key range.
+    ride_ids[:2] = [alphabet[:1].decode() * 16, alphabet[-1:].decode() * 16]
+    return ride_ids
+
+
+def _compact(ride_ids):
+    keys, lower = ride_id_keys(ride_ids)
+    return pd.DataFrame({"ride_id": keys, RIDE_ID_LOWER: lower})
+
+
+@pytest.mark.parametrize("case", ["upper", "lower"])
+def test_keys_round_trip(case):
+    ride_ids = _ride_ids(1_000, case)
+    df = _compact(ride_ids)
+    assert df["ride_id"].dtype == np.uint64
+    assert ride_id_labels(df).tolist() == ride_ids.tolist()
+
+
+def test_concat_keeps_case_and_keys():
+    upper = _ride_ids(100, "upper", seed=1)
+    lower = _ride_ids(100, "lower", seed=2)
+    df = pd.concat([_compact(upper), _compact(lower)], ignore_index=True)
+    assert df["ride_id"].dtype == np.uint64
+    assert ride_id_labels(df).tolist() == [*upper, *lower]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [["abc"], ["0123456789ABCDEF", None], ["0123456789ABCDEf"], ["0123456789ABCDEF0"]],
+)
+def test_keys_reject_other_values(values):
+    assert ride_id_keys(values) is None
+
+
+def test_hashes_match_strings():
+    ride_ids = np.concatenate([_ride_ids(500, "upper"), _ride_ids(500, "lower")])
+    expected = pd.util.hash_array(ride_ids, categorize=False)
+    assert (ride_id_hashes(_compact(ride_ids)) == expected).all()
+    assert (ride_id_hashes(pd.DataFrame({"ride_id": ride_ids})) == expected).all()
+
+
+@pytest.mark.parametrize("copy_format", COPY_FORMATS)
+def test_copy_payload_matches_strings(copy_format):
+    ride_ids = np.concatenate([_ride_ids(50, "upper"), _ride_ids(50, "lower")])
+    strings = pd.DataFrame({"ride_id": ride_ids, "locale": "NYC"})
+    compact = _compact(ride_ids).assign(locale="NYC")
+    assert (
+        copy_source(compact, copy_format).read()
+        == copy_source(strings, copy_format).read()
+    )
@@ -0,0 +1,143 @@
+import os
+
+import pandas as pd
+import pytest
+
+from benchmark import E2E_SCHEMA, _create_e2e_schema, _drop_e2e_schema
+from file_diff import FileSnapshots
+from ride_keys import RIDE_ID_LOWER, ride_id_keys
+from staged_upload import StagedFileUpload
+
+DSN = os.environ.get("BENCH_PG_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="set BENCH_PG_DSN to a local Postgres")
+
+
+@pytest.fixture
+def conn():
+    import psycopg2
+
+    # ride_data as the migrations create it: identity on the parent only.
+    _create_e2e_schema(DSN, [pd.Timestamp(2024, 5, 1), pd.Timestamp(2024, 6, 1)])
+    conn = psycopg2.connect(DSN, options=f"-c search_path={E2E_SCHEMA}")
+    yield conn
+    conn.close()
+    _drop_e2e_schema(DSN)
+
+
+def _rides(ride_ids, cell="89283082803ffff"):
+    return pd.DataFrame(
+        {
+            "ride_id": ride_ids,
+            "start_date": pd.to_datetime(["2024-05-31", "2024-06-01"] * 2)[
+                : len(ride_ids)
+            ].date,
+            "locale": "NYC",
+            "h3_cell_start": cell,
+            "h3_cell_end": cell,
+        }
+    )
+
+
+def _stored(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT ride_id, h3_cell_start, id IS NOT NULL FROM ride_data ORDER BY ride_id"
+        )
+        return cur.fetchall()
+
+
+@pytest.mark.parametrize("copy_format", ["csv", "binary"])
+def test_merge_generates_ids_and_upserts(conn, copy_format):
+    with StagedFileUpload(conn, "ride_data", copy_format) as upload:
+        upload.copy(_rides(["A", "B"]))
+        upload.merge()
+    with StagedFileUpload(conn, "ride_data", copy_format) as upload:
+        upload.copy(_rides(["A", "B", "C"], cell="89283082807ffff"))
+        upload.merge()
+
+    assert _stored(conn) == [
+        ("A", "89283082807ffff", True),
+        ("B", "89283082807ffff", True),
+        ("C", "89283082807ffff", True),
+    ]
+
+
+@pytest.mark.parametrize("copy_format", ["csv", "binary"])
+def test_merge_compact_ride_ids(conn, copy_format):
+    ride_ids = ["00000000000000AB", "00000000000000ab", "0000000000000012"]
+    keys, lower = ride_id_keys(ride_ids)
+    rides = _rides(ride_ids).assign(ride_id=keys, **{RIDE_ID_LOWER: lower})
+    with StagedFileUpload(conn, "ride_data", copy_format) as upload:
+        upload.copy(rides)
+        upload.merge()
+
+    assert [row[0] for row in _stored(conn)] == sorted(ride_ids)
+
+
+def _upload_diff(conn, snapshots, df, aggregate_od=False):
+    # As processor.upload_output_obj does in diff mode.
+    diff = snapshots.diff("202405-citibike-tripdata.zip")
+    output = diff.filter_output({"trips.csv": df})
+    with StagedFileUpload(conn, "ride_data", aggregate_od=aggregate_od) as upload:
+        for frame in output.values():
+            upload.copy(frame)
+        upload.delete(diff.removed())
+        result = upload.merge()
+    diff.save()
+    return result
+
+
+def test_diff_deletes_removed_rows(conn, tmp_path):
+    snapshots = FileSnapshots(tmp_path)
+    _upload_diff(conn, snapshots, _rides(["A", "B", "C"]))
+
+    changed = _rides(["A", "B", "D"])
+    changed.loc[1, "h3_cell_start"] = "89283082807ffff"
+    result = _upload_diff(conn, snapshots, changed)
+
+    assert result["total_processed"] == 2
+    assert result["total_deleted"] == 1
+    assert _stored(conn) == [
+        ("A", "89283082803ffff", True),
+        ("B", "89283082807ffff", True),
+        ("D", "89283082803ffff", True),
+    ]
+
+
+def _od_mismatches(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT count(*)
+            FROM (
+                SELECT h3_cell_start, h3_cell_end,
+                       date_trunc('month', start_date)::date AS date_month,
+                       count(*)::integer AS count
+                FROM ride_data
+                GROUP BY 1, 2, 3
+            ) recount
+            FULL JOIN "citi-bike-monthly" m
+                USING (h3_cell_start, h3_cell_end, date_month)
+            WHERE recount.count IS DISTINCT FROM m.count
+            """)
+        return cur.fetchone()[0]
+
+
+def test_od_counts_follow_reuploads(conn, tmp_path):
+    with StagedFileUpload(conn, "ride_data", aggregate_od=True) as upload:
+        upload.copy(_rides(["A", "B"]))
+        # A ride repeated in a later chunk replaces its first copy.
+        upload.copy(_rides(["A"], cell="89283082807ffff"))
+        upload.merge()
+    assert _od_mismatches(conn) == 0
+
+    # Stored rides the upload overwrites are taken out of their old counts.
+    with StagedFileUpload(conn, "ride_data", aggregate_od=True) as upload:
+        upload.copy(_rides(["A", "B", "C"], cell="8928308280bffff"))
+        upload.merge()
+    assert _od_mismatches(conn) == 0
+
+    snapshots = FileSnapshots(tmp_path)
+    _upload_diff(conn, snapshots, _rides(["A", "B", "C"]), aggregate_od=True)
+    _upload_diff(conn, snapshots, _rides(["A", "D"]), aggregate_od=True)
+    assert _od_mismatches(conn) == 0
+    assert [row[0] for row in _stored(conn)] == ["A", "D"]
@@ -0,0 +1,151 @@
+import logging
+import os
+import re
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from geo_helpers import CELL_COLUMNS, cell_labels, is_integer_cells
+from ride_keys import with_ride_id_labels
+
+logger = logging.getLogger(__name__)
+
+
+def _pyarrow():
+    """Import pyarrow on first use; it is only needed when a store is configured."""
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "The Parquet trip store requires pyarrow (pip install pyarrow)"
+        ) from e
+    return pa, ds, pq
+
+
+class ParquetTripStore:
+    """
+    Local Parquet copy of processed trips, so reprocessing, re-aggregating or
+    reloading the database is a local scan instead of a refetch from S3.
+
+    The dataset is hive-partitioned as locale=<locale>/year=<yyyy>/month=<m>/,
+    with one or more files per source archive in each partition. Files are
+    named after the source archive, which is what lets a re-published archive
+    replace exactly its own rows.
+    """
+
+    def __init__(self, root, compression="zstd"):
+        _pyarrow()
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compression = compression
+
+    def write(self, df: pd.DataFrame, source_file: str, mode="append"):
+        """
+        Write a frame of trips from source_file.
+
+        mode="overwrite" first removes everything previously written for
+        source_file; "append" adds to it, e.g. for later chunks of a stream.
+        """
+        pa, _, pq = _pyarrow()
+        if mode == "overwrite":
+            self.remove_source(source_file)
+        elif mode != "append":
+            raise ValueError(f"Unknown write mode {mode}, expected append or overwrite")
+        if len(df) == 0:
+            return
+        # Cells and ride_ids are stored as strings, as in ride_data,
+        # whichever form the pipeline holds them in.
+        df = with_ride_id_labels(df)
+        labels = {
+            col: cell_labels(df[col])
+            for col in CELL_COLUMNS
+            if col in df.columns and is_integer_cells(df[col])
+        }
+        if labels:
+            df = df.assign(**labels)
+
+        months = pd.to_datetime(df["start_date"]).to_numpy().astype("datetime64[M]")
+        years = months.astype("datetime64[Y]").astype(np.int64) + 1970
+        month_numbers = months.astype(np.int64) % 12 + 1
+        prefix = _source_prefix(source_file)
+        for (locale, year, month), part in df.groupby(
+            [df["locale"].astype(str).to_numpy(), years, month_numbers],
+            sort=False,
+        ):
+            directory = (
+                self.root / f"locale={locale}" / f"year={year}" / f"month={month}"
+            )
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{prefix}.{uuid.uuid4().hex[:8]}.parquet"
+            table = pa.Table.from_pandas(
+                part.drop(columns=["locale"]), preserve_index=False
+            )
+            # start_date arrives as datetime64 or as dates; store date32 either
+            # way so every file in the dataset has the same schema.
+            if "start_date" in table.column_names:
+                i = table.column_names.index("start_date")
+                table = table.set_column(
+                    i, "start_date", table.column(i).cast(pa.date32())
+                )
+            # Write under a temporary name so readers never see a partial file.
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            pq.write_table(table, tmp_path, compression=self.compression)
+            os.replace(tmp_path, path)
+        logger.info(f"Stored {len(df)} trips from {source_file} in {self.root}")
+
+    def remove_source(self, source_file: str) -> int:
+        """Delete every file written for source_file. Returns the number removed."""
+        removed = 0
+        for path in self.root.glob(
+            f"locale=*/year=*/month=*/{_source_prefix(source_file)}.*.parquet"
+        ):
+            path.unlink()
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} stored files of {source_file}")
+        return removed
+
+    def dataset(self):
+        """The store as a pyarrow Dataset with locale/year/month partition columns."""
+        _, ds, _ = _pyarrow()
+        return ds.dataset(self.root, format="parquet", partitioning="hive")
+
+    def read(self, columns=None, filters=None) -> pd.DataFrame:
+        """
+        Read trips into a DataFrame.
+
+        filters use the pyarrow / pandas.read_parquet form, e.g.
+        [("locale", "=", "NYC"), ("year", "=", 2024), ("month", ">=", 6)].
+        Partition filters skip whole directories, and filters on stored
+        columns skip row groups by their statistics before anything is read.
+        """
+        return (
+            self.dataset()
+            .to_table(columns=columns, filter=self._expression(filters))
+            .to_pandas()
+        )
+
+    def iter_batches(self, columns=None, filters=None, batch_size=500_000):
+        """Yield DataFrames of up to batch_size trips, filtered as in read()."""
+        scanner = self.dataset().scanner(
+            columns=columns, filter=self._expression(filters), batch_size=batch_size
+        )
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    @staticmethod
+    def _expression(filters):
+        if not filters:
+            return None
+        _, _, pq = _pyarrow()
+        return pq.filters_to_expression(filters)
+
+
+def _source_prefix(source_file: str) -> str:
+    """Filesystem-safe stem of a source archive name, without dots."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", Path(source_file).name)
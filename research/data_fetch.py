@@ -1,39 +1,21 @@
-import pandas as pd
-from bs4 import BeautifulSoup
-import requests
-from datetime import datetime
-
-
-def parse_citibike_xml(xml_content):
-    soup = BeautifulSoup(xml_content, "xml")
-    contents = soup.find_all("Contents")
-    data = []
-
-    for content in contents:
-        key = content.find("Key").text
+import sys
+from pathlib import Path
 
-        # Skip non-data files and index.html
-        if not key.endswith(".zip") or key == "index.html":
-            continue
+import requests
 
-        # Extract data
-        row = {
-            "filename": key,
-            "last_modified": datetime.strptime(
-                content.find("LastModified").text, "%Y-%m-%dT%H:%M:%S.%fZ"
-            ),
-            "size_bytes": int(content.find("Size").text),
-            "storage_class": content.find("StorageClass").text,
-            "etag": content.find("ETag").text.strip('"'),
-        }
+# The bucket listing parser lives with the ingestion code.
+sys.path.append(str(Path(__file__).resolve().parent.parent / "ingestion"))
+from bucket_listing import BucketLister
 
-        # Calculate size in MB
-        row["size_mb"] = round(row["size_bytes"] / (1024 * 1024), 2)
 
-        data.append(row)
+def summarize_listing(df):
+    # Skip non-data files and index.html
+    df = df[df["file_name"].str.endswith(".zip")].rename(
+        columns={"file_name": "filename"}
+    )
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+    # Calculate size in MB
+    df["size_mb"] = (df["size_bytes"] / (1024 * 1024)).round(2)
 
     # Add year-month column for easier analysis
     df["year_month"] = df["filename"].apply(
@@ -48,9 +30,8 @@ def parse_citibike_xml(xml_content):
 
 def fetch_and_process_xml(url):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return parse_citibike_xml(response.content)
+        # Follows the listing past its first page of 1000 keys.
+        return summarize_listing(BucketLister(url).list_files())
     except requests.exceptions.RequestException as e:
         print(f"Error fetching XML: {e}")
         return None
@@ -59,7 +40,7 @@ def fetch_and_process_xml(url):
 # Example usage
 if __name__ == "__main__":
     # URL for the XML data
-    url = "https://s3.amazonaws.com/tripdata"
+    url = "https://s3.amazonaws.com/tripdata/"
 
     # Process the XML
     df = fetch_and_process_xml(url)
@@ -76,5 +57,3 @@ if __name__ == "__main__":
         # Display first few rows
         print("\nFirst few rows of the DataFrame:")
         print(df.head())
-
-
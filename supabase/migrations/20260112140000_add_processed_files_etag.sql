@@ -0,0 +1,6 @@
+-- Record the S3 ETag and size of each processed file so downloads can be
+-- cached per file version.
+
+ALTER TABLE "public"."processed_files"
+    ADD COLUMN IF NOT EXISTS "etag" "text",
+    ADD COLUMN IF NOT EXISTS "size_bytes" bigint;
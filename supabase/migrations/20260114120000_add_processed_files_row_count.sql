@@ -0,0 +1,5 @@
+-- Record how many rows each processed file produced, alongside its ETag and
+-- size, so the change manifest can tell what a reprocess replaced.
+
+ALTER TABLE "public"."processed_files"
+    ADD COLUMN IF NOT EXISTS "row_count" bigint;
@@ -0,0 +1,22 @@
+-- Progress through large files, so an interrupted run resumes from the
+-- first uncommitted chunk instead of reprocessing the whole archive. One row
+-- per CSV member (and per nested zip, and per file once complete) of the file
+-- version being processed.
+
+CREATE TABLE IF NOT EXISTS "public"."ingest_checkpoints" (
+    "file_name" "text" NOT NULL,
+    "locale" "text" NOT NULL,
+    "member" "text" NOT NULL,
+    "version" "text" NOT NULL,
+    "chunks" integer DEFAULT 0 NOT NULL,
+    "rows" bigint DEFAULT 0 NOT NULL,
+    "complete" boolean DEFAULT false NOT NULL,
+    "updated_at" timestamp with time zone DEFAULT "now"() NOT NULL,
+    CONSTRAINT "ingest_checkpoints_pkey" PRIMARY KEY ("file_name", "locale", "member")
+);
+
+ALTER TABLE "public"."ingest_checkpoints" OWNER TO "postgres";
+
+-- Written by the ingestion job over its direct connection only; no policies,
+-- so the table is not exposed through the API.
+ALTER TABLE "public"."ingest_checkpoints" ENABLE ROW LEVEL SECURITY;